@@ -3,7 +3,11 @@ import os
 import logging
 import json
 import re
+import math
 import datetime
+import hmac
+import time
+import threading
 import google.generativeai as genai
 import psycopg2
 import pandas as pd
@@ -11,6 +15,11 @@ from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS
 from dotenv import load_dotenv
 from decimal import Decimal
+from cachetools import TTLCache
+from admission import AdmissionController, Rejected, PRIORITY_CHEAP, PRIORITY_LLM
+from db_router import ReadRouter
+from slow_query_log import SlowQueryRecorder
+from narrative_batcher import NarrativeBatcher, EmptyNarrative, FakeModel
 
 # --- Configuration & Setup ---
 load_dotenv()
@@ -34,21 +43,28 @@ DEFINITIONS = {
     "kpi": "Key Performance Indicator - a measurable value demonstrating effectiveness.",
     "revenue anomaly": "A significant spike or drop in revenue compared to recent trends.",
     "high failure products": "Products with a notably high rate of refusal or delivery failure after shipping.",
-    "cancellation reasons": "The breakdown of stated reasons why orders were cancelled or failed delivery."
+    "cancellation reasons": "The breakdown of stated reasons why orders were cancelled or failed delivery.",
+    "attribution": "Crediting each order to the customer's last website visit (its traffic source or campaign) within a few days before ordering."
 }
 
 app = Flask(__name__)
 CORS(app, resources={r"/chat*": {"origins": "*"}})
 
 model = None
-try:
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key: raise ValueError("GEMINI_API_KEY not found.")
-    genai.configure(api_key=gemini_api_key)
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    logging.info("Gemini Model Loaded Successfully.")
-except Exception as e:
-    logging.error(f"Fatal Error Configuring Gemini: {e}.")
+# LLM_STUB=true answers narratives from a local fake model (no API key or network), for load tests and offline runs.
+LLM_STUB = os.getenv("LLM_STUB", "false").lower() in ("1", "true", "yes")
+if LLM_STUB:
+    model = FakeModel(overhead=float(os.getenv("LLM_STUB_LATENCY_MS", "300")) / 1000.0, max_concurrent=int(os.getenv("LLM_STUB_MAX_CONCURRENT", "4")))
+    logging.warning("LLM_STUB is set: narratives come from a local fake model, not Gemini.")
+else:
+    try:
+        gemini_api_key = os.getenv("GEMINI_API_KEY")
+        if not gemini_api_key: raise ValueError("GEMINI_API_KEY not found.")
+        genai.configure(api_key=gemini_api_key)
+        model = genai.GenerativeModel('gemini-1.5-flash')
+        logging.info("Gemini Model Loaded Successfully.")
+    except Exception as e:
+        logging.error(f"Fatal Error Configuring Gemini: {e}.")
 
 def get_db_connection():
     conn = None
@@ -87,6 +103,7 @@ def interpret_query_intent(query: str) -> tuple[str | None, dict]:
     help_kws = ["help", "what can you do", "capabilities", "commands", "info", "guide"]
     anomaly_kws = ["anomaly", "anomalies", "unusual", "spike", "drop", "significant change", "biggest change", "outlier"]
     solution_kws = ["solution", "solve", "fix", "improve", "address", "what can we do", "suggestion", "what to do about"]
+    channel_kws = ["channel", "campaign", "utm", "traffic source", "acquisition", "marketing", "referrer", "attribution"]
 
     # --- Intent Rules (Order matters - specific before general) ---
     if any(kw in query_lower for kw in help_kws): return "get_help", {}
@@ -137,6 +154,12 @@ def interpret_query_intent(query: str) -> tuple[str | None, dict]:
             else: logging.warning(f"Invalid countries for compare: '{country1_raw}','{country2_raw}'"); return None,{"error":f"Sorry, I can only compare countries within {', '.join(KNOWN_COUNTRIES)}."}
         elif any(kw in query_lower for kw in geo_kws): logging.warning("Geo compare kws matched, but countries not extracted."); return None,{"error":"Please specify two countries clearly (e.g., '...between Algeria and Egypt')."}
 
+    # --- Intent: Revenue / failure rate by acquisition channel or campaign (reads order_attribution) ---
+    if any(kw in query_lower for kw in channel_kws):
+        context['dimension'] = 'campaign' if any(kw in query_lower for kw in ["campaign", "utm"]) else 'channel'; context['period'] = 'last_90_days'; context['top_n'] = 10
+        [(context.update({'period':p_key}) if any(p in query_lower for p in phrases) else None) for p_key, phrases in time_periods.items() if any(p in query_lower for p in phrases)]
+        logging.info(f"Intent: get_channel_performance, Dimension: {context['dimension']}"); return "get_channel_performance", context
+
     # (Other intents: High Failure Products, Cancellation Reasons, Anomaly, Profit, Funnel, Revenue as before)
     if (any(kw in query_lower for kw in product_kws + failure_kws) and any(kw in query_lower for kw in shipping_kws + ["high", "worst", "often"])):
         context['period']='last_90_days'; context['threshold']=5; context['top_n']=5; [(context.update({'period':p_key}) if any(p in query_lower for p in phrases) else None) for p_key, phrases in time_periods.items() if any(p in query_lower for p in phrases)]; return "get_high_failure_products", context
@@ -153,55 +176,101 @@ def interpret_query_intent(query: str) -> tuple[str | None, dict]:
 
     logging.warning(f"Could not determine intent for query: '{query}'"); return None, {"error": "Intent not understood. Try asking 'help'."}
 
+# --- Period Filters ---
+# Upper bound on days between order placement and delivery/failure. Filters on delivered_at also bound
+# order_date by the same window widened by this lag, which lets PostgreSQL prune order partitions.
+MAX_FULFILMENT_DAYS = int(os.getenv("MAX_FULFILMENT_DAYS", "60"))
+# Set when the database was created from cod_schema_partitioned.sql (order_items carries order_date).
+PARTITIONED_SCHEMA = os.getenv("PARTITIONED_SCHEMA", "false").lower() in ("1", "true", "yes")
+# Set when cod_order_facts.sql is installed: geo, failure and funnel intents count rows of order_facts
+# (shipping city/country snapshotted per order) instead of joining orders to addresses.
+ORDER_FACTS = os.getenv("ORDER_FACTS", "false").lower() in ("1", "true", "yes")
+
+def get_period_bounds(period_key):
+    """Returns (lower, upper) SQL expressions for a period key; upper is None for open-ended windows."""
+    if period_key == 'last_quarter': return "DATE_TRUNC('quarter', CURRENT_DATE) - INTERVAL '3 months'", "DATE_TRUNC('quarter', CURRENT_DATE)"
+    elif period_key == 'this_month_mtd': return "DATE_TRUNC('month', CURRENT_DATE)", "CURRENT_DATE + INTERVAL '1 day'"
+    elif period_key == 'last_90_days': return "(CURRENT_DATE - INTERVAL '90 days')::date", None
+    elif period_key == 'last_30_days': return "(CURRENT_DATE - INTERVAL '30 days')::date", None
+    elif period_key == 'last_7_days': return "(CURRENT_DATE - INTERVAL '7 days')::date", "CURRENT_DATE + INTERVAL '1 day'"
+    elif period_key == 'year_to_date': return "DATE_TRUNC('year', CURRENT_DATE)", "CURRENT_DATE + INTERVAL '1 day'"
+    else: return "DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '1 month'", "DATE_TRUNC('month', CURRENT_DATE)"
+
+def get_date_filter(period_key, date_column='o.order_date', partition_column=None):
+    lower, upper = get_period_bounds(period_key)
+    date_filter = f"AND {date_column} >= {lower}" + (f" AND {date_column} < {upper}" if upper else "")
+    if partition_column: # An order is placed before it is delivered, and at most MAX_FULFILMENT_DAYS earlier.
+        date_filter += f" AND {partition_column} >= ({lower}) - INTERVAL '{MAX_FULFILMENT_DAYS} days'" + (f" AND {partition_column} < {upper}" if upper else "")
+    return date_filter
+
+def order_items_join(oi='oi', o='o'):
+    # Joining on the shared partition key as well lets the planner prune and pair co-located partitions.
+    condition = f"{oi}.order_id = {o}.order_id"
+    return condition + f" AND {oi}.order_date = {o}.order_date" if PARTITIONED_SCHEMA else condition
+
+# --- Read Routing ---
+# Intent queries go to a replica from DB_REPLICA_HOSTS when its lag fits the period, else to the primary,
+# with per-intent statement_timeout/work_mem (see db_router.py). Without replicas everything uses DB_HOST.
+READ_ROUTER = ReadRouter()
+# Intent queries slower than their threshold are kept for /admin/slow-queries and slow_queries.jsonl, with
+# sampled EXPLAIN ANALYZE plans (see slow_query_log.py).
+SLOW_QUERIES = SlowQueryRecorder(READ_ROUTER.reconnect)
+
 # --- Data Fetching (ALL INTENT LOGIC RESTORED) ---
-def fetch_data_for_intent(intent: str, context: dict) -> pd.DataFrame | dict | float | list | str | None:
+def fetch_data_for_intent(intent: str, context: dict, conn=None, prefer_primary=False) -> pd.DataFrame | dict | float | list | str | None:
     logging.info(f"Fetching data for intent: '{intent}', Context: {context}")
     if intent in ["get_help", "explain_term"]: return {}
 
-    conn = get_db_connection()
+    owns_conn = conn is None # Callers such as index_advisor.py pass their own (instrumented) connection.
+    db_target = 'primary'; retry_on_primary = False
+    if owns_conn:
+        try: conn, db_target = READ_ROUTER.connect(intent, context, prefer_primary); logging.info(f"Intent '{intent}' routed to {db_target}.")
+        except psycopg2.Error as db_err: logging.error(f"Database Connection Error: {db_err}"); conn = None
     if not conn: return {"error": "Database connection failed."}
 
     data_result = None; query = ""; params = ()
-    def get_date_filter(period_key, date_column='o.order_date'):
-        if period_key == 'last_quarter': return f"AND {date_column} >= DATE_TRUNC('quarter', CURRENT_DATE) - INTERVAL '3 months' AND {date_column} < DATE_TRUNC('quarter', CURRENT_DATE)"
-        elif period_key == 'this_month_mtd': return f"AND {date_column} >= DATE_TRUNC('month', CURRENT_DATE) AND {date_column} < CURRENT_DATE + INTERVAL '1 day'"
-        elif period_key == 'last_90_days': return f"AND {date_column} >= (CURRENT_DATE - INTERVAL '90 days')::date"
-        elif period_key == 'last_30_days': return f"AND {date_column} >= (CURRENT_DATE - INTERVAL '30 days')::date"
-        elif period_key == 'last_7_days': return f"AND {date_column} >= (CURRENT_DATE - INTERVAL '7 days')::date AND {date_column} < CURRENT_DATE + INTERVAL '1 day'"
-        elif period_key == 'year_to_date': return f"AND {date_column} >= DATE_TRUNC('year', CURRENT_DATE) AND {date_column} < CURRENT_DATE + INTERVAL '1 day'"
-        else: return f"AND {date_column} >= DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '1 month' AND {date_column} < DATE_TRUNC('month', CURRENT_DATE)"
-
     cursor = None
     try:
-        cursor = conn.cursor()
+        cursor = SLOW_QUERIES.cursor(conn, intent, db_target) if owns_conn else conn.cursor()
 
         if intent == "suggest_improvement_for_high_failure_city": # RESTORED
             city = context.get("city"); period = context.get("period", "last_90_days")
             if not city: return {"error": "City name not identified."}
-            date_filter = get_date_filter(period, 'o.order_date')
-            query_stats = f"SELECT COUNT(DISTINCT o.order_id) AS total_orders, COUNT(DISTINCT CASE WHEN o.order_status IN ('Refused Delivery', 'Delivery Failed', 'Cancelled by Customer', 'Cancelled by Admin') THEN o.order_id ELSE NULL END) AS failed_orders FROM public.orders o JOIN public.addresses a ON o.shipping_address_id = a.address_id WHERE a.city = %s {date_filter} AND a.country IS NOT NULL;"
+            if ORDER_FACTS:
+                date_filter = get_date_filter(period, 'f.order_date')
+                query_stats = f"SELECT COUNT(*) AS total_orders, COUNT(*) FILTER (WHERE f.is_failed) AS failed_orders FROM public.order_facts f WHERE f.shipping_city = %s {date_filter} AND f.shipping_country IS NOT NULL;"
+                query_reasons = f"SELECT f.cancellation_reason, COUNT(*) AS reason_count FROM public.order_facts f WHERE f.shipping_city = %s AND f.is_failed AND f.cancellation_reason IS NOT NULL {date_filter} GROUP BY f.cancellation_reason ORDER BY reason_count DESC LIMIT 3;"
+            else:
+                date_filter = get_date_filter(period, 'o.order_date')
+                query_stats = f"SELECT COUNT(DISTINCT o.order_id) AS total_orders, COUNT(DISTINCT CASE WHEN o.order_status IN ('Refused Delivery', 'Delivery Failed', 'Cancelled by Customer', 'Cancelled by Admin') THEN o.order_id ELSE NULL END) AS failed_orders FROM public.orders o JOIN public.addresses a ON o.shipping_address_id = a.address_id WHERE a.city = %s {date_filter} AND a.country IS NOT NULL;"
+                query_reasons = f"SELECT o.cancellation_reason, COUNT(DISTINCT o.order_id) AS reason_count FROM public.orders o JOIN public.addresses a ON o.shipping_address_id = a.address_id WHERE a.city = %s AND o.order_status IN ('Refused Delivery', 'Delivery Failed', 'Cancelled by Customer', 'Cancelled by Admin') AND o.cancellation_reason IS NOT NULL {date_filter} GROUP BY o.cancellation_reason ORDER BY reason_count DESC LIMIT 3;"
             cursor.execute(query_stats, (city,)); stats_result = cursor.fetchone()
             city_total_orders = int(stats_result[0]) if stats_result and stats_result[0] is not None else 0
             city_failed_orders = int(stats_result[1]) if stats_result and stats_result[1] is not None else 0
             city_failure_rate = (float(city_failed_orders) * 100.0 / float(city_total_orders)) if city_total_orders > 0 else 0.0
-            query_reasons = f"SELECT o.cancellation_reason, COUNT(DISTINCT o.order_id) AS reason_count FROM public.orders o JOIN public.addresses a ON o.shipping_address_id = a.address_id WHERE a.city = %s AND o.order_status IN ('Refused Delivery', 'Delivery Failed', 'Cancelled by Customer', 'Cancelled by Admin') AND o.cancellation_reason IS NOT NULL {date_filter} GROUP BY o.cancellation_reason ORDER BY reason_count DESC LIMIT 3;"
             cursor.execute(query_reasons, (city,)); reasons_results = cursor.fetchall(); top_reasons = []
             if reasons_results: colnames_reasons = [desc[0] for desc in cursor.description]; top_reasons = [dict(zip(colnames_reasons, row)) for row in reasons_results]; [r.update({'reason_count': int(r['reason_count'])}) for r in top_reasons]
             data_result = {"city": city, "total_orders": city_total_orders, "failed_orders": city_failed_orders, "failure_rate_percent": round(city_failure_rate, 1), "top_cancellation_reasons": top_reasons}
         
         elif intent == "get_delivered_revenue": # RESTORED (Example)
-            period = context.get('period', 'last_month'); date_filter = get_date_filter(period, 'delivered_at'); query = f"SELECT SUM(order_total) AS total_revenue FROM public.orders WHERE order_status = 'Delivered' {date_filter};"; cursor.execute(query); result = cursor.fetchone(); data_result = float(result[0]) if result and result[0] is not None else 0.0
+            period = context.get('period', 'last_month'); date_filter = get_date_filter(period, 'delivered_at', 'order_date'); query = f"SELECT SUM(order_total) AS total_revenue FROM public.orders WHERE order_status = 'Delivered' {date_filter};"; cursor.execute(query); result = cursor.fetchone(); data_result = float(result[0]) if result and result[0] is not None else 0.0
         
         elif intent == "get_gross_profit": # RESTORED
-            period = context.get('period', 'last_month'); date_filter = get_date_filter(period, 'o.delivered_at'); query = f""" SELECT SUM((oi.price_per_unit - COALESCE(oi.cost_per_unit, 0)) * oi.quantity) AS gross_profit FROM public.order_items oi JOIN public.orders o ON oi.order_id = o.order_id WHERE o.order_status = 'Delivered' {date_filter}; """; cursor.execute(query); result = cursor.fetchone(); data_result = float(result[0]) if result and result[0] is not None else 0.0
+            period = context.get('period', 'last_month'); date_filter = get_date_filter(period, 'o.delivered_at', 'o.order_date'); query = f""" SELECT SUM((oi.price_per_unit - COALESCE(oi.cost_per_unit, 0)) * oi.quantity) AS gross_profit FROM public.order_items oi JOIN public.orders o ON {order_items_join()} WHERE o.order_status = 'Delivered' {date_filter}; """; cursor.execute(query); result = cursor.fetchone(); data_result = float(result[0]) if result and result[0] is not None else 0.0
         
         elif intent == "get_cancellation_reasons": # RESTORED
-            period = context.get('period', 'last_90_days'); top_n = context.get('top_n', 7); date_filter = get_date_filter(period, 'order_date'); query = f""" SELECT cancellation_reason, COUNT(DISTINCT order_id) as reason_count FROM public.orders WHERE order_status IN ('Cancelled by Customer', 'Cancelled by Admin', 'Refused Delivery', 'Delivery Failed') AND cancellation_reason IS NOT NULL {date_filter} GROUP BY cancellation_reason ORDER BY reason_count DESC LIMIT %s; """; params = (top_n,); cursor.execute(query, params); results = cursor.fetchall()
+            period = context.get('period', 'last_90_days'); top_n = context.get('top_n', 7); date_filter = get_date_filter(period, 'order_date')
+            if ORDER_FACTS: query = f""" SELECT cancellation_reason, COUNT(*) as reason_count FROM public.order_facts WHERE is_failed AND cancellation_reason IS NOT NULL {date_filter} GROUP BY cancellation_reason ORDER BY reason_count DESC LIMIT %s; """
+            else: query = f""" SELECT cancellation_reason, COUNT(DISTINCT order_id) as reason_count FROM public.orders WHERE order_status IN ('Cancelled by Customer', 'Cancelled by Admin', 'Refused Delivery', 'Delivery Failed') AND cancellation_reason IS NOT NULL {date_filter} GROUP BY cancellation_reason ORDER BY reason_count DESC LIMIT %s; """
+            params = (top_n,); cursor.execute(query, params); results = cursor.fetchall()
             if results: colnames = [desc[0] for desc in cursor.description]; data_result = [dict(zip(colnames, row)) for row in results]; [r.update({'reason_count': int(r['reason_count'])}) for r in data_result]
             else: data_result = []
         
         elif intent == "explain_sales_funnel": # RESTORED
-             period = context.get('period', 'last_90_days'); date_interval = '30 days' if period == 'last_30_days' else ('7 days' if period == 'last_7_days' else '90 days'); query = f""" SELECT '1. Placed' AS stage, COUNT(DISTINCT order_id) AS order_count FROM public.orders WHERE order_date >= CURRENT_DATE - INTERVAL '{date_interval}' UNION ALL SELECT '2. Confirmed/Processing' AS stage, COUNT(DISTINCT order_id) AS order_count FROM public.orders WHERE order_date >= CURRENT_DATE - INTERVAL '{date_interval}' AND order_status NOT IN ('Pending Confirmation', 'Cancelled by Customer', 'Cancelled by Admin') UNION ALL SELECT '3. Shipped' AS stage, COUNT(DISTINCT order_id) AS order_count FROM public.orders WHERE order_date >= CURRENT_DATE - INTERVAL '{date_interval}' AND shipped_at IS NOT NULL AND order_status NOT IN ('Cancelled by Customer', 'Cancelled by Admin') UNION ALL SELECT '4. Delivered' AS stage, COUNT(DISTINCT order_id) AS order_count FROM public.orders WHERE order_date >= CURRENT_DATE - INTERVAL '{date_interval}' AND order_status = 'Delivered' ORDER BY stage ASC;"""; cursor.execute(query); results = cursor.fetchall();
+             period = context.get('period', 'last_90_days'); date_interval = '30 days' if period == 'last_30_days' else ('7 days' if period == 'last_7_days' else '90 days')
+             if ORDER_FACTS: query = f""" SELECT s.stage, s.order_count FROM (SELECT COUNT(*) AS placed, COUNT(*) FILTER (WHERE order_status NOT IN ('Pending Confirmation', 'Cancelled by Customer', 'Cancelled by Admin')) AS confirmed, COUNT(*) FILTER (WHERE shipped_at IS NOT NULL AND order_status NOT IN ('Cancelled by Customer', 'Cancelled by Admin')) AS shipped, COUNT(*) FILTER (WHERE order_status = 'Delivered') AS delivered FROM public.order_facts WHERE order_date >= CURRENT_DATE - INTERVAL '{date_interval}') c CROSS JOIN LATERAL (VALUES ('1. Placed', c.placed), ('2. Confirmed/Processing', c.confirmed), ('3. Shipped', c.shipped), ('4. Delivered', c.delivered)) AS s(stage, order_count) ORDER BY s.stage ASC;"""
+             else: query = f""" SELECT '1. Placed' AS stage, COUNT(DISTINCT order_id) AS order_count FROM public.orders WHERE order_date >= CURRENT_DATE - INTERVAL '{date_interval}' UNION ALL SELECT '2. Confirmed/Processing' AS stage, COUNT(DISTINCT order_id) AS order_count FROM public.orders WHERE order_date >= CURRENT_DATE - INTERVAL '{date_interval}' AND order_status NOT IN ('Pending Confirmation', 'Cancelled by Customer', 'Cancelled by Admin') UNION ALL SELECT '3. Shipped' AS stage, COUNT(DISTINCT order_id) AS order_count FROM public.orders WHERE order_date >= CURRENT_DATE - INTERVAL '{date_interval}' AND shipped_at IS NOT NULL AND order_status NOT IN ('Cancelled by Customer', 'Cancelled by Admin') UNION ALL SELECT '4. Delivered' AS stage, COUNT(DISTINCT order_id) AS order_count FROM public.orders WHERE order_date >= CURRENT_DATE - INTERVAL '{date_interval}' AND order_status = 'Delivered' ORDER BY stage ASC;"""
+             cursor.execute(query); results = cursor.fetchall();
              if results: colnames = [desc[0] for desc in cursor.description]; data_result = [dict(zip(colnames, row)) for row in results]; [r.update({'order_count': int(r['order_count'])}) for r in data_result]
              else: data_result = []
         
@@ -210,21 +279,27 @@ def fetch_data_for_intent(intent: str, context: dict) -> pd.DataFrame | dict | f
              logging.info(f"Geo Compare FETCH - Countries: {countries}, Period: {period}")
              if not countries or not isinstance(countries, list) or len(countries) != 2: logging.error(f"Geo Compare FETCH - Invalid 'countries': {countries}"); return {"error":"Internal error: Country data invalid."}
              if not all(isinstance(c, str) for c in countries): logging.error(f"Geo Compare FETCH - Non-string country name: {countries}"); return {"error": "Internal error: Country names invalid."}
-             date_filter = get_date_filter(period, 'o.order_date'); query = f""" SELECT a.country, COUNT(DISTINCT o.order_id) AS total_orders, COUNT(DISTINCT CASE WHEN o.order_status IN ('Cancelled by Customer', 'Cancelled by Admin', 'Refused Delivery', 'Delivery Failed') THEN o.order_id ELSE NULL END) AS failed_orders FROM public.orders o LEFT JOIN public.addresses a ON o.shipping_address_id = a.address_id WHERE a.country IN %s {date_filter} AND a.country IS NOT NULL GROUP BY a.country; """; params = (tuple(countries),); logging.info(f"Geo Compare FETCH - SQL: {query}, Params: {params}");
+             if ORDER_FACTS: date_filter = get_date_filter(period, 'f.order_date'); query = f""" SELECT f.shipping_country AS country, COUNT(*) AS total_orders, COUNT(*) FILTER (WHERE f.is_failed) AS failed_orders FROM public.order_facts f WHERE f.shipping_country IN %s {date_filter} GROUP BY f.shipping_country; """
+             else: date_filter = get_date_filter(period, 'o.order_date'); query = f""" SELECT a.country, COUNT(DISTINCT o.order_id) AS total_orders, COUNT(DISTINCT CASE WHEN o.order_status IN ('Cancelled by Customer', 'Cancelled by Admin', 'Refused Delivery', 'Delivery Failed') THEN o.order_id ELSE NULL END) AS failed_orders FROM public.orders o LEFT JOIN public.addresses a ON o.shipping_address_id = a.address_id WHERE a.country IN %s {date_filter} AND a.country IS NOT NULL GROUP BY a.country; """
+             params = (tuple(countries),); logging.info(f"Geo Compare FETCH - SQL: {query}, Params: {params}");
              cursor.execute(query, params); results = cursor.fetchall(); logging.info(f"Geo Compare FETCH - DB Results: {results}"); country_stats = {}
              if results: colnames = [desc[0] for desc in cursor.description]; [country_stats.update({r['country']: {"total": int(r['total_orders']), "failed": int(r['failed_orders']), "failure_rate": round((float(r['failed_orders'])*100.0/float(r['total_orders'])) if r['total_orders']>0 else 0.0, 1)}}) for r in map(lambda row: dict(zip(colnames, row)), results)]
              for c_name in countries: country_stats.setdefault(c_name, {"total": 0, "failed": 0, "failure_rate": 0.0})
              data_result = country_stats; logging.info(f"Geo Compare FETCH - Processed Stats: {data_result}")
         
         elif intent == "get_high_failure_products": # RESTORED
-             period = context.get('period', 'last_90_days'); threshold = context.get('threshold', 5); top_n = context.get('top_n', 5); date_interval = '30 days' if period == 'last_30_days' else ('7 days' if period == 'last_7_days' else '90 days'); query = f""" WITH PS AS ( SELECT oi.product_id, COUNT(DISTINCT o.order_id) AS ts, COUNT(DISTINCT CASE WHEN o.order_status IN ('Refused Delivery', 'Delivery Failed', 'Returned') THEN o.order_id ELSE NULL END) AS tfps FROM public.order_items oi JOIN public.orders o ON oi.order_id = o.order_id WHERE o.shipped_at IS NOT NULL AND o.order_date >= CURRENT_DATE - INTERVAL '{date_interval}' AND o.order_status NOT IN ('Cancelled by Customer', 'Cancelled by Admin') GROUP BY oi.product_id ) SELECT p.product_name, ps.ts, ps.tfps, CASE WHEN ps.ts=0 THEN 0.0 ELSE (ps.tfps::NUMERIC * 100.0 / ps.ts::NUMERIC) END AS frp FROM PS ps JOIN public.products p ON ps.product_id = p.product_id WHERE ps.ts >= %s ORDER BY frp DESC, tfps DESC LIMIT %s; """; params = (threshold, top_n); cursor.execute(query, params); results = cursor.fetchall()
+             period = context.get('period', 'last_90_days'); threshold = context.get('threshold', 5); top_n = context.get('top_n', 5); date_interval = '30 days' if period == 'last_30_days' else ('7 days' if period == 'last_7_days' else '90 days'); query = f""" WITH PS AS ( SELECT oi.product_id, COUNT(DISTINCT o.order_id) AS ts, COUNT(DISTINCT CASE WHEN o.order_status IN ('Refused Delivery', 'Delivery Failed', 'Returned') THEN o.order_id ELSE NULL END) AS tfps FROM public.order_items oi JOIN public.orders o ON {order_items_join()} WHERE o.shipped_at IS NOT NULL AND o.order_date >= CURRENT_DATE - INTERVAL '{date_interval}' AND o.order_status NOT IN ('Cancelled by Customer', 'Cancelled by Admin') GROUP BY oi.product_id ) SELECT p.product_name, ps.ts, ps.tfps, CASE WHEN ps.ts=0 THEN 0.0 ELSE (ps.tfps::NUMERIC * 100.0 / ps.ts::NUMERIC) END AS frp FROM PS ps JOIN public.products p ON ps.product_id = p.product_id WHERE ps.ts >= %s ORDER BY frp DESC, tfps DESC LIMIT %s; """; params = (threshold, top_n); cursor.execute(query, params); results = cursor.fetchall()
              if results: colnames = ['product_name', 'times_shipped', 'times_failed_post_ship', 'failure_rate_percent']; data_result = [dict(zip(colnames, [r[0], int(r[1]), int(r[2]), round(float(r[3]),1)])) for r in results]
              else: data_result = []
         
         elif intent == "find_revenue_anomaly": # RESTORED
-             period = context.get('period', 'last_90_days'); time_grain = context.get('time_grain', 'day'); date_interval = '30 days' if period == 'last_30_days' else ('7 days' if period == 'last_7_days' else '90 days'); query = f""" WITH TR AS (SELECT DATE_TRUNC(%s, delivered_at) AS tp, SUM(order_total) AS pr FROM public.orders WHERE order_status = 'Delivered' AND delivered_at >= CURRENT_DATE - INTERVAL '{date_interval}' GROUP BY tp), RL AS (SELECT tp, pr, LAG(pr, 1, 0.0) OVER (ORDER BY tp ASC) AS ppr FROM TR) SELECT TO_CHAR(tp, 'YYYY-MM-DD') AS ps, pr, ppr, (pr - ppr) AS rc FROM RL WHERE tp >= CURRENT_DATE - INTERVAL '{date_interval}' AND (pr IS NOT NULL AND ppr IS NOT NULL) ORDER BY ABS(pr - ppr) DESC LIMIT 5; """; params = (time_grain,); cursor.execute(query, params); results = cursor.fetchall()
+             period = context.get('period', 'last_90_days'); time_grain = context.get('time_grain', 'day'); date_interval = '30 days' if period == 'last_30_days' else ('7 days' if period == 'last_7_days' else '90 days'); query = f""" WITH TR AS (SELECT DATE_TRUNC(%s, delivered_at) AS tp, SUM(order_total) AS pr FROM public.orders WHERE order_status = 'Delivered' AND delivered_at >= CURRENT_DATE - INTERVAL '{date_interval}' AND order_date >= CURRENT_DATE - INTERVAL '{date_interval}' - INTERVAL '{MAX_FULFILMENT_DAYS} days' GROUP BY tp), RL AS (SELECT tp, pr, LAG(pr, 1, 0.0) OVER (ORDER BY tp ASC) AS ppr FROM TR) SELECT TO_CHAR(tp, 'YYYY-MM-DD') AS ps, pr, ppr, (pr - ppr) AS rc FROM RL WHERE tp >= CURRENT_DATE - INTERVAL '{date_interval}' AND (pr IS NOT NULL AND ppr IS NOT NULL) ORDER BY ABS(pr - ppr) DESC LIMIT 5; """; params = (time_grain,); cursor.execute(query, params); results = cursor.fetchall()
              if results: colnames = ['period_str','period_revenue','prev_period_revenue','revenue_change']; data_result = [dict(zip(colnames, [r[0], float(r[1]), float(r[2]), float(r[3])])) for r in results]
              else: data_result = []
+        elif intent == "get_channel_performance": # Answered from order_attribution (attribution_job.py), no session/order join
+             period = context.get('period', 'last_90_days'); top_n = context.get('top_n', 10); dimension = 'utm_campaign' if context.get('dimension') == 'campaign' else 'channel'; date_filter = get_date_filter(period, 'order_date')
+             query = f""" SELECT {dimension} AS segment, COUNT(*) AS total_orders, COUNT(*) FILTER (WHERE is_failed) AS failed_orders, COALESCE(SUM(order_total) FILTER (WHERE order_status = 'Delivered'), 0) AS delivered_revenue FROM public.order_attribution WHERE {dimension} IS NOT NULL {date_filter} GROUP BY {dimension} ORDER BY delivered_revenue DESC LIMIT %s; """; params = (top_n,); cursor.execute(query, params); results = cursor.fetchall()
+             data_result = [{"segment": r[0], "total_orders": int(r[1]), "failed_orders": int(r[2]), "failure_rate_percent": round(float(r[2]) * 100.0 / float(r[1]), 1) if r[1] else 0.0, "delivered_revenue": float(r[3])} for r in results]
         else:
             logging.warning(f"No data fetching logic defined for intent: {intent}")
             data_result = {"error": f"Analysis not implemented for '{intent}' yet."} # More specific error
@@ -232,25 +307,37 @@ def fetch_data_for_intent(intent: str, context: dict) -> pd.DataFrame | dict | f
         if not (isinstance(data_result, dict) and 'error' in data_result):
              log_snippet = str(data_result)[:250] + ('...' if len(str(data_result)) > 250 else ''); logging.info(f"Data fetched for '{intent}': {log_snippet}")
 
+    except psycopg2.extensions.QueryCanceledError as db_err: # the intent's statement_timeout
+        logging.error(f"Query for intent '{intent}' cancelled on {db_target}: {db_err}")
+        if conn: conn.rollback();
+        data_result = {"error": "the query took too long and was cancelled. Try a shorter period"}
     except psycopg2.Error as db_err:
         logging.error(f"Database query error for intent '{intent}': {db_err} --- SQL: {cursor.query if cursor and hasattr(cursor, 'query') else 'N/A'}")
-        if conn: conn.rollback();
+        if conn and not conn.closed: conn.rollback();
         data_result = {"error": "Database query failed."}
+        # A replica cancels queries that conflict with WAL replay (vacuum cleanup, locks), or drops the session
+        # when it sits idle in such a transaction; the primary has no such conflicts.
+        retry_on_primary = db_target != 'primary' and isinstance(db_err, psycopg2.OperationalError)
     except Exception as e:
         logging.exception(f"Unexpected error fetching data for intent '{intent}':")
         data_result = {"error": "Unexpected error fetching data."}
     finally:
         if cursor: cursor.close();
-        if conn: conn.close(); logging.info("DB connection closed (fetch_data).")
+        if conn and owns_conn: conn.close(); logging.info("DB connection closed (fetch_data).")
+    if retry_on_primary: logging.warning(f"Retrying intent '{intent}' on the primary after a replica error on {db_target}."); return fetch_data_for_intent(intent, context, prefer_primary=True)
     return data_result
 
 # --- Narrative Generation (Includes new intent prompt and refined others) ---
-def generate_narrative(intent: str, data: any, original_query: str, context: dict) -> str:
+NARRATIVE_PREAMBLE = "You are 'InsightBot', a BI assistant for a COD e-commerce business (PC Gaming Accessories, North Africa). Explain data insights clearly and concisely to a non-technical manager called Adel. Focus on the key takeaway and suggest areas for investigation or general types of solutions if applicable based on the data."
+# Concurrent narratives share LLM calls (one preamble, several prompts); see narrative_batcher.py.
+NARRATIVES = NarrativeBatcher(model, NARRATIVE_PREAMBLE) if model else None
+
+def generate_narrative(intent: str, data: any, original_query: str, context: dict, client_id: str = None) -> str:
     # --- PASTE THE FULL generate_narrative FUNCTION HERE ---
     # --- It should include the logic for ALL intents, including suggest_improvement_for_high_failure_city ---
     # --- and the refined prompts for existing intents asking Gemini for more insights/suggestions ---
     logging.info(f"Generating narrative for intent: '{intent}'")
-    if intent == "get_help": return ("I can provide insights on:\n*   **Delivered Revenue or Gross Profit:** Ask like 'What was delivered revenue last quarter?', 'gross profit last 7 days'\n*   **Sales Funnel:** 'Explain the sales funnel'\n*   **Failure Rate Comparison:** 'Compare failure rate between Algeria and Egypt'\n*   **Problem Products:** 'Which products have high failure rates after shipping?'\n*   **Cancellation Reasons:** 'Show cancellation reason breakdown'\n*   **Revenue Anomalies:** 'Any unusual revenue changes lately?'\n*   **Solutions for Problem Cities:** 'Improve delivery issues for Cairo'\n*   **Definitions:** 'What is AOV?', 'define COD'\n\n**Tips:** Specify time periods (last month, last 90 days, etc.) for better results.")
+    if intent == "get_help": return ("I can provide insights on:\n*   **Delivered Revenue or Gross Profit:** Ask like 'What was delivered revenue last quarter?', 'gross profit last 7 days'\n*   **Sales Funnel:** 'Explain the sales funnel'\n*   **Failure Rate Comparison:** 'Compare failure rate between Algeria and Egypt'\n*   **Problem Products:** 'Which products have high failure rates after shipping?'\n*   **Cancellation Reasons:** 'Show cancellation reason breakdown'\n*   **Revenue Anomalies:** 'Any unusual revenue changes lately?'\n*   **Solutions for Problem Cities:** 'Improve delivery issues for Cairo'\n*   **Channels & Campaigns:** 'Revenue and failure rate by channel last month', 'Which campaign performs best?'\n*   **Definitions:** 'What is AOV?', 'define COD'\n\n**Tips:** Specify time periods (last month, last 90 days, etc.) for better results.")
     if intent == "explain_term":
         term = context.get('term', '').lower(); definition = DEFINITIONS.get(term)
         if definition: return f"Okay, here's the definition for '{term}': {definition}"
@@ -261,7 +348,6 @@ def generate_narrative(intent: str, data: any, original_query: str, context: dic
 
     data_string_for_prompt = ""; prompt_instructions = ""
     try:
-        base_prompt = (f"You are 'InsightBot', a BI assistant for a COD e-commerce business (PC Gaming Accessories, North Africa). Explain data insights clearly and concisely to a non-technical manager called Adel. Focus on the key takeaway and suggest areas for investigation or general types of solutions if applicable based on the data.\n\nUser Query: '{original_query}'\n\nRelevant Data Summary:\n")
         if intent == "suggest_improvement_for_high_failure_city":
             if isinstance(data, dict) and "city" in data:
                 city=data['city']; rate=data['failure_rate_percent']; reasons=data['top_cancellation_reasons']; reason_summary = "\n".join([f"- {r['cancellation_reason']} ({r['reason_count']} orders)" for r in reasons]) if reasons else "No specific top reasons logged for this city in the period."
@@ -301,21 +387,59 @@ def generate_narrative(intent: str, data: any, original_query: str, context: dic
              if isinstance(data, list) and data: grain = context.get('time_grain', 'period'); period = context.get('period','').replace('_',' '); summary = [f"- {i['period_str']}: Change ${i['revenue_change']:,.2f} (Prev: ${i['prev_period_revenue']:,.2f}, Curr: ${i['period_revenue']:,.2f})" for i in data]; data_string_for_prompt = f"Largest {grain}ly revenue changes ({period}):\n" + "\n".join(summary); top = data[0]; change_dir = "increase" if top['revenue_change'] > 0 else "decrease"; prompt_instructions = (f"Describe the single biggest {grain}ly revenue anomaly ({period}). Mention date ({top['period_str']}), direction ({change_dir}), approx change (${abs(top['revenue_change']):,.0f}), and resulting revenue (${top['period_revenue']:,.0f}). Suggest 1-2 common business reasons for such a change (e.g., promotions, stock issues, external event).")
              elif isinstance(data, list) and not data: return f"Analyzed recent revenue but found no major {context.get('time_grain', 'period')}-over-{context.get('time_grain', 'period')} changes."
              else: raise TypeError("Revenue anomaly data invalid.")
+        elif intent == "get_channel_performance":
+             if isinstance(data, list) and data: period = context.get('period', '').replace('_', ' '); label = 'Campaign' if context.get('dimension') == 'campaign' else 'Channel'; rows = [f"- {i['segment']}: delivered revenue ${i['delivered_revenue']:,.2f}, {i['total_orders']} orders, failure rate {i['failure_rate_percent']:.1f}%" for i in data]; data_string_for_prompt = f"{label} performance for orders placed in {period} (last-touch session attribution):\n" + "\n".join(rows); prompt_instructions = (f"Compare {label.lower()}s by delivered revenue and failure rate ({period}). Name the strongest and the weakest {label.lower()}, point out any {label.lower()} whose failure rate stands out, and suggest where marketing spend or order verification deserves a closer look. 'Unattributed' means no website visit was recorded shortly before the order.")
+             elif isinstance(data, list) and not data: return f"No attributed orders found for {context.get('period', '').replace('_', ' ')}. Has the attribution job (attribution_job.py) been run?"
+             else: raise TypeError("Channel performance data invalid.")
         else: data_string_for_prompt = json.dumps(data, indent=2, default=str); prompt_instructions = "Briefly summarize this data."
 
-        final_prompt = f"{base_prompt}```json\n{data_string_for_prompt}\n```\n\nTask: {prompt_instructions}\n\nResponse:"
-        logging.info(f"\n--- Sending Prompt to Gemini ---\n{final_prompt}\n-----------------------------\n")
-        response = model.generate_content(final_prompt)
-        if response.parts:
-            narrative = response.text.strip(); logging.info(f"--- Received Narrative --- \n{narrative}\n--------------")
-            if len(narrative)<len(prompt_instructions)+30 and data_string_for_prompt.strip().split('\n')[0] in narrative.replace('\n',' ').replace('$','').replace(',',''):
-                 logging.warning("Gemini may have just repeated input data. Returning summary."); return f"Data Summary:\n{data_string_for_prompt}"
-            return narrative
-        else:
-            logging.warning(f"Gemini returned no content. Feedback: {response.prompt_feedback}"); safety_str = str(response.prompt_feedback.safety_ratings) if response.prompt_feedback else "N/A"; return f"Analysis engine provided no narrative. (Safety Feedback: {safety_str})"
+        # Answers are cached per (intent, context) and served to every query that parses to them, so the prompt
+        # carries the parsed request only: quoting this user's wording would leak into other users' answers.
+        item_prompt = f"Relevant Data Summary:\n```json\n{data_string_for_prompt}\n```\n\nTask: {prompt_instructions}"
+        logging.info(f"\n--- Sending Prompt to Gemini ---\n{item_prompt}\n-----------------------------\n")
+        try: narrative = NARRATIVES.generate(item_prompt, client_id)
+        except EmptyNarrative as empty: logging.warning(f"Gemini returned no content. Feedback: {empty.feedback}"); return f"Analysis engine provided no narrative. (Safety Feedback: {empty.feedback})"
+        logging.info(f"--- Received Narrative --- \n{narrative}\n--------------")
+        if len(narrative)<len(prompt_instructions)+30 and data_string_for_prompt.strip().split('\n')[0] in narrative.replace('\n',' ').replace('$','').replace(',',''):
+             logging.warning("Gemini may have just repeated input data. Returning summary."); return f"Data Summary:\n{data_string_for_prompt}"
+        return narrative
     except Exception as e:
         logging.exception(f"Error during narrative generation (intent: {intent}):"); return "Sorry, an internal error occurred generating the insight."
 
+# --- Admission Control & Answer Cache ---
+# Bounded concurrency/queue with per-client token buckets in front of the DB + LLM work (see admission.py).
+ADMISSION = AdmissionController(
+    max_concurrency=int(os.getenv("CHAT_MAX_CONCURRENCY", "4")), max_queue=int(os.getenv("CHAT_MAX_QUEUE", "16")),
+    rate_per_client=float(os.getenv("CHAT_RATE_PER_CLIENT", "1.0")), burst_per_client=int(os.getenv("CHAT_BURST_PER_CLIENT", "5")))
+CHAT_DEFAULT_TIMEOUT_SECONDS = float(os.getenv("CHAT_DEFAULT_TIMEOUT_SECONDS", "30"))
+CHAT_MIN_TIMEOUT_SECONDS = float(os.getenv("CHAT_MIN_TIMEOUT_SECONDS", "0.5"))
+CHEAP_INTENTS = {"get_help", "explain_term"}
+# Narratives for the same intent and context are reused for a few minutes; the data behind them moves slowly.
+ANSWER_CACHE = TTLCache(maxsize=int(os.getenv("ANSWER_CACHE_SIZE", "512")), ttl=int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "300")))
+ANSWER_CACHE_LOCK = threading.Lock()
+ANSWER_CACHE_STATS = {'hit': 0, 'miss': 0}
+
+# CHAT_RECORD_FILE=<path> appends every /chat query (arrival time, intent, client) as JSONL for load_harness.py replay.
+CHAT_RECORD_FILE = os.getenv("CHAT_RECORD_FILE")
+CHAT_RECORD_LOCK = threading.Lock()
+
+def record_chat_query(user_query, intent, client_id):
+    if not CHAT_RECORD_FILE: return
+    line = json.dumps({"ts": round(time.time(), 3), "query": user_query, "intent": intent, "client_id": client_id, "timeout_ms": request.headers.get('X-Client-Timeout-Ms')})
+    try:
+        with CHAT_RECORD_LOCK, open(CHAT_RECORD_FILE, 'a', encoding='utf-8') as f: f.write(line + "\n")
+    except OSError as e: logging.error(f"Could not record /chat query to {CHAT_RECORD_FILE}: {e}")
+
+def answer_cache_key(intent, context): return (intent, json.dumps(context, sort_keys=True, default=str))
+
+def client_deadline():
+    # Clients may announce how long they will wait (X-Client-Timeout-Ms); queued work past it is dropped.
+    # Non-numeric or non-finite values (nan would never expire and break EDF order) get the default.
+    try: timeout = float(request.headers.get('X-Client-Timeout-Ms', '')) / 1000.0
+    except ValueError: timeout = CHAT_DEFAULT_TIMEOUT_SECONDS
+    if not math.isfinite(timeout): timeout = CHAT_DEFAULT_TIMEOUT_SECONDS
+    return ADMISSION.clock() + min(max(timeout, CHAT_MIN_TIMEOUT_SECONDS), CHAT_DEFAULT_TIMEOUT_SECONDS)
+
 # --- Flask Routes ---
 @app.route('/chat', methods=['POST'])
 def chat_handler():
@@ -326,22 +450,58 @@ def chat_handler():
         user_query = user_data['query'].strip();
         if not user_query: return jsonify({"error": "Query empty."}), 400
         logging.info(f"Received query via /chat: '{user_query}'")
+        client_id = request.headers.get('X-Client-Id') or request.remote_addr or 'anonymous'
         intent, context = interpret_query_intent(user_query)
-        if not intent:
-            error_msg = context.get("error", "I didn't understand that. Try asking 'help'.")
-            response_text = f"Sorry, {error_msg}"; status_code = 200
-        elif intent == "get_help" or intent == "explain_term":
-             response_text = generate_narrative(intent, None, user_query, context); status_code = 200
-        else:
-            fetched_data = fetch_data_for_intent(intent, context)
-            response_text = generate_narrative(intent, fetched_data, user_query, context)
-            is_error_response = ("Error:" in response_text or ("Sorry," in response_text and ("unavailable" in response_text or "internal error" in response_text or "Database query failed" in response_text or "fetching data" in response_text or "definition" in response_text or "couldn't get data" in response_text)))
-            if is_error_response: status_code = 503 if "engine" in response_text else 500; logging.error(f"Responding with status {status_code} for query '{user_query}'. Response: {response_text}")
-            else: status_code = 200
+        record_chat_query(user_query, intent, client_id)
+        cache_key = answer_cache_key(intent, context) if intent and intent not in CHEAP_INTENTS else None
+        with ANSWER_CACHE_LOCK:
+            cached_response = ANSWER_CACHE.get(cache_key) if cache_key else None
+            if cache_key: ANSWER_CACHE_STATS['hit' if cached_response is not None else 'miss'] += 1
+        priority = PRIORITY_LLM if cache_key and cached_response is None else PRIORITY_CHEAP
+        try: ticket = ADMISSION.admit(client_id, priority, client_deadline())
+        except Rejected as rejected:
+            logging.warning(f"Shedding /chat request from '{client_id}' ({rejected.reason}); Retry-After {rejected.retry_after}s.")
+            return jsonify({"error": rejected.message}), rejected.status, {"Retry-After": str(rejected.retry_after)}
+        with ticket:
+            if not intent:
+                error_msg = context.get("error", "I didn't understand that. Try asking 'help'.")
+                response_text = f"Sorry, {error_msg}"; status_code = 200
+            elif intent == "get_help" or intent == "explain_term":
+                 response_text = generate_narrative(intent, None, user_query, context); status_code = 200
+            elif cached_response is not None:
+                 logging.info(f"Answer cache hit for intent '{intent}'."); response_text = cached_response; status_code = 200
+            else:
+                fetched_data = fetch_data_for_intent(intent, context)
+                response_text = generate_narrative(intent, fetched_data, user_query, context, client_id)
+                is_error_response = ("Error:" in response_text or ("Sorry," in response_text and ("unavailable" in response_text or "internal error" in response_text or "Database query failed" in response_text or "fetching data" in response_text or "definition" in response_text or "couldn't get data" in response_text)))
+                if is_error_response: status_code = 503 if "engine" in response_text else 500; logging.error(f"Responding with status {status_code} for query '{user_query}'. Response: {response_text}")
+                else:
+                    status_code = 200
+                    with ANSWER_CACHE_LOCK: ANSWER_CACHE[cache_key] = response_text
         return jsonify({"response": response_text}), status_code
     except Exception as e:
         logging.exception("Critical error in /chat handler:"); return jsonify({"error": "Internal server error."}), 500
 
+@app.route('/metrics')
+def metrics():
+    with ANSWER_CACHE_LOCK: cache_lines = [f'insightflow_answer_cache_total{{result="{k}"}} {v}' for k, v in ANSWER_CACHE_STATS.items()]
+    body = ADMISSION.prometheus_text() + READ_ROUTER.prometheus_text() + SLOW_QUERIES.prometheus_text() + (NARRATIVES.prometheus_text() if NARRATIVES else "") + "# TYPE insightflow_answer_cache_total counter\n" + "\n".join(cache_lines) + "\n"
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+def admin_allowed():
+    # With ADMIN_TOKEN set, admin routes need a matching X-Admin-Token header; without it, only local requests.
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if admin_token: return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token)
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/admin/slow-queries')
+def slow_queries():
+    if not admin_allowed(): return jsonify({"error": "Forbidden."}), 403
+    try: limit = int(request.args.get('limit', '50'))
+    except ValueError: return jsonify({"error": "Invalid 'limit'."}), 400
+    records = SLOW_QUERIES.snapshot(request.args.get('intent'), limit, include_plans=request.args.get('plans') == '1')
+    return jsonify({"count": len(records), "records": records})
+
 @app.route('/chat-interface')
 def chat_interface():
     try: return render_template('interface.html')
@@ -349,4 +509,4 @@ def chat_interface():
 
 # --- Main Execution ---
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5001, debug=False, threaded=True)
\ No newline at end of file
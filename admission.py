@@ -0,0 +1,149 @@
+import math
+import time
+import heapq
+import itertools
+import threading
+
+# Cheap answers (help, definitions, cached narratives) take no execution slot: they never wait behind
+# LLM-bound requests and are never refused for a full queue. They are still rate limited.
+PRIORITY_CHEAP = 0
+PRIORITY_LLM = 1
+SHED_REASONS = ('rate_limited', 'queue_full', 'deadline')
+IDLE_BUCKET_SECONDS = 600
+
+
+class Rejected(Exception):
+    """Raised by AdmissionController.admit(); carries the HTTP status and Retry-After seconds to send."""
+
+    def __init__(self, status, reason, retry_after, message):
+        super().__init__(message)
+        self.status = status; self.reason = reason; self.retry_after = retry_after; self.message = message
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate; self.burst = burst; self.tokens = float(burst); self.updated = now
+
+    def take(self, now):
+        """Takes one token; returns 0 on success, otherwise the seconds until a token is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate); self.updated = now
+        if self.tokens >= 1: self.tokens -= 1; return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Ticket:
+    """A granted execution slot; release it (or use it as a context manager) when the request is done."""
+
+    def __init__(self, controller, priority, started):
+        self.controller = controller; self.priority = priority; self.started = started; self.released = priority == PRIORITY_CHEAP
+
+    def release(self):
+        if not self.released: self.released = True; self.controller._release(self)
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.release()
+
+
+class AdmissionController:
+    """
+    Bounded admission for the /chat handler threads: per-client token buckets, at most max_concurrency
+    LLM-bound requests executing and at most max_queue waiting for a slot, served earliest deadline
+    first (max_queue=0 means no waiting at all). A waiting request whose deadline passes is dropped
+    instead of being run for a client that gave up.
+    """
+
+    def __init__(self, max_concurrency=4, max_queue=16, rate_per_client=1.0, burst_per_client=5, clock=time.monotonic):
+        self.max_concurrency = max_concurrency; self.max_queue = max_queue
+        self.rate_per_client = rate_per_client; self.burst_per_client = burst_per_client
+        self.clock = clock
+        self.cond = threading.Condition()
+        self.waiting = [] # heap of [deadline, seq, entry]
+        self.queued = 0; self.inflight = 0
+        self.seq = itertools.count()
+        self.buckets = {}
+        self.service_seconds = 2.0 # EWMA of slot hold time, for Retry-After estimates
+        self.shed = {reason: 0 for reason in SHED_REASONS}
+        self.admitted = {PRIORITY_CHEAP: 0, PRIORITY_LLM: 0}
+
+    # --- Rate limiting ---
+    def _take_token(self, client_id, now):
+        bucket = self.buckets.get(client_id)
+        if bucket is None:
+            if len(self.buckets) > 10_000: # forget clients idle long enough to have refilled anyway
+                self.buckets = {cid: b for cid, b in self.buckets.items() if now - b.updated < IDLE_BUCKET_SECONDS}
+            bucket = self.buckets[client_id] = TokenBucket(self.rate_per_client, self.burst_per_client, now)
+        return bucket.take(now)
+
+    # --- Queueing ---
+    def _retry_after_estimate(self):
+        return max(1, math.ceil(self.service_seconds * (self.queued + self.inflight) / self.max_concurrency))
+
+    def _dispatch(self, now):
+        # Called with the lock held: grant free slots to the best waiting entries, dropping expired ones.
+        granted_any = False
+        while self.waiting and self.inflight < self.max_concurrency:
+            deadline, _, entry = heapq.heappop(self.waiting)
+            if entry['state'] != 'waiting': continue
+            self.queued -= 1
+            if deadline <= now: entry['state'] = 'expired'; self.shed['deadline'] += 1; granted_any = True; continue
+            entry['state'] = 'granted'; self.inflight += 1; granted_any = True
+        if granted_any: self.cond.notify_all()
+
+    def admit(self, client_id, priority, deadline):
+        """
+        Blocks until the request may run and returns a Ticket, or raises Rejected (429 when the client is
+        over its rate, 503 when the queue is full or the deadline passes while waiting). deadline is an
+        absolute time on self.clock.
+        """
+        with self.cond:
+            now = self.clock()
+            wait = self._take_token(client_id, now)
+            if wait:
+                self.shed['rate_limited'] += 1
+                raise Rejected(429, 'rate_limited', max(1, math.ceil(wait)), "Too many requests; please slow down.")
+            if priority == PRIORITY_CHEAP:
+                self.admitted[priority] += 1
+                return Ticket(self, priority, now)
+            if not self.queued and self.inflight < self.max_concurrency: # a free slot and nobody ahead: run now
+                self.inflight += 1; self.admitted[priority] += 1
+                return Ticket(self, priority, now)
+            if self.queued >= self.max_queue:
+                self.shed['queue_full'] += 1
+                raise Rejected(503, 'queue_full', self._retry_after_estimate(), "The assistant is busy; please retry shortly.")
+            entry = {'state': 'waiting'}
+            heapq.heappush(self.waiting, [deadline, next(self.seq), entry]); self.queued += 1
+            self._dispatch(now)
+            while entry['state'] == 'waiting':
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    entry['state'] = 'expired'; self.queued -= 1; self.shed['deadline'] += 1 # lazily removed from the heap
+                    break
+                self.cond.wait(remaining)
+            if entry['state'] == 'expired':
+                raise Rejected(503, 'deadline', self._retry_after_estimate(), "The request timed out while waiting; please retry.")
+            self.admitted[priority] += 1
+            return Ticket(self, priority, self.clock())
+
+    def _release(self, ticket):
+        with self.cond:
+            now = self.clock()
+            self.inflight -= 1
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * (now - ticket.started)
+            self._dispatch(now)
+
+    # --- Metrics ---
+    def snapshot(self):
+        with self.cond:
+            return {'inflight': self.inflight, 'queued': self.queued, 'max_concurrency': self.max_concurrency, 'max_queue': self.max_queue,
+                    'service_seconds_ewma': round(self.service_seconds, 3), 'shed': dict(self.shed),
+                    'admitted': {'cheap': self.admitted[PRIORITY_CHEAP], 'llm': self.admitted[PRIORITY_LLM]}}
+
+    def prometheus_text(self):
+        s = self.snapshot()
+        lines = ["# HELP insightflow_chat_shed_total /chat requests rejected by admission control.", "# TYPE insightflow_chat_shed_total counter"]
+        lines += [f'insightflow_chat_shed_total{{reason="{reason}"}} {count}' for reason, count in s['shed'].items()]
+        lines += ["# HELP insightflow_chat_admitted_total /chat requests admitted, by priority class.", "# TYPE insightflow_chat_admitted_total counter"]
+        lines += [f'insightflow_chat_admitted_total{{priority="{p}"}} {count}' for p, count in s['admitted'].items()]
+        lines += ["# TYPE insightflow_chat_inflight gauge", f"insightflow_chat_inflight {s['inflight']}",
+                  "# TYPE insightflow_chat_queued gauge", f"insightflow_chat_queued {s['queued']}"]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,161 @@
+import os
+import io
+import csv
+import logging
+import argparse
+import datetime
+import psycopg2
+from dotenv import load_dotenv
+
+# --- Configuration ---
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ATTRIBUTION_LOOKBACK_DAYS = int(os.getenv("ATTRIBUTION_LOOKBACK_DAYS", "7"))
+# Incremental runs re-scan orders this far behind the newest attributed order to pick up late inserts.
+LATE_ORDER_GRACE = datetime.timedelta(days=1)
+FETCH_ROWS = 10_000
+BATCH_ROWS = 50_000
+UNATTRIBUTED = 'Unattributed'
+ATTRIBUTION_COLUMNS = ['order_id', 'order_date', 'customer_id', 'session_id', 'session_start', 'channel',
+                       'utm_campaign', 'utm_medium', 'order_status', 'order_total']
+
+
+def get_db_connection():
+    """Establishes a connection to the PostgreSQL database."""
+    try:
+        conn = psycopg2.connect(
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT")
+        )
+        return conn
+    except Exception as e:
+        logging.error(f"Database Connection Error: {e}")
+        return None
+
+def last_touch(orders, sessions, lookback):
+    """
+    Sort-merge of two streams ordered by (customer_id, time): orders (order_id, customer_id, order_date,
+    order_status, order_total) and sessions (session_id, customer_id, session_start, referrer_source,
+    utm_campaign, utm_medium). Yields one attribution row per order, crediting the customer's latest
+    session at or before order_date and no older than lookback. Orders without a customer come last.
+    """
+    sessions = iter(sessions)
+    session = next(sessions, None)
+    latest = None # latest session so far of the current order's customer
+    for order_id, customer_id, order_date, order_status, order_total in orders:
+        if customer_id is None:
+            yield (order_id, order_date, None, None, None, UNATTRIBUTED, None, None, order_status, order_total); continue
+        if latest and latest[1] != customer_id: latest = None
+        while session and (session[1], session[2]) <= (customer_id, order_date):
+            if session[1] == customer_id: latest = session
+            session = next(sessions, None)
+        if latest and latest[2] >= order_date - lookback:
+            session_id, _, session_start, referrer, utm_campaign, utm_medium = latest
+            yield (order_id, order_date, customer_id, session_id, session_start, referrer or 'Direct', utm_campaign, utm_medium, order_status, order_total)
+        else:
+            yield (order_id, order_date, customer_id, None, None, UNATTRIBUTED, None, None, order_status, order_total)
+
+def _write_batch(cur, rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cur.execute("TRUNCATE tmp_attribution")
+    cur.copy_expert(f"COPY tmp_attribution ({', '.join(ATTRIBUTION_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf)
+    columns = ', '.join(ATTRIBUTION_COLUMNS)
+    updates = ', '.join(f"{c} = EXCLUDED.{c}" for c in ATTRIBUTION_COLUMNS[1:])
+    cur.execute(f"""INSERT INTO public.order_attribution ({columns}) SELECT {columns} FROM tmp_attribution
+                    ON CONFLICT (order_id) DO UPDATE SET {updates}, attributed_at = CURRENT_TIMESTAMP""")
+
+def run_attribution(conn, lookback_days=ATTRIBUTION_LOOKBACK_DAYS, full=False):
+    """
+    Attributes orders not yet in order_attribution (all orders with full=True, or when the lookback
+    changed), then re-syncs status/total of attributed orders updated since the previous run.
+    Runs in one transaction; returns a stats dict.
+    """
+    lookback = datetime.timedelta(days=lookback_days)
+    stats = {'attributed': 0, 'matched': 0, 'status_resynced': 0}
+    with conn.cursor() as cur:
+        cur.execute("SELECT NOW()::timestamp")
+        run_started = cur.fetchone()[0]
+        cur.execute("SELECT lookback_days, last_run_at FROM public.attribution_state")
+        state = cur.fetchone()
+        if state and state[0] != lookback_days and not full:
+            logging.info(f"Lookback changed ({state[0]} -> {lookback_days} days); rebuilding all attributions.")
+            full = True
+        since = None
+        if full or not state:
+            cur.execute("TRUNCATE public.order_attribution")
+        else:
+            cur.execute("SELECT MAX(order_date) FROM public.order_attribution")
+            newest = cur.fetchone()[0]
+            since = newest - LATE_ORDER_GRACE if newest else None
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS tmp_attribution (LIKE public.order_attribution INCLUDING DEFAULTS) ON COMMIT DROP")
+
+    # Both streams arrive sorted by (customer, time) from server-side cursors, so memory stays at
+    # FETCH_ROWS + BATCH_ROWS rows whatever the table sizes.
+    orders = conn.cursor(name='attribution_orders'); orders.itersize = FETCH_ROWS
+    orders.execute(
+        """SELECT o.order_id, o.customer_id, o.order_date, o.order_status, o.order_total FROM public.orders o
+           WHERE (%(since)s::timestamp IS NULL OR o.order_date >= %(since)s)
+             AND NOT EXISTS (SELECT 1 FROM public.order_attribution a WHERE a.order_id = o.order_id)
+           ORDER BY o.customer_id NULLS LAST, o.order_date, o.order_id""",
+        {'since': since}
+    )
+    sessions = conn.cursor(name='attribution_sessions'); sessions.itersize = FETCH_ROWS
+    sessions.execute(
+        """SELECT s.session_id, s.customer_id, s.session_start, s.referrer_source, s.utm_campaign, s.utm_medium FROM public.web_sessions s
+           WHERE s.customer_id IS NOT NULL AND (%(since)s::timestamp IS NULL OR s.session_start >= %(since)s::timestamp - %(lookback)s)
+           ORDER BY s.customer_id, s.session_start, s.session_id""",
+        {'since': since, 'lookback': lookback}
+    )
+    with conn.cursor() as cur:
+        batch = []
+        for row in last_touch(orders, sessions, lookback):
+            batch.append(row)
+            if row[3] is not None: stats['matched'] += 1
+            if len(batch) >= BATCH_ROWS:
+                _write_batch(cur, batch); stats['attributed'] += len(batch); batch = []
+        if batch: _write_batch(cur, batch); stats['attributed'] += len(batch)
+        orders.close(); sessions.close()
+
+        if state and not full:
+            cur.execute(
+                """UPDATE public.order_attribution a SET order_status = o.order_status, order_total = o.order_total, attributed_at = CURRENT_TIMESTAMP
+                   FROM public.orders o
+                   WHERE o.order_id = a.order_id AND o.last_updated_at >= %s
+                     AND (a.order_status, a.order_total) IS DISTINCT FROM (o.order_status, o.order_total)""",
+                (state[1],)
+            )
+            stats['status_resynced'] = cur.rowcount
+        cur.execute(
+            """INSERT INTO public.attribution_state (singleton, lookback_days, last_run_at) VALUES (TRUE, %s, %s)
+               ON CONFLICT (singleton) DO UPDATE SET lookback_days = EXCLUDED.lookback_days, last_run_at = EXCLUDED.last_run_at""",
+            (lookback_days, run_started)
+        )
+        if stats['attributed'] > BATCH_ROWS: cur.execute("ANALYZE public.order_attribution")
+    conn.commit()
+    return stats
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Attribute orders to their last web session within a lookback window (incremental).")
+    parser.add_argument('--lookback-days', type=int, default=ATTRIBUTION_LOOKBACK_DAYS, help=f"Session lookback before each order (default: {ATTRIBUTION_LOOKBACK_DAYS}, env ATTRIBUTION_LOOKBACK_DAYS)")
+    parser.add_argument('--full', action='store_true', help="Rebuild order_attribution from scratch")
+    args = parser.parse_args()
+
+    start_time = datetime.datetime.now()
+    conn = get_db_connection()
+    if not conn: raise SystemExit("Could not establish database connection.")
+    try:
+        stats = run_attribution(conn, args.lookback_days, args.full)
+        share = f"{stats['matched'] * 100.0 / stats['attributed']:.1f}%" if stats['attributed'] else "n/a"
+        logging.info(f"Attribution finished in {datetime.datetime.now() - start_time}: {stats['attributed']} orders attributed ({share} matched a session), {stats['status_resynced']} statuses re-synced.")
+    except Exception:
+        conn.rollback(); raise
+    finally:
+        conn.close()
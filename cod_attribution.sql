@@ -0,0 +1,41 @@
+-- ====================================================================
+-- InsightFlow Session-to-Order Attribution (PostgreSQL 13+)
+-- ====================================================================
+-- Last-touch attribution: each order is credited to its customer's latest web session that
+-- started at or before the order and within the lookback window. Filled by attribution_job.py
+-- (incremental sort-merge over sessions and orders per customer); the chatbot's channel intent
+-- reads only this table. Works on top of cod_schema_partitioned.sql or a monolithic PostgreSQL
+-- schema. Re-runnable.
+
+CREATE TABLE IF NOT EXISTS order_attribution (
+order_id BIGINT PRIMARY KEY,
+order_date TIMESTAMP NOT NULL,
+customer_id BIGINT,
+session_id BIGINT,
+session_start TIMESTAMP,
+channel VARCHAR(255) NOT NULL,
+utm_campaign VARCHAR(100),
+utm_medium VARCHAR(100),
+order_status VARCHAR(50) NOT NULL,
+is_failed BOOLEAN GENERATED ALWAYS AS (order_status IN ('Cancelled by Customer', 'Cancelled by Admin', 'Refused Delivery', 'Delivery Failed')) STORED,
+order_total NUMERIC(12, 2),
+attributed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON TABLE order_attribution IS 'One row per order: the web session (referrer, campaign) it is attributed to, last-touch within the lookback window.';
+COMMENT ON COLUMN order_attribution.channel IS 'referrer_source of the attributed session (''Direct'' when empty); ''Unattributed'' when no session qualified.';
+COMMENT ON COLUMN order_attribution.order_status IS 'Copied from orders; re-synced for orders updated since the previous job run.';
+
+CREATE TABLE IF NOT EXISTS attribution_state (
+singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+lookback_days INTEGER NOT NULL,
+last_run_at TIMESTAMP NOT NULL
+);
+COMMENT ON TABLE attribution_state IS 'Watermark of attribution_job.py: start time and lookback of the last successful run.';
+
+CREATE INDEX IF NOT EXISTS idx_order_attribution_date ON order_attribution (order_date)
+    INCLUDE (channel, order_status, order_total, is_failed);
+CREATE INDEX IF NOT EXISTS idx_order_attribution_campaign_date ON order_attribution (utm_campaign, order_date)
+    INCLUDE (order_status, order_total, is_failed) WHERE utm_campaign IS NOT NULL;
+
+-- Lets each run find orders whose status changed since the previous one.
+CREATE INDEX IF NOT EXISTS idx_orders_last_updated_at ON orders (last_updated_at);
@@ -0,0 +1,141 @@
+-- ====================================================================
+-- InsightFlow Order Facts (PostgreSQL 13+)
+-- ====================================================================
+-- One denormalized row per order for the geo and failure intents: lifecycle status and
+-- timestamps, totals, item count / units / COGS, and the shipping city and country snapshotted
+-- when the order is placed (later address edits do not rewrite history). Works on top of
+-- cod_schema_partitioned.sql or a monolithic PostgreSQL schema. Re-runnable.
+--
+-- Kept in sync by statement-level triggers on orders and order_items (one refresh per statement,
+-- not per row). psycopg2's executemany sends one statement per row, so writers insert items with
+-- a multi-row INSERT (execute_values) or COPY; large loads are better done with the triggers
+-- bypassed (dataset_loader.py --trusted) followed by one refresh_order_facts(), which also
+-- serves as the incremental refresher for repairs:
+--   SELECT refresh_order_facts();                                   -- full backfill
+--   SELECT refresh_order_facts(NOW() - INTERVAL '1 day');           -- orders touched since
+-- Set ORDER_FACTS=true in .env so the chatbot reads from this table.
+
+CREATE TABLE IF NOT EXISTS order_facts (
+order_id BIGINT PRIMARY KEY,
+customer_id BIGINT,
+order_date TIMESTAMP NOT NULL,
+order_status VARCHAR(50) NOT NULL,
+is_failed BOOLEAN GENERATED ALWAYS AS (order_status IN ('Cancelled by Customer', 'Cancelled by Admin', 'Refused Delivery', 'Delivery Failed')) STORED,
+shipped_at TIMESTAMP,
+delivered_at TIMESTAMP,
+cancelled_at TIMESTAMP,
+cancellation_reason TEXT,
+order_total NUMERIC(12, 2),
+item_count INTEGER NOT NULL DEFAULT 0,
+units INTEGER NOT NULL DEFAULT 0,
+cogs NUMERIC(14, 2) NOT NULL DEFAULT 0,
+shipping_address_id BIGINT,
+shipping_city VARCHAR(100),
+shipping_country VARCHAR(100),
+refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON TABLE order_facts IS 'Denormalized one-row-per-order fact table maintained from orders, order_items and addresses.';
+COMMENT ON COLUMN order_facts.is_failed IS 'Cancelled, refused or failed delivery (the chatbot''s failure rate numerator).';
+COMMENT ON COLUMN order_facts.cogs IS 'SUM(cost_per_unit * quantity) over the order''s items.';
+COMMENT ON COLUMN order_facts.shipping_city IS 'Shipping city as it was when the order was placed (or its address last changed).';
+
+CREATE INDEX IF NOT EXISTS idx_order_facts_country_date ON order_facts (shipping_country, order_date) INCLUDE (is_failed);
+CREATE INDEX IF NOT EXISTS idx_order_facts_city_date ON order_facts (shipping_city, order_date) INCLUDE (is_failed, cancellation_reason);
+CREATE INDEX IF NOT EXISTS idx_order_facts_order_date ON order_facts (order_date) INCLUDE (order_status, shipped_at, is_failed, cancellation_reason);
+
+-- ====================================================================
+-- Refresh
+-- ====================================================================
+-- Recomputes the facts of the given orders from the base tables; orders that no longer exist
+-- lose their fact row. Returns the number of rows upserted.
+CREATE OR REPLACE FUNCTION upsert_order_facts(p_order_ids BIGINT[]) RETURNS INTEGER AS $$
+DECLARE
+    v_rows INTEGER;
+BEGIN
+    DELETE FROM order_facts f
+    WHERE f.order_id = ANY(p_order_ids) AND NOT EXISTS (SELECT 1 FROM orders o WHERE o.order_id = f.order_id);
+
+    WITH ids AS (SELECT DISTINCT order_id FROM unnest(p_order_ids) AS t(order_id)),
+    items AS (
+        SELECT oi.order_id, COUNT(*) AS item_count, SUM(oi.quantity) AS units,
+               SUM(COALESCE(oi.cost_per_unit, 0) * oi.quantity) AS cogs
+        FROM order_items oi JOIN ids USING (order_id)
+        GROUP BY oi.order_id
+    )
+    INSERT INTO order_facts AS f (order_id, customer_id, order_date, order_status, shipped_at, delivered_at, cancelled_at,
+                                  cancellation_reason, order_total, item_count, units, cogs,
+                                  shipping_address_id, shipping_city, shipping_country, refreshed_at)
+    SELECT o.order_id, o.customer_id, o.order_date, o.order_status, o.shipped_at, o.delivered_at, o.cancelled_at,
+           o.cancellation_reason, o.order_total, COALESCE(i.item_count, 0), COALESCE(i.units, 0), COALESCE(i.cogs, 0),
+           o.shipping_address_id, a.city, a.country, CURRENT_TIMESTAMP
+    FROM ids JOIN orders o USING (order_id)
+    LEFT JOIN items i USING (order_id)
+    LEFT JOIN addresses a ON a.address_id = o.shipping_address_id
+    ON CONFLICT (order_id) DO UPDATE SET
+        customer_id = EXCLUDED.customer_id, order_date = EXCLUDED.order_date, order_status = EXCLUDED.order_status,
+        shipped_at = EXCLUDED.shipped_at, delivered_at = EXCLUDED.delivered_at, cancelled_at = EXCLUDED.cancelled_at,
+        cancellation_reason = EXCLUDED.cancellation_reason, order_total = EXCLUDED.order_total,
+        item_count = EXCLUDED.item_count, units = EXCLUDED.units, cogs = EXCLUDED.cogs,
+        -- Geography is a snapshot: only re-read when the order is pointed at a different address.
+        shipping_city = CASE WHEN f.shipping_address_id IS DISTINCT FROM EXCLUDED.shipping_address_id THEN EXCLUDED.shipping_city ELSE f.shipping_city END,
+        shipping_country = CASE WHEN f.shipping_address_id IS DISTINCT FROM EXCLUDED.shipping_address_id THEN EXCLUDED.shipping_country ELSE f.shipping_country END,
+        shipping_address_id = EXCLUDED.shipping_address_id,
+        refreshed_at = EXCLUDED.refreshed_at;
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Incremental refresher: orders whose last_updated_at is at or after p_since (all orders when NULL),
+-- plus orders that have no fact row yet.
+CREATE OR REPLACE FUNCTION refresh_order_facts(p_since TIMESTAMP DEFAULT NULL) RETURNS INTEGER AS $$
+BEGIN
+    RETURN upsert_order_facts(ARRAY(
+        SELECT o.order_id FROM orders o
+        WHERE p_since IS NULL OR o.last_updated_at >= p_since
+           OR NOT EXISTS (SELECT 1 FROM order_facts f WHERE f.order_id = o.order_id)
+    ));
+END;
+$$ LANGUAGE plpgsql;
+
+-- ====================================================================
+-- Sync Triggers
+-- ====================================================================
+-- Transition tables allow a single event per trigger, hence one trigger per event below.
+CREATE OR REPLACE FUNCTION trg_order_facts_new_rows() RETURNS trigger AS $$
+BEGIN
+    PERFORM upsert_order_facts(ARRAY(SELECT order_id FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_order_facts_old_rows() RETURNS trigger AS $$
+BEGIN
+    PERFORM upsert_order_facts(ARRAY(SELECT order_id FROM old_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_order_facts_orders_ins ON orders;
+CREATE TRIGGER trg_order_facts_orders_ins AFTER INSERT ON orders
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION trg_order_facts_new_rows();
+DROP TRIGGER IF EXISTS trg_order_facts_orders_upd ON orders;
+CREATE TRIGGER trg_order_facts_orders_upd AFTER UPDATE ON orders
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION trg_order_facts_new_rows();
+DROP TRIGGER IF EXISTS trg_order_facts_orders_del ON orders;
+CREATE TRIGGER trg_order_facts_orders_del AFTER DELETE ON orders
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION trg_order_facts_old_rows();
+
+DROP TRIGGER IF EXISTS trg_order_facts_items_ins ON order_items;
+CREATE TRIGGER trg_order_facts_items_ins AFTER INSERT ON order_items
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION trg_order_facts_new_rows();
+DROP TRIGGER IF EXISTS trg_order_facts_items_upd ON order_items;
+CREATE TRIGGER trg_order_facts_items_upd AFTER UPDATE ON order_items
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION trg_order_facts_new_rows();
+DROP TRIGGER IF EXISTS trg_order_facts_items_del ON order_items;
+CREATE TRIGGER trg_order_facts_items_del AFTER DELETE ON order_items
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION trg_order_facts_old_rows();
+
+-- Backfill existing orders.
+SELECT refresh_order_facts();
+ANALYZE order_facts;
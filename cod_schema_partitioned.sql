@@ -0,0 +1,240 @@
+-- ====================================================================
+-- InsightFlow COD E-commerce Database Schema Setup (Native PostgreSQL 13+, Partitioned)
+-- ====================================================================
+-- Same tables and columns as cod_schema_setup.sql, in PostgreSQL dialect, with the heavy
+-- tables split into monthly range partitions:
+--   orders        PARTITION BY RANGE (order_date)
+--   order_items   PARTITION BY RANGE (order_date)   -- carries its order's order_date, co-located
+--   web_sessions  PARTITION BY RANGE (session_start)
+-- Primary keys, unique constraints and foreign keys into partitioned tables must include the
+-- partition key, hence (order_id, order_date) and (order_ref, order_date).
+-- Partitions are created by ensure_monthly_partitions(); see partition_maintenance.py.
+
+-- Categories Table
+CREATE TABLE categories (
+category_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+category_name VARCHAR(100) NOT NULL UNIQUE,
+description TEXT
+);
+COMMENT ON TABLE categories IS 'Stores product categories like Electronics, Clothing, etc.';
+COMMENT ON COLUMN categories.category_id IS 'Unique identifier for the category.';
+COMMENT ON COLUMN categories.category_name IS 'Human-readable name of the category.';
+
+-- Products Table
+CREATE TABLE products (
+product_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+product_name VARCHAR(255) NOT NULL,
+category_id BIGINT REFERENCES categories(category_id) ON DELETE SET NULL,
+unit_price NUMERIC(10, 2) NOT NULL CHECK (unit_price >= 0),
+unit_cost NUMERIC(10, 2) CHECK (unit_cost >= 0),
+sku VARCHAR(100) UNIQUE,
+description TEXT,
+is_active BOOLEAN DEFAULT TRUE,
+created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON TABLE products IS 'Stores details about each product offered for sale.';
+COMMENT ON COLUMN products.category_id IS 'Foreign key linking to the categories table.';
+COMMENT ON COLUMN products.unit_cost IS 'The cost price of the product for the business.';
+COMMENT ON COLUMN products.is_active IS 'Flag indicating if the product is currently available for purchase.';
+
+-- Customers Table
+CREATE TABLE customers (
+customer_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+first_name VARCHAR(100),
+last_name VARCHAR(100),
+email VARCHAR(255) UNIQUE NOT NULL,
+phone VARCHAR(50) NOT NULL,
+signup_date DATE DEFAULT CURRENT_DATE,
+created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON TABLE customers IS 'Stores information about registered customers.';
+COMMENT ON COLUMN customers.phone IS 'Customer phone number, vital for COD operations.';
+COMMENT ON COLUMN customers.signup_date IS 'Date the customer registered.';
+
+-- Addresses Table
+CREATE TABLE addresses (
+address_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+customer_id BIGINT NOT NULL REFERENCES customers(customer_id) ON DELETE CASCADE,
+address_type VARCHAR(20) DEFAULT 'Shipping' CHECK (address_type IN ('Shipping', 'Billing')),
+street_address VARCHAR(255) NOT NULL,
+city VARCHAR(100) NOT NULL,
+state_province VARCHAR(100),
+postal_code VARCHAR(20) NOT NULL,
+country VARCHAR(100) NOT NULL,
+is_default BOOLEAN DEFAULT FALSE,
+created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON TABLE addresses IS 'Stores customer shipping and billing addresses. A customer can have multiple addresses.';
+COMMENT ON COLUMN addresses.customer_id IS 'Foreign key linking to the customers table. Addresses are deleted if customer is deleted.';
+COMMENT ON COLUMN addresses.is_default IS 'Indicates if this is the customer''s default address for the specified type.';
+
+-- Promotions Table
+CREATE TABLE promotions (
+promo_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+promo_code VARCHAR(50) UNIQUE NOT NULL,
+description TEXT,
+discount_type VARCHAR(20) CHECK (discount_type IN ('Percentage', 'Fixed Amount')),
+discount_value NUMERIC(10, 2) NOT NULL CHECK (discount_value >= 0),
+start_date DATE,
+end_date DATE,
+created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON TABLE promotions IS 'Stores details about promotional codes and discounts.';
+COMMENT ON COLUMN promotions.start_date IS 'Date when the promotion becomes valid (NULL for indefinite start).';
+COMMENT ON COLUMN promotions.end_date IS 'Date when the promotion expires (NULL for no expiry).';
+
+-- Orders Table (partitioned by month of order_date)
+CREATE TABLE orders (
+order_id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+order_ref VARCHAR(30),
+customer_id BIGINT REFERENCES customers(customer_id) ON DELETE SET NULL,
+order_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+order_status VARCHAR(50) NOT NULL CHECK (order_status IN (
+'Pending Confirmation', 'Processing', 'Shipped', 'Out for Delivery', 'Delivered',
+'Cancelled by Customer', 'Cancelled by Admin', 'Refused Delivery', 'Delivery Failed', 'Returned'
+)),
+shipped_at TIMESTAMP,
+delivered_at TIMESTAMP,
+cancelled_at TIMESTAMP,
+last_updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+cancellation_reason TEXT,
+subtotal NUMERIC(12, 2) NOT NULL CHECK (subtotal >= 0),
+discount_amount NUMERIC(12, 2) DEFAULT 0 CHECK (discount_amount >= 0),
+shipping_cost NUMERIC(10, 2) DEFAULT 0 CHECK (shipping_cost >= 0),
+tax_amount NUMERIC(10, 2) DEFAULT 0 CHECK (tax_amount >= 0),
+order_total NUMERIC(12, 2) NOT NULL CHECK (order_total >= 0),
+shipping_address_id BIGINT NOT NULL REFERENCES addresses(address_id),
+billing_address_id BIGINT REFERENCES addresses(address_id) ON DELETE SET NULL,
+promo_id BIGINT REFERENCES promotions(promo_id) ON DELETE SET NULL,
+notes TEXT,
+PRIMARY KEY (order_id, order_date),
+UNIQUE (order_ref, order_date)
+) PARTITION BY RANGE (order_date);
+COMMENT ON TABLE orders IS 'Central transaction table, tracking COD order lifecycle and financials. Monthly partitions on order_date.';
+COMMENT ON COLUMN orders.order_status IS 'Current stage of the order in the COD process.';
+COMMENT ON COLUMN orders.shipped_at IS 'Timestamp when the order was handed to courier.';
+COMMENT ON COLUMN orders.delivered_at IS 'Timestamp when the order was successfully delivered and paid.';
+COMMENT ON COLUMN orders.cancelled_at IS 'Timestamp when order was cancelled or final delivery failed.';
+COMMENT ON COLUMN orders.cancellation_reason IS 'Reason for order cancellation or failure.';
+COMMENT ON COLUMN orders.order_total IS 'Final COD amount due at delivery.';
+
+-- Order Items Table (co-located with orders: same partition key and bounds)
+CREATE TABLE order_items (
+order_item_id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+order_id BIGINT NOT NULL,
+order_date TIMESTAMP NOT NULL,
+product_id BIGINT NOT NULL REFERENCES products(product_id),
+quantity INTEGER NOT NULL CHECK (quantity > 0),
+price_per_unit NUMERIC(10, 2) NOT NULL CHECK (price_per_unit >= 0),
+cost_per_unit NUMERIC(10, 2),
+item_total NUMERIC(12, 2),
+PRIMARY KEY (order_item_id, order_date),
+FOREIGN KEY (order_id, order_date) REFERENCES orders(order_id, order_date) ON DELETE CASCADE
+) PARTITION BY RANGE (order_date);
+COMMENT ON TABLE order_items IS 'Junction table linking orders and products; details items within an order.';
+COMMENT ON COLUMN order_items.order_id IS 'Foreign key to orders. Items are deleted if parent order is deleted.';
+COMMENT ON COLUMN order_items.order_date IS 'Copy of the parent order''s order_date; partition key shared with orders.';
+COMMENT ON COLUMN order_items.product_id IS 'Foreign key to products. Prevents deleting a product if it is part of an order history.';
+COMMENT ON COLUMN order_items.price_per_unit IS 'Price of the product unit at the time of order placement.';
+COMMENT ON COLUMN order_items.cost_per_unit IS 'Cost of the product unit at the time of order placement for historical profit calculation.';
+COMMENT ON COLUMN order_items.item_total IS 'Total for this line item (quantity * price_per_unit).';
+
+-- Web Sessions Table (partitioned by month of session_start)
+CREATE TABLE web_sessions (
+session_id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+customer_id BIGINT REFERENCES customers(customer_id) ON DELETE SET NULL,
+session_start TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+session_end TIMESTAMP,
+ip_address VARCHAR(45),
+user_agent TEXT,
+referrer_source VARCHAR(255),
+utm_campaign VARCHAR(100),
+utm_medium VARCHAR(100),
+PRIMARY KEY (session_id, session_start)
+) PARTITION BY RANGE (session_start);
+COMMENT ON TABLE web_sessions IS 'Stores basic information about user visits to the website. Monthly partitions on session_start.';
+COMMENT ON COLUMN web_sessions.customer_id IS 'Links session to a logged-in customer, if known. Null for guest sessions.';
+
+-- ====================================================================
+-- Triggers (PL/pgSQL)
+-- ====================================================================
+
+CREATE OR REPLACE FUNCTION trg_order_items_total() RETURNS trigger AS $$
+BEGIN
+    NEW.item_total := NEW.quantity * NEW.price_per_unit;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_order_items_total
+BEFORE INSERT OR UPDATE ON order_items
+FOR EACH ROW EXECUTE FUNCTION trg_order_items_total();
+
+CREATE OR REPLACE FUNCTION set_order_ref() RETURNS trigger AS $$
+BEGIN
+    IF NEW.order_ref IS NULL THEN
+        NEW.order_ref := 'COD-' || TO_CHAR(NEW.order_date, 'YYYYMMDD') || '-' || NEW.order_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER set_order_ref
+BEFORE INSERT ON orders
+FOR EACH ROW EXECUTE FUNCTION set_order_ref();
+
+-- ====================================================================
+-- Partition Management
+-- ====================================================================
+-- Creates any missing monthly partitions of orders, order_items and web_sessions covering
+-- [p_from, p_to). Idempotent; returns the number of partitions created.
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(p_from DATE, p_to DATE) RETURNS INTEGER AS $$
+DECLARE
+    parent TEXT;
+    month_start DATE;
+    part_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['orders', 'order_items', 'web_sessions'] LOOP
+        month_start := DATE_TRUNC('month', p_from)::DATE;
+        WHILE month_start < p_to LOOP
+            part_name := parent || '_p' || TO_CHAR(month_start, 'YYYY_MM');
+            IF to_regclass('public.' || part_name) IS NULL THEN
+                EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I FOR VALUES FROM (%L) TO (%L)',
+                               part_name, parent, month_start, (month_start + INTERVAL '1 month')::DATE);
+                created := created + 1;
+            END IF;
+            month_start := (month_start + INTERVAL '1 month')::DATE;
+        END LOOP;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Two years of history plus three months ahead; partition_maintenance.py keeps the window rolling.
+SELECT ensure_monthly_partitions((DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '24 months')::DATE,
+                                 (DATE_TRUNC('month', CURRENT_DATE) + INTERVAL '4 months')::DATE);
+
+-- ====================================================================
+-- Create Indexes for Performance (defined on the parents, inherited by every partition)
+-- ====================================================================
+-- Foreign Keys
+CREATE INDEX idx_products_category_id ON products(category_id);
+CREATE INDEX idx_addresses_customer_id ON addresses(customer_id);
+CREATE INDEX idx_orders_customer_id ON orders(customer_id);
+CREATE INDEX idx_orders_shipping_address_id ON orders(shipping_address_id);
+CREATE INDEX idx_orders_billing_address_id ON orders(billing_address_id);
+CREATE INDEX idx_orders_promo_id ON orders(promo_id);
+CREATE INDEX idx_order_items_order_id ON order_items(order_id);
+CREATE INDEX idx_order_items_product_id ON order_items(product_id);
+CREATE INDEX idx_web_sessions_customer_id ON web_sessions(customer_id);
+
+-- Frequently Filtered/Sorted Columns (order_date / session_start are covered by the partition bounds and PKs)
+CREATE INDEX idx_orders_order_date ON orders(order_date);
+CREATE INDEX idx_orders_order_status ON orders(order_status);
+CREATE INDEX idx_orders_shipped_at ON orders(shipped_at);
+CREATE INDEX idx_orders_delivered_at ON orders(delivered_at);
+CREATE INDEX idx_orders_cancelled_at ON orders(cancelled_at);
+CREATE INDEX idx_customers_phone ON customers(phone);
+CREATE INDEX idx_products_product_name ON products(product_name);
+CREATE INDEX idx_web_sessions_session_start ON web_sessions(session_start);
@@ -82,7 +82,7 @@ COMMENT ON COLUMN promotions.end_date IS 'Date when the promotion expires (NULL
 -- Orders Table
 CREATE TABLE orders (
 order_id NUMBER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
-order_ref VARCHAR2(20) UNIQUE,
+order_ref VARCHAR2(30) UNIQUE,
 customer_id NUMBER REFERENCES customers(customer_id) ON DELETE SET NULL,
 order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
 order_status VARCHAR2(50) NOT NULL CHECK (order_status IN (
@@ -105,6 +105,7 @@ promo_id NUMBER REFERENCES promotions(promo_id) ON DELETE SET NULL,
 notes CLOB
 );
 COMMENT ON TABLE orders IS 'Central transaction table, tracking COD order lifecycle and financials.';
+COMMENT ON COLUMN orders.order_ref IS 'COD-YYYYMMDD-<order_id>; 30 characters leave room for 17-digit order ids.';
 COMMENT ON COLUMN orders.order_status IS 'Current stage of the order in the COD process.';
 COMMENT ON COLUMN orders.shipped_at IS 'Timestamp when the order was handed to courier.';
 COMMENT ON COLUMN orders.delivered_at IS 'Timestamp when the order was successfully delivered and paid.';
@@ -0,0 +1,241 @@
+import os
+import csv
+import gzip
+import json
+import random
+import logging
+import argparse
+import datetime
+import generate_data as gd
+
+# Column layout of every exported table. Names and order match cod_schema_setup.sql; columns left
+# to their database defaults (created_at, notes, description, ...) are not exported. order_items also
+# carries its order's order_date (the partition key in cod_schema_partitioned.sql); the loader skips
+# columns the target table does not have.
+TABLE_COLUMNS = {
+    'categories': [('category_id', 'int'), ('category_name', 'str'), ('description', 'str')],
+    'products': [('product_id', 'int'), ('product_name', 'str'), ('category_id', 'int'), ('unit_price', 'float'),
+                 ('unit_cost', 'float'), ('sku', 'str'), ('is_active', 'bool')],
+    'customers': [('customer_id', 'int'), ('first_name', 'str'), ('last_name', 'str'), ('email', 'str'),
+                  ('phone', 'str'), ('signup_date', 'date')],
+    'addresses': [('address_id', 'int'), ('customer_id', 'int'), ('address_type', 'str'), ('street_address', 'str'),
+                  ('city', 'str'), ('postal_code', 'str'), ('country', 'str'), ('is_default', 'bool')],
+    'promotions': [('promo_id', 'int'), ('promo_code', 'str'), ('description', 'str'), ('discount_type', 'str'),
+                   ('discount_value', 'float'), ('start_date', 'date'), ('end_date', 'date')],
+    'orders': [('order_id', 'int'), ('order_ref', 'str'), ('customer_id', 'int'), ('order_date', 'timestamp'),
+               ('order_status', 'str'), ('shipped_at', 'timestamp'), ('delivered_at', 'timestamp'),
+               ('cancelled_at', 'timestamp'), ('last_updated_at', 'timestamp'), ('cancellation_reason', 'str'),
+               ('subtotal', 'float'), ('discount_amount', 'float'), ('shipping_cost', 'float'), ('tax_amount', 'float'),
+               ('order_total', 'float'), ('shipping_address_id', 'int'), ('billing_address_id', 'int'), ('promo_id', 'int')],
+    'order_items': [('order_item_id', 'int'), ('order_id', 'int'), ('product_id', 'int'), ('quantity', 'int'),
+                    ('price_per_unit', 'float'), ('cost_per_unit', 'float'), ('item_total', 'float'), ('order_date', 'timestamp')],
+    'web_sessions': [('session_id', 'int'), ('customer_id', 'int'), ('session_start', 'timestamp'),
+                     ('session_end', 'timestamp'), ('ip_address', 'str'), ('user_agent', 'str'),
+                     ('referrer_source', 'str'), ('utm_campaign', 'str'), ('utm_medium', 'str')],
+}
+# Dependency order: a table only references tables listed before it.
+TABLE_ORDER = ['categories', 'products', 'customers', 'addresses', 'promotions', 'orders', 'order_items', 'web_sessions']
+# Tables that are sharded by month; order_items follows its parent order's month so both stay co-located.
+DATE_PARTITIONED = {'customers': 'signup_date', 'orders': 'order_date', 'order_items': 'order_date', 'web_sessions': 'session_start'}
+
+DEFAULT_SHARD_ROWS = 100_000
+# Cap on rows held across all open (table, month) buffers; the largest buffer is flushed early past it.
+DEFAULT_MAX_BUFFERED_ROWS = 300_000
+PROGRESS_EVERY = 1_000_000
+MANIFEST_NAME = 'manifest.json'
+
+
+def _arrow_schema(table):
+    import pyarrow as pa
+    types = {'int': pa.int64(), 'str': pa.string(), 'float': pa.float64(), 'bool': pa.bool_(),
+             'date': pa.date32(), 'timestamp': pa.timestamp('us', tz='UTC')}
+    return pa.schema([(name, types[kind]) for name, kind in TABLE_COLUMNS[table]])
+
+
+class ShardWriter:
+    """
+    Buffers generated rows per (table, month) and flushes them as numbered shard files:
+    <out_dir>/<table>/month=YYYY-MM/part-00000.parquet (or .csv.gz). A manifest.json listing every
+    shard, its row count and the column layout is written on close() for the loader.
+    """
+
+    def __init__(self, out_dir, fmt='parquet', compression=None, shard_rows=DEFAULT_SHARD_ROWS, max_buffered_rows=DEFAULT_MAX_BUFFERED_ROWS):
+        if fmt not in ('parquet', 'csv'): raise ValueError(f"Unsupported export format '{fmt}'.")
+        if fmt == 'parquet':
+            try: import pyarrow.parquet  # noqa: F401
+            except ImportError: raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow), or use --format csv.")
+        self.out_dir = out_dir; self.fmt = fmt; self.shard_rows = shard_rows
+        self.max_buffered_rows = max(max_buffered_rows, shard_rows); self.buffered_rows = 0
+        self.compression = compression or ('zstd' if fmt == 'parquet' else 'gzip')
+        self.buffers = {}; self.part_counters = {}; self.files = {t: [] for t in TABLE_ORDER}
+        os.makedirs(out_dir, exist_ok=True)
+
+    def add(self, table, row, partition_date=None):
+        partition = partition_date.strftime('%Y-%m') if partition_date else None
+        key = (table, partition)
+        buf = self.buffers.setdefault(key, [])
+        buf.append(row); self.buffered_rows += 1
+        if len(buf) >= self.shard_rows: self._flush(key)
+        elif self.buffered_rows > self.max_buffered_rows: self._flush(max(self.buffers, key=lambda k: len(self.buffers[k])))
+
+    def _flush(self, key):
+        rows = self.buffers.get(key)
+        if not rows: return
+        table, partition = key
+        part_no = self.part_counters.get(key, 0); self.part_counters[key] = part_no + 1
+        rel_dir = os.path.join(table, f"month={partition}") if partition else table
+        os.makedirs(os.path.join(self.out_dir, rel_dir), exist_ok=True)
+        ext = 'parquet' if self.fmt == 'parquet' else ('csv.gz' if self.compression == 'gzip' else 'csv')
+        rel_path = os.path.join(rel_dir, f"part-{part_no:05d}.{ext}")
+        path = os.path.join(self.out_dir, rel_path)
+        columns = [name for name, _ in TABLE_COLUMNS[table]]
+
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            arrow_table = pa.Table.from_pylist([dict(zip(columns, r)) for r in rows], schema=_arrow_schema(table))
+            pq.write_table(arrow_table, path, compression=self.compression)
+        else:
+            opener = gzip.open if self.compression == 'gzip' else open
+            with opener(path, 'wt', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                writer.writerows(rows)
+
+        self.files[table].append({'path': rel_path.replace(os.sep, '/'), 'rows': len(rows), 'partition': partition})
+        self.buffered_rows -= len(rows)
+        del self.buffers[key]
+
+    def close(self, extra_meta=None):
+        for key in list(self.buffers): self._flush(key)
+        manifest = {
+            'format': self.fmt, 'compression': self.compression, 'table_order': TABLE_ORDER,
+            'columns': {t: [name for name, _ in cols] for t, cols in TABLE_COLUMNS.items()},
+            'partitioned_by': DATE_PARTITIONED, 'files': self.files,
+            'row_counts': {t: sum(f['rows'] for f in files) for t, files in self.files.items()},
+            'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        if extra_meta: manifest.update(extra_meta)
+        with open(os.path.join(self.out_dir, MANIFEST_NAME), 'w') as f: json.dump(manifest, f, indent=2)
+        return manifest
+
+
+def address_ids_for(customer_id, salt):
+    """
+    Address ids owned by a customer, computed arithmetically instead of kept in a dict: every customer
+    owns a fixed block of NUM_ADDRESSES_PER_CUSTOMER[1] ids and uses the first 1..max of them (unused
+    ids are simply never written). The count is a salted hash of the id, so it is stable per run.
+    """
+    low, high = gd.NUM_ADDRESSES_PER_CUSTOMER
+    first = (customer_id - 1) * high + 1
+    count = low + ((customer_id * 2654435761 + salt) >> 8) % (high - low + 1)
+    return range(first, first + count)
+
+
+def arrival_time(index, count):
+    """
+    The index-th (1-based) of count timestamps spread uniformly over ORDER_START_DATE..ORDER_END_DATE
+    in ascending order, so ids and physical row order follow time as in production (BRIN-friendly).
+    """
+    start = datetime.datetime.combine(gd.ORDER_START_DATE, datetime.time(), tzinfo=datetime.timezone.utc)
+    span = (gd.ORDER_END_DATE - gd.ORDER_START_DATE + datetime.timedelta(days=1)).total_seconds()
+    return start + datetime.timedelta(seconds=int(span * (index - 1 + random.random()) / count))
+
+def export_dataset(writer, num_customers=None, num_orders=None, num_sessions=None):
+    """
+    Generates the full dataset with explicit ids (no database round trips) into the given writer.
+
+    Memory stays constant in the row counts: customer and address ids are derived arithmetically,
+    order totals are computed from the order's own items, and rows leave through the writer's
+    bounded buffers. Only the small dimension tables (products, promotions) are held in memory.
+    """
+    num_customers = num_customers or gd.NUM_CUSTOMERS
+    num_orders = num_orders or gd.NUM_ORDERS
+    num_sessions = num_sessions or gd.NUM_WEB_SESSIONS
+    salt = random.getrandbits(32)
+
+    logging.info("Generating categories and products...")
+    cat_names = {}
+    for cat_id, (name, desc) in enumerate(gd.CATEGORIES_DATA, start=1):
+        cat_names[cat_id] = name
+        writer.add('categories', (cat_id, name, desc))
+
+    product_data = []
+    for product_id in range(1, gd.NUM_PRODUCTS + 1):
+        cat_id = random.choice(list(cat_names))
+        product_name, unit_price, unit_cost, sku, is_active = gd.build_product_fields(cat_names[cat_id])
+        writer.add('products', (product_id, product_name, cat_id, unit_price, unit_cost, sku, is_active))
+        product_data.append({'id': product_id, 'price': unit_price, 'cost': unit_cost})
+
+    logging.info(f"Generating {num_customers} customers and their addresses...")
+    for customer_id in range(1, num_customers + 1):
+        fname, lname, email, phone, signup_date = gd.build_customer_fields()
+        writer.add('customers', (customer_id, fname, lname, email, phone, signup_date), signup_date)
+        for i, address_id in enumerate(address_ids_for(customer_id, salt)):
+            writer.add('addresses', (address_id, customer_id) + gd.build_address_fields(i))
+        if customer_id % PROGRESS_EVERY == 0: logging.info(f"... {customer_id} customers (peak RSS {gd.peak_rss_mb():.0f} MB)")
+
+    logging.info("Generating promotions...")
+    promos = []
+    for promo_id in range(1, gd.NUM_PROMOTIONS + 1):
+        code, desc, dtype, dvalue, start_date, end_date = gd.build_promotion_fields()
+        writer.add('promotions', (promo_id, code, desc, dtype, dvalue, start_date, end_date))
+        promos.append({'id': promo_id, 'type': dtype, 'value': dvalue})
+
+    logging.info(f"Generating {num_orders} orders and their items...")
+    order_item_id = 0
+    for order_id in range(1, num_orders + 1):
+        cust_id = random.randint(1, num_customers)
+        ship_addr_id = random.choice(address_ids_for(cust_id, salt))
+        order_date = arrival_time(order_id, num_orders)
+        order_status = gd.get_weighted_status(gd.ORDER_STATUS_DISTRIBUTION)
+        shipped_at, delivered_at, cancelled_at, last_updated_at, cancellation_reason = gd.simulate_order_lifecycle(order_date, order_status)
+        promo = random.choice(promos) if promos and random.random() < 0.30 else None
+
+        # Items are known before the order row is written, so totals are final (no second UPDATE pass).
+        items = gd.build_order_items(product_data)
+        subtotal = round(sum(qty * price for _, qty, price, _ in items), 2)
+        discount_amount, shipping_cost, tax_amount, order_total = gd.compute_order_totals(subtotal, promo)
+        order_ref = f"COD-{order_date.strftime('%Y%m%d')}-{order_id}"
+        writer.add('orders', (order_id, order_ref, cust_id, order_date, order_status, shipped_at, delivered_at, cancelled_at,
+                              last_updated_at, cancellation_reason, subtotal, discount_amount, shipping_cost, tax_amount,
+                              order_total, ship_addr_id, ship_addr_id, promo['id'] if promo else None), order_date)
+        for prod_id, qty, price_unit, cost_unit in items:
+            order_item_id += 1
+            writer.add('order_items', (order_item_id, order_id, prod_id, qty, price_unit, cost_unit, round(qty * price_unit, 2), order_date), order_date)
+        if order_id % PROGRESS_EVERY == 0: logging.info(f"... {order_id} orders (peak RSS {gd.peak_rss_mb():.0f} MB)")
+
+    logging.info(f"Generating {num_sessions} web sessions...")
+    # Guests get weight 0.6 per registered customer (as in insert_web_sessions), sampled in O(1).
+    guest_weight = int(num_customers * 0.6)
+    for session_id in range(1, num_sessions + 1):
+        pick = random.randrange(num_customers + guest_weight)
+        cust_id = pick + 1 if pick < num_customers else None
+        session_fields = gd.build_session_fields(arrival_time(session_id, num_sessions))
+        writer.add('web_sessions', (session_id, cust_id) + session_fields, session_fields[0])
+        if session_id % PROGRESS_EVERY == 0: logging.info(f"... {session_id} sessions (peak RSS {gd.peak_rss_mb():.0f} MB)")
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the InsightFlow dataset offline as partitioned Parquet/CSV shards.")
+    parser.add_argument('--out', default='dataset_export', help="Output directory (default: dataset_export)")
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet')
+    parser.add_argument('--compression', default=None, help="Parquet codec (default zstd) or 'gzip'/'none' for CSV (default gzip)")
+    parser.add_argument('--shard-rows', type=int, default=DEFAULT_SHARD_ROWS, help="Max rows per shard file")
+    parser.add_argument('--max-buffered-rows', type=int, default=DEFAULT_MAX_BUFFERED_ROWS, help="Max rows buffered across all shards")
+    parser.add_argument('--customers', type=int, default=None, help=f"Number of customers (default: {gd.NUM_CUSTOMERS})")
+    parser.add_argument('--orders', type=int, default=None, help=f"Number of orders (default: {gd.NUM_ORDERS})")
+    parser.add_argument('--sessions', type=int, default=None, help=f"Number of web sessions (default: {gd.NUM_WEB_SESSIONS})")
+    parser.add_argument('--sink', choices=['files', 'postgres'], default='files', help="Write shards to --out, or COPY straight into PostgreSQL")
+    args = parser.parse_args()
+
+    start_time = datetime.datetime.now()
+    if args.sink == 'postgres':
+        from dataset_loader import PostgresCopyWriter
+        writer = PostgresCopyWriter(args.shard_rows)
+    else:
+        writer = ShardWriter(args.out, args.format, args.compression, args.shard_rows, args.max_buffered_rows)
+    export_dataset(writer, args.customers, args.orders, args.sessions)
+    manifest = writer.close({'seed': gd.DATA_SEED})
+    logging.info(f"Export finished in {datetime.datetime.now() - start_time} (peak RSS {gd.peak_rss_mb():.0f} MB): {manifest['row_counts']}")
@@ -0,0 +1,242 @@
+import os
+import io
+import csv
+import gzip
+import json
+import logging
+import argparse
+import datetime
+import psycopg2
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from dataset_export import MANIFEST_NAME, TABLE_ORDER, TABLE_COLUMNS, DEFAULT_SHARD_ROWS
+from partition_maintenance import is_partitioned, ensure_partitions, add_months
+
+# --- Configuration ---
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Tables in the same group have no references to each other and are loaded concurrently.
+LOAD_GROUPS = [['categories', 'customers', 'promotions'], ['products', 'addresses'], ['orders'], ['order_items', 'web_sessions']]
+ID_COLUMNS = {'categories': 'category_id', 'products': 'product_id', 'customers': 'customer_id', 'addresses': 'address_id',
+              'promotions': 'promo_id', 'orders': 'order_id', 'order_items': 'order_item_id', 'web_sessions': 'session_id'}
+
+
+def get_db_connection():
+    """Establishes a connection to the PostgreSQL database."""
+    try:
+        conn = psycopg2.connect(
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT")
+        )
+        return conn
+    except Exception as e:
+        logging.error(f"Database Connection Error: {e}")
+        return None
+
+def read_manifest(dataset_dir):
+    with open(os.path.join(dataset_dir, MANIFEST_NAME)) as f: return json.load(f)
+
+
+# --- In-process loading (no database) ---
+def _apply_column_kinds(pd, frame, table, from_csv):
+    """
+    Types a shard frame after TABLE_COLUMNS: ids and flags become nullable Int64/boolean in both
+    formats (pandas would turn an id column with NULLs into floats). CSV shards are read as text, so
+    postal codes and phones keep their leading zeros, and the other kinds are parsed here.
+    """
+    for name, kind in TABLE_COLUMNS[table]:
+        if name not in frame.columns: continue
+        if kind == 'int': frame[name] = frame[name].astype('Int64')
+        elif kind == 'bool': frame[name] = (frame[name].map({'True': True, 'False': False}) if from_csv else frame[name]).astype('boolean')
+        elif not from_csv: continue
+        elif kind == 'float': frame[name] = frame[name].astype('float64')
+        elif kind == 'date': frame[name] = pd.to_datetime(frame[name], format='ISO8601').dt.date
+        elif kind == 'timestamp': frame[name] = pd.to_datetime(frame[name], format='ISO8601', utc=True)
+    return frame
+
+def load_dataset(dataset_dir, tables=None):
+    """Reads an exported dataset into {table: pandas.DataFrame}; used by benchmarks and offline analysis."""
+    import pandas as pd
+    manifest = read_manifest(dataset_dir)
+    frames = {}
+    for table in tables or manifest['table_order']:
+        columns = manifest['columns'][table]
+        parts = []
+        for shard in manifest['files'][table]:
+            path = os.path.join(dataset_dir, shard['path'])
+            if manifest['format'] == 'parquet': parts.append(_apply_column_kinds(pd, pd.read_parquet(path), table, from_csv=False))
+            else: parts.append(_apply_column_kinds(pd, pd.read_csv(path, dtype=str, keep_default_na=False, na_values=['']), table, from_csv=True))
+        frames[table] = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=columns)
+    return frames
+
+
+# --- Parallel COPY into PostgreSQL ---
+def target_columns(cur, table):
+    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s", (table,))
+    return {row[0] for row in cur.fetchall()}
+
+def has_order_facts(cur):
+    """True when cod_order_facts.sql is installed."""
+    cur.execute("SELECT to_regclass('public.order_facts') IS NOT NULL")
+    return cur.fetchone()[0]
+
+def _shard_as_csv(path, fmt, columns=None):
+    """Returns a binary file object with the shard as CSV (header row included) ready for COPY, optionally projected to columns."""
+    if fmt == 'parquet' or columns is not None:
+        import pyarrow as pa
+        import pyarrow.csv as pcsv
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            arrow_table = pq.read_table(path, columns=columns)
+        else: # Read every column as text so values like postal codes round-trip unchanged.
+            with (gzip.open if path.endswith('.gz') else open)(path, 'rt', newline='', encoding='utf-8') as f: header = next(csv.reader(f))
+            convert = pcsv.ConvertOptions(column_types={c: pa.string() for c in header}, strings_can_be_null=True, include_columns=columns)
+            arrow_table = pcsv.read_csv(path, convert_options=convert)
+        buf = io.BytesIO()
+        pcsv.write_csv(arrow_table, buf)
+        buf.seek(0)
+        return buf
+    if path.endswith('.gz'): return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+def copy_shard(dataset_dir, manifest, table, shard, columns, trusted=False):
+    conn = get_db_connection()
+    if not conn: raise RuntimeError(f"No database connection for {table} shard {shard['path']}.")
+    projection = columns if columns != manifest['columns'][table] else None
+    columns = ', '.join(columns)
+    try:
+        with conn.cursor() as cur, _shard_as_csv(os.path.join(dataset_dir, shard['path']), manifest['format'], projection) as f:
+            cur.execute("SET synchronous_commit = off")
+            # Shards already carry order_ref/item_total and consistent ids; replica mode skips triggers and FK checks.
+            if trusted: cur.execute("SET session_replication_role = replica")
+            cur.copy_expert(f"COPY public.{table} ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true)", f)
+        conn.commit()
+        return shard['rows']
+    except psycopg2.Error:
+        conn.rollback(); raise
+    finally:
+        conn.close()
+
+def reset_identity_sequences(cur):
+    # Ids were supplied explicitly, so move every identity sequence past the loaded maximum.
+    for table, id_col in ID_COLUMNS.items():
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('public.{table}', '{id_col}'), COALESCE((SELECT MAX({id_col}) FROM public.{table}), 0) + 1, false)")
+
+def refresh_order_facts(cur, since=None):
+    cur.execute("SELECT public.refresh_order_facts(%s)", (since,))
+    return cur.fetchone()[0]
+
+def load_into_postgres(dataset_dir, workers=4, truncate=False, trusted=False):
+    manifest = read_manifest(dataset_dir)
+    conn = get_db_connection()
+    if not conn: raise RuntimeError("Could not establish database connection.")
+    try:
+        with conn.cursor() as cur:
+            order_facts = has_order_facts(cur)
+            if truncate:
+                logging.info("Truncating target tables...")
+                cur.execute(f"TRUNCATE {', '.join('public.' + t for t in manifest['table_order'] + (['order_facts'] if order_facts else []))} RESTART IDENTITY CASCADE")
+            # Shards may carry columns the target schema lacks (e.g. order_items.order_date on the monolithic schema).
+            columns = {}
+            for table in manifest['table_order']:
+                present = target_columns(cur, table)
+                columns[table] = [c for c in manifest['columns'][table] if c in present]
+            if is_partitioned(cur):
+                months = sorted(f['partition'] for t in ('orders', 'web_sessions') for f in manifest['files'].get(t, []) if f['partition'])
+                if months:
+                    first, last = (datetime.date.fromisoformat(m + '-01') for m in (months[0], months[-1]))
+                    logging.info(f"Created {ensure_partitions(cur, first, add_months(last, 1))} missing partitions for {months[0]}..{months[-1]}.")
+            conn.commit()
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for group in LOAD_GROUPS:
+                    group_start = datetime.datetime.now()
+                    jobs = [(t, pool.submit(copy_shard, dataset_dir, manifest, t, shard, columns[t], trusted)) for t in group for shard in manifest['files'].get(t, [])]
+                    loaded = {t: 0 for t in group}
+                    for table, job in jobs: loaded[table] += job.result()
+                    logging.info(f"Loaded {loaded} in {datetime.datetime.now() - group_start}.")
+
+            reset_identity_sequences(cur)
+            # Replica mode skipped the order_facts triggers; without it, one order's items can span shards COPYed
+            # concurrently, and each shard's trigger only saw the items committed before it.
+            if order_facts: logging.info(f"Refreshed {refresh_order_facts(cur)} order_facts rows.")
+            cur.execute(f"ANALYZE {', '.join('public.' + t for t in manifest['table_order'] + (['order_facts'] if order_facts else []))}")
+            conn.commit()
+    finally:
+        conn.close()
+    return manifest['row_counts']
+
+
+# --- Streaming sink: generation straight into PostgreSQL ---
+class PostgresCopyWriter:
+    """
+    Drop-in replacement for dataset_export.ShardWriter that COPYs each table's buffer into PostgreSQL
+    once it reaches chunk_rows, so arbitrarily large datasets stream through bounded memory without
+    intermediate files. Parent tables are flushed before children to keep foreign keys satisfied.
+    """
+
+    def __init__(self, chunk_rows=DEFAULT_SHARD_ROWS):
+        self.conn = get_db_connection()
+        if not self.conn: raise RuntimeError("Could not establish database connection.")
+        self.cur = self.conn.cursor()
+        self.cur.execute("SET synchronous_commit = off")
+        # Keep only the columns the target schema has (see load_into_postgres), by position.
+        self.columns = {}; self.keep = {}
+        for table in TABLE_ORDER:
+            present = target_columns(self.cur, table)
+            names = [name for name, _ in TABLE_COLUMNS[table]]
+            self.keep[table] = [i for i, name in enumerate(names) if name in present]
+            self.columns[table] = [names[i] for i in self.keep[table]]
+        if is_partitioned(self.cur):
+            import generate_data as gd
+            ensure_partitions(self.cur, gd.ORDER_START_DATE.replace(day=1), add_months(gd.ORDER_END_DATE.replace(day=1), 1))
+        self.conn.commit()
+        self.chunk_rows = chunk_rows
+        self.buffers = {t: [] for t in TABLE_ORDER}; self.row_counts = {t: 0 for t in TABLE_ORDER}
+
+    def add(self, table, row, partition_date=None):
+        buf = self.buffers[table]
+        buf.append(row)
+        if len(buf) >= self.chunk_rows:
+            for parent in TABLE_ORDER[:TABLE_ORDER.index(table)]: self._copy(parent)
+            self._copy(table)
+
+    def _copy(self, table):
+        rows = self.buffers[table]
+        if not rows: return
+        buf = io.StringIO()
+        keep = self.keep[table]
+        if len(keep) == len(TABLE_COLUMNS[table]): csv.writer(buf).writerows(rows)
+        else: csv.writer(buf).writerows([tuple(r[i] for i in keep) for r in rows])
+        buf.seek(0)
+        columns = ', '.join(self.columns[table])
+        self.cur.copy_expert(f"COPY public.{table} ({columns}) FROM STDIN WITH (FORMAT csv)", buf)
+        self.conn.commit()
+        self.row_counts[table] += len(rows); self.buffers[table] = []
+
+    def close(self, extra_meta=None):
+        try:
+            for table in TABLE_ORDER: self._copy(table)
+            reset_identity_sequences(self.cur)
+            self.conn.commit()
+        finally:
+            self.cur.close(); self.conn.close()
+        return dict(extra_meta or {}, row_counts=self.row_counts)
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="COPY an exported InsightFlow dataset into PostgreSQL in parallel.")
+    parser.add_argument('dataset_dir', help="Directory written by dataset_export.py")
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent COPY connections (default: 4)")
+    parser.add_argument('--truncate', action='store_true', help="TRUNCATE the target tables (RESTART IDENTITY) before loading")
+    parser.add_argument('--trusted', action='store_true', help="Skip triggers and foreign-key checks while loading (superuser; shards from dataset_export.py only)")
+    args = parser.parse_args()
+
+    start_time = datetime.datetime.now()
+    row_counts = load_into_postgres(args.dataset_dir, args.workers, args.truncate, args.trusted)
+    logging.info(f"Dataset loaded in {datetime.datetime.now() - start_time}: {row_counts}")
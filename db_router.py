@@ -0,0 +1,158 @@
+import os
+import time
+import logging
+import argparse
+import itertools
+import threading
+import psycopg2
+from dotenv import load_dotenv
+
+# --- Configuration ---
+load_dotenv()
+
+# Session settings per intent, passed as connection options so they hold for the whole connection
+# (a rollback cannot undo them). Intents not listed get the defaults.
+DEFAULT_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+DEFAULT_WORK_MEM = os.getenv("DB_WORK_MEM", "8MB")
+INTENT_DB_SETTINGS = {
+    'get_high_failure_products': {'statement_timeout': 20000, 'work_mem': '64MB'}, # per-product DISTINCT aggregates over items x orders
+    'find_revenue_anomaly': {'statement_timeout': 15000, 'work_mem': '32MB'}, # grouping + window over 90 days of deliveries
+    'get_gross_profit': {'statement_timeout': 15000, 'work_mem': '32MB'},
+    'explain_sales_funnel': {'statement_timeout': 10000, 'work_mem': '16MB'},
+    'get_channel_performance': {'statement_timeout': 10000, 'work_mem': '16MB'},
+}
+
+# Replication lag a replica may have and still answer: windows that include today need fresh rows,
+# closed ones (last month/quarter) only move through late status updates.
+REPLICA_HOSTS = [h.strip() for h in os.getenv("DB_REPLICA_HOSTS", "").split(",") if h.strip()] # host[:port],...
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+REPLICA_MAX_LAG_CLOSED_SECONDS = float(os.getenv("REPLICA_MAX_LAG_CLOSED_SECONDS", "900"))
+CLOSED_PERIODS = {'last_month', 'last_quarter'}
+# A replica found unreachable or too stale is not retried for this long (other requests go elsewhere).
+REPLICA_RECHECK_SECONDS = float(os.getenv("REPLICA_RECHECK_SECONDS", "10"))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+
+# Seconds of data the replica is missing. Caught up (everything received is replayed, and the WAL
+# receiver is streaming) counts as 0 even when the primary has been idle; otherwise it is the age of
+# the last replayed transaction. A server not in recovery is its own primary.
+LAG_QUERY = """
+SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                 AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity') END::float8
+"""
+
+
+def session_options(intent):
+    settings = INTENT_DB_SETTINGS.get(intent, {})
+    statement_timeout = settings.get('statement_timeout', DEFAULT_STATEMENT_TIMEOUT_MS); work_mem = settings.get('work_mem', DEFAULT_WORK_MEM)
+    return f"-c statement_timeout={statement_timeout} -c work_mem={work_mem} -c default_transaction_read_only=on -c application_name=insightflow:{intent}"
+
+def max_lag_for_period(period):
+    return REPLICA_MAX_LAG_CLOSED_SECONDS if period in CLOSED_PERIODS else REPLICA_MAX_LAG_SECONDS
+
+def connect(host=None, port=None, **kwargs):
+    """Connects with the DB_* settings of .env, optionally to another host/port (a replica)."""
+    return psycopg2.connect(dbname=os.getenv("DB_NAME"), user=os.getenv("DB_USER"), password=os.getenv("DB_PASSWORD"),
+                            host=host or os.getenv("DB_HOST"), port=port or os.getenv("DB_PORT"), **kwargs)
+
+
+class Replica:
+    def __init__(self, address):
+        host, _, port = address.partition(':')
+        self.name = address; self.host = host; self.port = port or os.getenv("DB_PORT")
+        self.lag = None; self.error = None; self.checked = float('-inf')
+
+
+class ReadRouter:
+    """
+    Hands out connections for read-only intent queries: a replica whose measured lag fits the
+    requested period (round robin among them), else the primary. Every connection carries the
+    intent's statement_timeout/work_mem and is read-only.
+    """
+
+    def __init__(self, replicas=None, clock=time.monotonic):
+        self.replicas = [Replica(r) for r in (REPLICA_HOSTS if replicas is None else replicas)]
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.turn = itertools.count()
+        self.routed = {'primary': 0, **{r.name: 0 for r in self.replicas}}
+        self.fallbacks = {'stale': 0, 'unreachable': 0}
+
+    def _candidates(self, max_lag, now):
+        # Replicas in round-robin order, minus those recently seen down or too stale for this period.
+        with self.lock:
+            if not self.replicas: return []
+            start = next(self.turn) % len(self.replicas); rotated = self.replicas[start:] + self.replicas[:start]
+            return [r for r in rotated if now - r.checked >= REPLICA_RECHECK_SECONDS or (r.error is None and r.lag <= max_lag)]
+
+    def _count(self, target, fallback=None):
+        with self.lock:
+            self.routed[target] += 1
+            if fallback: self.fallbacks[fallback] += 1
+
+    def connect(self, intent, context, prefer_primary=False):
+        """Returns (connection, target name); target is 'primary' or the replica's host:port."""
+        options = session_options(intent); max_lag = max_lag_for_period(context.get('period'))
+        fallback = None
+        for replica in ([] if prefer_primary else self._candidates(max_lag, self.clock())):
+            conn = None
+            try:
+                conn = connect(replica.host, replica.port, options=options, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+                with conn.cursor() as cur: cur.execute(LAG_QUERY); lag = cur.fetchone()[0]
+                conn.rollback() # leave no transaction open before the intent's own queries
+                with self.lock: replica.lag = lag; replica.error = None; replica.checked = self.clock()
+            except psycopg2.Error as e:
+                if conn: conn.close()
+                with self.lock: replica.error = str(e).strip().splitlines()[0]; replica.checked = self.clock()
+                logging.warning(f"Replica {replica.name} unavailable: {replica.error}"); fallback = 'unreachable'; continue
+            if lag <= max_lag:
+                self._count(replica.name); return conn, replica.name
+            conn.close(); fallback = 'stale'
+            logging.info(f"Replica {replica.name} is {lag:.1f}s behind (limit {max_lag:.0f}s for period '{context.get('period')}'); skipping.")
+        conn = connect(options=options)
+        self._count('primary', fallback); return conn, 'primary'
+
+    def reconnect(self, target, intent):
+        """A new connection to a target returned by connect(), with the same session settings (not counted)."""
+        replica = next((r for r in self.replicas if r.name == target), None)
+        if replica: return connect(replica.host, replica.port, options=session_options(intent), connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        return connect(options=session_options(intent))
+
+    # --- Metrics ---
+    def snapshot(self):
+        with self.lock:
+            return {'routed': dict(self.routed), 'fallbacks': dict(self.fallbacks),
+                    'replicas': {r.name: {'lag_seconds': r.lag, 'error': r.error} for r in self.replicas}}
+
+    def prometheus_text(self):
+        s = self.snapshot()
+        lines = ["# HELP insightflow_db_routed_total Intent connections handed out, by target server.", "# TYPE insightflow_db_routed_total counter"]
+        lines += [f'insightflow_db_routed_total{{target="{target}"}} {count}' for target, count in s['routed'].items()]
+        lines += ["# HELP insightflow_db_replica_fallback_total Intent connections sent to the primary because a replica was skipped.", "# TYPE insightflow_db_replica_fallback_total counter"]
+        lines += [f'insightflow_db_replica_fallback_total{{reason="{reason}"}} {count}' for reason, count in s['fallbacks'].items()]
+        lag_lines = [f'insightflow_db_replica_lag_seconds{{replica="{name}"}} {r["lag_seconds"]}' for name, r in s['replicas'].items() if r['lag_seconds'] is not None and not r['error']]
+        if lag_lines: lines += ["# TYPE insightflow_db_replica_lag_seconds gauge"] + lag_lines
+        return "\n".join(lines) + "\n"
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report replica lag and where each intent/period would be routed.")
+    parser.add_argument('--replicas', help="Comma-separated host[:port] list (default: DB_REPLICA_HOSTS)")
+    parser.add_argument('--periods', default="last_7_days,last_month", help="Periods to route (default: last_7_days,last_month)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    router = ReadRouter([h.strip() for h in args.replicas.split(",") if h.strip()] if args.replicas else None)
+    if not router.replicas: logging.warning("No replicas configured (DB_REPLICA_HOSTS); everything routes to the primary.")
+    for intent in INTENT_DB_SETTINGS:
+        for period in args.periods.split(","):
+            for replica in router.replicas: replica.checked = float('-inf') # re-measure for every line
+            try: conn, target = router.connect(intent, {'period': period})
+            except psycopg2.Error as e: raise SystemExit(f"Could not connect to the primary: {e}")
+            with conn.cursor() as cur: cur.execute("SHOW statement_timeout"); timeout = cur.fetchone()[0]; cur.execute("SHOW work_mem"); work_mem = cur.fetchone()[0]
+            conn.close()
+            print(f"{intent:<28} {period:<14} -> {target:<22} statement_timeout={timeout} work_mem={work_mem} (max lag {max_lag_for_period(period):.0f}s)")
+    for name, r in router.snapshot()['replicas'].items():
+        print(f"replica {name}: " + (f"unreachable ({r['error']})" if r['error'] else f"lag {r['lag_seconds']:.2f}s"))
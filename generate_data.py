@@ -1,12 +1,13 @@
 import os
 import random
 import datetime
+import resource
 import psycopg2
+import psycopg2.extras
 from decimal import Decimal # Import Decimal for explicit checks if needed, though we convert to float
-from faker import Faker
 from dotenv import load_dotenv
 import logging
-import re # For basic phone cleaning
+from value_pools import ValuePools
 
 # --- Configuration ---
 load_dotenv()
@@ -29,13 +30,16 @@ def get_db_connection():
         logging.error(f"Database Connection Error: {e}")
         return None
 
-# --- Faker Initialization ---
-try:
-    fake = Faker(['fr_FR', 'ar_SA', 'en_US'])
-    fake.name()
-except ImportError:
-    logging.warning("Could not initialize Faker with 'ar_SA', falling back to fr_FR and en_US.")
-    fake = Faker(['fr_FR', 'en_US'])
+# --- Value Pools (Faker is only called while these are built) ---
+DATA_SEED = int(os.getenv("DATA_SEED")) if os.getenv("DATA_SEED") else None
+if DATA_SEED is not None: random.seed(DATA_SEED)
+_pools = None
+
+def get_pools():
+    """The run's ValuePools, built on first use so that importing this module (dataset_export, dataset_loader) stays cheap."""
+    global _pools
+    if _pools is None: _pools = ValuePools(seed=DATA_SEED)
+    return _pools
 
 
 # --- Data Generation Configuration ---
@@ -97,12 +101,6 @@ CANCELLATION_REASONS = [
 REFERRER_SOURCES = ['Google', 'Facebook', 'Instagram', 'YouTube', 'TikTok', 'Direct', 'Friend Referral', 'Other Website']
 
 # --- Helper Functions ---
-def clean_phone_number(phone):
-    cleaned = re.sub(r'[^\d+]+', '', phone)
-    if not cleaned.startswith('+'):
-        cleaned = re.sub(r'[^\d]+', '', cleaned)
-    return cleaned[:15]
-
 def get_random_location():
     country = random.choice(COUNTRIES)
     city = random.choice(NA_LOCATIONS[country])
@@ -126,6 +124,149 @@ def get_weighted_status(status_distribution):
     statuses, weights = zip(*status_distribution)
     return random.choices(statuses, weights=weights, k=1)[0]
 
+REFUSED_REASONS = [r for r in CANCELLATION_REASONS if 'Refused' in r]
+DELIVERY_FAILED_REASONS = [r for r in CANCELLATION_REASONS if 'Courier' in r or 'Address' in r or 'answer' in r]
+CUSTOMER_CANCEL_REASONS = [r for r in CANCELLATION_REASONS if 'Customer' in r or 'needed' in r or 'item' in r or 'delayed' in r or 'cheaper' in r]
+ADMIN_CANCEL_REASONS = [r for r in CANCELLATION_REASONS if 'Admin' in r or 'stock' in r]
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux, bytes on macOS)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if os.uname().sysname == 'Darwin' else rss / 1024
+
+# --- Row Builders (shared by the live-DB inserts and the offline exporter) ---
+def build_product_fields(cat_name):
+    """Returns (product_name, unit_price, unit_cost, sku, is_active) for a product in cat_name."""
+    template = random.choice(PRODUCT_NAME_TEMPLATES[cat_name])
+    variation = random.choice(['', ' X', ' RGB', ' Wireless', ' Mini', ' Elite', ' Plus'])
+    modifier = random.choice(['', f' {random.randint(1, 9)}00', f' V{random.randint(2, 7)}', f'-{random.choice(["BLK","WHT","BLU","RED"])}'])
+    product_name = template.format(modifier) + variation
+    product_name = product_name.replace(' {}','').strip()
+
+    if cat_name == 'PC Components':
+      unit_price = round(random.uniform(50.00, 500.00), 2)
+    elif cat_name == 'Keyboards':
+      unit_price = round(random.uniform(40.00, 350.00), 2)
+    elif cat_name == 'Audio':
+       unit_price = round(random.uniform(25.00, 400.00), 2)
+    else:
+      unit_price = round(random.uniform(25.00, 150.00), 2)
+
+    unit_cost = round(unit_price * random.uniform(0.4, 0.7), 2)
+    sku = get_pools().sku()
+    is_active = random.choices([True, False], weights=[0.95, 0.05], k=1)[0]
+    return product_name, unit_price, unit_cost, sku, is_active
+
+def build_customer_fields():
+    """Returns (first_name, last_name, email, phone, signup_date)."""
+    pools = get_pools()
+    fname, lname = pools.person_name()
+    email = pools.email()
+    phone = pools.phone()
+    signup_date = random_date_between(datetime.date(2022, 6, 1), datetime.date.today()).date()
+    return fname, lname, email, phone, signup_date
+
+def build_address_fields(i):
+    """Returns (address_type, street_address, city, postal_code, country, is_default) for the i-th address of a customer."""
+    address_type = random.choice(['Shipping', 'Billing', 'Shipping'])
+    country, city = get_random_location()
+    pools = get_pools()
+    return address_type, pools.street_address(), city, pools.postcode(), country, (i == 0)
+
+def build_promotion_fields():
+    """Returns (promo_code, description, discount_type, discount_value, start_date, end_date)."""
+    code = get_pools().promo_code()
+    dtype = random.choice(['Percentage', 'Fixed Amount'])
+    dvalue = round(random.uniform(5.0, 30.0) if dtype == 'Percentage' else random.uniform(3.0, 50.0), 2)
+    desc = f"{dvalue}{'%' if dtype == 'Percentage' else '$'} off {random.choice(['selected items', 'your order', 'gaming gear', 'first order'])}"
+
+    days_offset_start = random.randint(-270, 45)
+    days_offset_end = days_offset_start + random.randint(15, 120)
+    start_date = datetime.date.today() + datetime.timedelta(days=days_offset_start)
+    end_date = datetime.date.today() + datetime.timedelta(days=days_offset_end)
+    if random.random() < 0.15: start_date = None
+    if random.random() < 0.25: end_date = None
+    return code, desc, dtype, dvalue, start_date, end_date
+
+def simulate_order_lifecycle(order_date, order_status):
+    """Returns (shipped_at, delivered_at, cancelled_at, last_updated_at, cancellation_reason) for an order."""
+    shipped_at, delivered_at, cancelled_at, cancellation_reason = None, None, None, None
+    last_updated_at = order_date + datetime.timedelta(minutes=random.randint(5, 120))
+
+    if order_status not in ['Pending Confirmation', 'Cancelled by Customer', 'Cancelled by Admin']:
+        processing_delay = datetime.timedelta(hours=random.uniform(1, 48))
+        if last_updated_at < order_date + processing_delay: last_updated_at = order_date + processing_delay
+        if order_status != 'Processing':
+            ship_delay = datetime.timedelta(days=random.uniform(0.5, 4))
+            shipped_at = last_updated_at + ship_delay
+            last_updated_at = shipped_at
+            if order_status != 'Shipped':
+                final_event_delay = datetime.timedelta(days=random.uniform(1, 10))
+                final_event_time = shipped_at + final_event_delay
+                if order_status == 'Delivered': delivered_at = final_event_time; last_updated_at = delivered_at
+                elif order_status in ['Refused Delivery', 'Delivery Failed']:
+                    cancelled_at = final_event_time; last_updated_at = cancelled_at
+                    if order_status == 'Refused Delivery': cancellation_reason = random.choice(REFUSED_REASONS)
+                    else: cancellation_reason = random.choice(DELIVERY_FAILED_REASONS)
+                elif order_status == 'Returned':
+                     delivery_delay = random.uniform(1, 7)
+                     delivered_at = shipped_at + datetime.timedelta(days=delivery_delay)
+                     return_delay = random.uniform(1, 5)
+                     cancelled_at = delivered_at + datetime.timedelta(days=return_delay)
+                     last_updated_at = cancelled_at
+                     cancellation_reason = "Item returned post-delivery"
+    elif order_status in ['Cancelled by Customer', 'Cancelled by Admin']:
+        cancel_delay = datetime.timedelta(days=random.uniform(0.1, 3))
+        cancelled_at = order_date + cancel_delay
+        last_updated_at = cancelled_at
+        if order_status == 'Cancelled by Customer': cancellation_reason = random.choice(CUSTOMER_CANCEL_REASONS)
+        else: cancellation_reason = random.choice(ADMIN_CANCEL_REASONS)
+    return shipped_at, delivered_at, cancelled_at, last_updated_at, cancellation_reason
+
+def build_order_items(product_data):
+    """Returns a list of (product_id, quantity, price_per_unit, cost_per_unit) for one order."""
+    items = []
+    for _ in range(random.randint(1, MAX_ITEMS_PER_ORDER)):
+        if not product_data: continue
+        product = random.choice(product_data)
+        # *** Convert potential Decimal from product_data to float ***
+        cost_unit = float(product['cost']) if product['cost'] is not None else None # Handle potential NULL cost
+        items.append((product['id'], random.randint(1, 3), float(product['price']), cost_unit))
+    return items
+
+def compute_order_totals(subtotal, promo_detail):
+    """Returns (discount_amount, shipping_cost, tax_amount, order_total) for an order subtotal and optional promo."""
+    discount_amount = 0.0
+    if promo_detail:
+        try:
+            # *** Ensure discount value is float ***
+            discount_value_float = float(promo_detail['value'])
+            if promo_detail['type'] == 'Percentage':
+                discount_amount = round(subtotal * (discount_value_float / 100.0), 2)
+            elif promo_detail['type'] == 'Fixed Amount':
+                discount_amount = discount_value_float
+            discount_amount = round(min(subtotal, discount_amount), 2)
+        except (ValueError, TypeError):
+             logging.warning(f"Invalid discount value '{promo_detail['value']}' for promo_id {promo_detail.get('id')}, skipping discount.")
+             discount_amount = 0.0
+
+    # *** Calculations using floats ***
+    shipping_cost = round(random.uniform(3.0, 15.0), 2) if subtotal < 75 else 0.0
+    taxable_amount = subtotal - discount_amount
+    tax_amount = round(taxable_amount * 0.07, 2) if taxable_amount > 0 else 0.0
+    order_total = round(subtotal - discount_amount + shipping_cost + tax_amount, 2)
+    order_total = max(0.0, order_total)
+    return discount_amount, shipping_cost, tax_amount, order_total
+
+def build_session_fields(session_start=None):
+    """Returns (session_start, session_end, ip_address, user_agent, referrer_source, utm_campaign, utm_medium)."""
+    session_start = session_start or random_date_between(ORDER_START_DATE, ORDER_END_DATE)
+    session_end = session_start + datetime.timedelta(minutes=random.randint(1, 180))
+    pools = get_pools()
+    utm_campaign = pools.utm_campaign() if random.random() < 0.25 else None
+    utm_medium = random.choice(['cpc', 'social', 'email', 'referral']) if utm_campaign else None
+    return session_start, session_end, pools.ipv4(), pools.user_agent(), pools.referrer(REFERRER_SOURCES), utm_campaign, utm_medium
+
 # --- Main Data Generation Functions ---
 
 def insert_categories(cursor):
@@ -170,24 +311,7 @@ def insert_products(cursor, category_ids):
             cat_name = cat_names.get(cat_id)
             if not cat_name: continue # Skip if somehow category name not found
 
-            template = random.choice(PRODUCT_NAME_TEMPLATES[cat_name])
-            variation = random.choice(['', ' X', ' RGB', ' Wireless', ' Mini', ' Elite', ' Plus'])
-            modifier = random.choice(['', f' {random.randint(1, 9)}00', f' V{random.randint(2, 7)}', f'-{random.choice(["BLK","WHT","BLU","RED"])}'])
-            product_name = template.format(modifier) + variation
-            product_name = product_name.replace(' {}','').strip()
-
-            if cat_name == 'PC Components':
-              unit_price = round(random.uniform(50.00, 500.00), 2) 
-            elif cat_name == 'Keyboards':
-              unit_price = round(random.uniform(40.00, 350.00), 2) 
-            elif cat_name == 'Audio':
-               unit_price = round(random.uniform(25.00, 400.00), 2) 
-            else: 
-              unit_price = round(random.uniform(25.00, 150.00), 2) 
-              
-            unit_cost = round(unit_price * random.uniform(0.4, 0.7), 2)
-            sku = fake.unique.bothify(text='SKU-???-#####').upper()
-            is_active = random.choices([True, False], weights=[0.95, 0.05], k=1)[0]
+            product_name, unit_price, unit_cost, sku, is_active = build_product_fields(cat_name)
 
             cursor.execute(
                 """INSERT INTO public.products
@@ -215,22 +339,17 @@ def insert_products(cursor, category_ids):
 
 
 def insert_customers(cursor):
-    logging.info("Inserting customers...")
-    customer_ids = []
+    """
+    Inserts customers, each followed by its addresses, and returns the range of customer ids this run
+    assigned. Ids are drawn from the range later instead of a kept list (ids skipped on conflict leave
+    gaps, which the order and session inserts tolerate).
+    """
+    logging.info("Inserting customers and their addresses...")
+    first_id = last_id = None
+    customer_count = address_count = 0
     for _ in range(NUM_CUSTOMERS):
         try:
-            fname = fake['fr_FR'].first_name()
-            lname = fake['fr_FR'].last_name()
-            if random.random() < 0.2: fname = fake['ar_SA'].first_name(); lname = fake['ar_SA'].last_name()
-            elif random.random() < 0.1: fname = fake['en_US'].first_name(); lname = fake['en_US'].last_name()
-
-            email = fake.unique.email()
-            phone = clean_phone_number(fake.phone_number())
-            if not phone: phone = f"{random.randint(100000000, 999999999)}"
-
-            s_date_start = datetime.date(2022, 6, 1)
-            s_date_end = datetime.date.today()
-            signup_date = random_date_between(s_date_start, s_date_end).date()
+            fname, lname, email, phone, signup_date = build_customer_fields()
 
             cursor.execute(
                 """INSERT INTO public.customers (first_name, last_name, email, phone, signup_date)
@@ -240,7 +359,12 @@ def insert_customers(cursor):
                 (fname, lname, email, phone, signup_date)
             )
             result = cursor.fetchone()
-            if result: customer_ids.append(result[0])
+            if not result: continue
+            cust_id = result[0]
+            first_id = cust_id if first_id is None else min(first_id, cust_id)
+            last_id = cust_id if last_id is None else max(last_id, cust_id)
+            customer_count += 1
+            address_count += insert_addresses(cursor, cust_id)
         except psycopg2.Error as e:
              logging.warning(f"Skipping customer due to DB error: {e}")
              cursor.connection.rollback()
@@ -248,59 +372,30 @@ def insert_customers(cursor):
         except Exception as e:
              logging.warning(f"Generic error generating customer data: {e}")
              continue
-    logging.info(f"Inserted/Processed {len(customer_ids)} customers.")
-    return customer_ids
+    logging.info(f"Inserted/Processed {customer_count} customers and {address_count} addresses.")
+    return range(first_id, last_id + 1) if first_id is not None else range(0)
 
-def insert_addresses(cursor, customer_ids):
-    logging.info("Inserting addresses...")
-    address_ids = {}
+def insert_addresses(cursor, cust_id):
+    """Inserts 1..NUM_ADDRESSES_PER_CUSTOMER[1] addresses for a customer; returns how many."""
     address_count = 0
-    for cust_id in customer_ids:
-        address_ids[cust_id] = []
-        num_addr = random.randint(NUM_ADDRESSES_PER_CUSTOMER[0], NUM_ADDRESSES_PER_CUSTOMER[1])
-        for i in range(num_addr):
-            try:
-                address_type = random.choice(['Shipping', 'Billing', 'Shipping'])
-                country, city = get_random_location()
-                street = fake['fr_FR'].street_address()
-                postal_code = fake.postcode()
-                is_default = (i == 0)
-
-                cursor.execute(
-                    """INSERT INTO public.addresses
-                       (customer_id, address_type, street_address, city, postal_code, country, is_default)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING address_id""",
-                    (cust_id, address_type, street, city, postal_code, country, is_default)
-                )
-                addr_id = cursor.fetchone()[0]
-                address_ids[cust_id].append(addr_id)
-                address_count += 1
-            except psycopg2.Error as e:
-                logging.error(f"Error inserting address for customer {cust_id}: {e}")
-                cursor.connection.rollback()
-                continue
-            except Exception as e:
-                logging.warning(f"Generic error generating address data: {e}")
-                continue
-    logging.info(f"Inserted {address_count} addresses.")
-    return address_ids
+    num_addr = random.randint(NUM_ADDRESSES_PER_CUSTOMER[0], NUM_ADDRESSES_PER_CUSTOMER[1])
+    for i in range(num_addr):
+        address_type, street, city, postal_code, country, is_default = build_address_fields(i)
+        cursor.execute(
+            """INSERT INTO public.addresses
+               (customer_id, address_type, street_address, city, postal_code, country, is_default)
+               VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+            (cust_id, address_type, street, city, postal_code, country, is_default)
+        )
+        address_count += 1
+    return address_count
 
 def insert_promotions(cursor):
     logging.info("Inserting promotions...")
     promo_details_map = {} # Changed name to avoid confusion
     for i in range(NUM_PROMOTIONS):
         try:
-            code = fake.unique.bothify(text=random.choice(['SALE##??', 'GAMER###', 'COD##OFF', 'NA###SALE'])).upper()
-            dtype = random.choice(['Percentage', 'Fixed Amount'])
-            dvalue = round(random.uniform(5.0, 30.0) if dtype == 'Percentage' else random.uniform(3.0, 50.0), 2)
-            desc = f"{dvalue}{'%' if dtype == 'Percentage' else '$'} off {random.choice(['selected items', 'your order', 'gaming gear', 'first order'])}"
-
-            days_offset_start = random.randint(-270, 45)
-            days_offset_end = days_offset_start + random.randint(15, 120)
-            start_date = datetime.date.today() + datetime.timedelta(days=days_offset_start)
-            end_date = datetime.date.today() + datetime.timedelta(days=days_offset_end)
-            if random.random() < 0.15: start_date = None
-            if random.random() < 0.25: end_date = None
+            code, desc, dtype, dvalue, start_date, end_date = build_promotion_fields()
 
             cursor.execute(
                 """INSERT INTO public.promotions (promo_code, description, discount_type, discount_value, start_date, end_date)
@@ -323,194 +418,93 @@ def insert_promotions(cursor):
     return promo_details_map # Return the map
 
 
-def insert_orders_and_items(cursor, customer_ids, product_data, address_ids, promo_details_map): # Use renamed map
+def insert_orders_and_items(cursor, customer_ids, product_data, promo_details_map): # Use renamed map
     logging.info("Inserting orders and order items...")
     if not customer_ids or not product_data:
         logging.error("Cannot generate orders without customers or products.")
-        return {}
+        return 0
 
-    order_id_map = {}
     order_insert_count = 0
+    promo_codes = list(promo_details_map.keys())
+    # cod_schema_partitioned.sql co-locates order_items with orders via a copied order_date column.
+    cursor.execute("SELECT 1 FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'order_items' AND column_name = 'order_date'")
+    items_have_order_date = cursor.fetchone() is not None
 
     for i in range(NUM_ORDERS):
         cust_id = random.choice(customer_ids)
-        if not address_ids.get(cust_id): continue
-        ship_addr_id = random.choice(address_ids[cust_id])
-        bill_addr_id = ship_addr_id
+        address_pick = random.randrange(NUM_ADDRESSES_PER_CUSTOMER[1]) # resolved to one of the customer's addresses by the INSERT
 
         order_date = random_date_between(ORDER_START_DATE, ORDER_END_DATE)
         order_status = get_weighted_status(ORDER_STATUS_DISTRIBUTION)
-        shipped_at, delivered_at, cancelled_at, cancellation_reason = None, None, None, None
-        last_updated_at = order_date + datetime.timedelta(minutes=random.randint(5, 120))
-
-        # Simulate Lifecycle
-        if order_status not in ['Pending Confirmation', 'Cancelled by Customer', 'Cancelled by Admin']:
-            processing_delay = datetime.timedelta(hours=random.uniform(1, 48))
-            if last_updated_at < order_date + processing_delay: last_updated_at = order_date + processing_delay
-            if order_status != 'Processing':
-                ship_delay = datetime.timedelta(days=random.uniform(0.5, 4))
-                shipped_at = last_updated_at + ship_delay
-                last_updated_at = shipped_at
-                if order_status != 'Shipped':
-                    final_event_delay = datetime.timedelta(days=random.uniform(1, 10))
-                    final_event_time = shipped_at + final_event_delay
-                    if order_status == 'Delivered': delivered_at = final_event_time; last_updated_at = delivered_at
-                    elif order_status in ['Refused Delivery', 'Delivery Failed']:
-                        cancelled_at = final_event_time; last_updated_at = cancelled_at
-                        if order_status == 'Refused Delivery': cancellation_reason = random.choice([r for r in CANCELLATION_REASONS if 'Refused' in r])
-                        else: cancellation_reason = random.choice([r for r in CANCELLATION_REASONS if 'Courier' in r or 'Address' in r or 'answer' in r])
-                    elif order_status == 'Returned':
-                         delivery_delay = random.uniform(1, 7)
-                         delivered_at = shipped_at + datetime.timedelta(days=delivery_delay)
-                         return_delay = random.uniform(1, 5)
-                         cancelled_at = delivered_at + datetime.timedelta(days=return_delay)
-                         last_updated_at = cancelled_at
-                         cancellation_reason = "Item returned post-delivery"
-        elif order_status in ['Cancelled by Customer', 'Cancelled by Admin']:
-            cancel_delay = datetime.timedelta(days=random.uniform(0.1, 3))
-            cancelled_at = order_date + cancel_delay
-            last_updated_at = cancelled_at
-            if order_status == 'Cancelled by Customer': cancellation_reason = random.choice([r for r in CANCELLATION_REASONS if 'Customer' in r or 'needed' in r or 'item' in r or 'delayed' in r or 'cheaper' in r])
-            else: cancellation_reason = random.choice([r for r in CANCELLATION_REASONS if 'Admin' in r or 'stock' in r])
-
-        applied_promo_id = None
-        if promo_details_map and random.random() < 0.30:
-            promo_code = random.choice(list(promo_details_map.keys()))
-            applied_promo_id = promo_details_map[promo_code]['id']
-
-        order_subtotal_placeholder, order_total_placeholder = 0.0, 0.0
+        shipped_at, delivered_at, cancelled_at, last_updated_at, cancellation_reason = simulate_order_lifecycle(order_date, order_status)
+
+        promo_detail = None
+        if promo_codes and random.random() < 0.30:
+            promo_detail = promo_details_map[random.choice(promo_codes)]
+
+        # Items are drawn first so the order row is written with its final totals (no second UPDATE pass).
+        items = build_order_items(product_data)
+        subtotal = round(sum(qty * price_unit for _, qty, price_unit, _ in items), 2)
+        discount_amount, shipping_cost, tax_amount, order_total = compute_order_totals(subtotal, promo_detail)
         try:
             cursor.execute(
+                # The shipping (and billing) address is picked in the same statement (idx_addresses_customer_id)
+                # instead of a SELECT round trip per order; no row is inserted for a customer without addresses.
                 """INSERT INTO public.orders
                    (customer_id, order_date, order_status, shipped_at, delivered_at, cancelled_at, last_updated_at,
                     cancellation_reason, subtotal, discount_amount, shipping_cost, tax_amount, order_total,
                     shipping_address_id, billing_address_id, promo_id)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING order_id""",
+                   SELECT %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, a.address_id, a.address_id, %s
+                   FROM (SELECT address_id, ROW_NUMBER() OVER (ORDER BY address_id) AS n, COUNT(*) OVER () AS addresses
+                         FROM public.addresses WHERE customer_id = %s) a
+                   WHERE a.n = %s %% a.addresses + 1
+                   RETURNING order_id""",
                  (cust_id, order_date, order_status, shipped_at, delivered_at, cancelled_at, last_updated_at,
-                  cancellation_reason, order_subtotal_placeholder, 0.0, 0.0, 0.0, order_total_placeholder,
-                  ship_addr_id, bill_addr_id, applied_promo_id)
+                  cancellation_reason, subtotal, discount_amount, shipping_cost, tax_amount, order_total,
+                  promo_detail['id'] if promo_detail else None, cust_id, address_pick)
             )
-            order_id = cursor.fetchone()[0]
-            order_id_map[order_id] = {'promo_id': applied_promo_id, 'items_total': 0.0}
+            result = cursor.fetchone()
+            if not result: continue # id skipped on conflict
+            order_id = result[0]
+            # One multi-row INSERT per order (executemany would run one statement, and fire the
+            # statement-level order_facts triggers, per item).
+            if items_have_order_date:
+                psycopg2.extras.execute_values(cursor,
+                    "INSERT INTO public.order_items (order_id, product_id, quantity, price_per_unit, cost_per_unit, order_date) VALUES %s",
+                     [(order_id, prod_id, qty, price_unit, cost_unit, order_date) for prod_id, qty, price_unit, cost_unit in items]
+                )
+            else:
+                psycopg2.extras.execute_values(cursor,
+                    "INSERT INTO public.order_items (order_id, product_id, quantity, price_per_unit, cost_per_unit) VALUES %s",
+                     [(order_id, prod_id, qty, price_unit, cost_unit) for prod_id, qty, price_unit, cost_unit in items]
+                )
             order_insert_count += 1
         except psycopg2.Error as e:
             logging.error(f"Error inserting order {i+1} for customer {cust_id}: {e}")
             cursor.connection.rollback()
             continue
 
-        num_items = random.randint(1, MAX_ITEMS_PER_ORDER)
-        order_items_subtotal = 0.0
-        items_inserted_count = 0
-        for _ in range(num_items):
-            if not product_data: continue
-            product = random.choice(product_data)
-            prod_id = product['id']
-            qty = random.randint(1, 3)
-            # *** Convert potential Decimal from product_data to float ***
-            price_unit = float(product['price'])
-            cost_unit = float(product['cost']) if product['cost'] is not None else None # Handle potential NULL cost
-
-            try:
-                cursor.execute(
-                    """INSERT INTO public.order_items (order_id, product_id, quantity, price_per_unit, cost_per_unit)
-                       VALUES (%s, %s, %s, %s, %s)""",
-                     (order_id, prod_id, qty, price_unit, cost_unit)
-                )
-                # *** Use float for calculation ***
-                order_items_subtotal += qty * price_unit
-                items_inserted_count += 1
-            except psycopg2.Error as e:
-                 logging.error(f"Error inserting order item for order {order_id}: {e}")
-                 cursor.connection.rollback()
-                 continue
-            except ValueError:
-                 logging.error(f"Error converting price/cost for item in order {order_id}")
-                 continue
-
-        if items_inserted_count > 0:
-             order_id_map[order_id]['items_total'] = round(order_items_subtotal, 2)
-        else:
-            logging.warning(f"Order {order_id} created with no items due to errors.")
-
-    logging.info(f"Finished inserting {order_insert_count} orders and their items.")
-    return order_id_map
-
-def update_order_totals(cursor, order_id_map, promo_details_map): # Use renamed map
-    logging.info("Updating order totals...")
-    if not promo_details_map:
-        logging.warning("Promo data unavailable for discount calculation.")
-
-    updated_count = 0
-    skipped_count = 0
-    for order_id, order_data in order_id_map.items():
-        # *** Ensure subtotal is float ***
-        subtotal = float(order_data.get('items_total', 0.0))
-
-        if subtotal <= 0:
-             skipped_count += 1
-             continue
-
-        discount_amount = 0.0
-        promo_id = order_data.get('promo_id')
-
-        if promo_id and promo_details_map:
-            # Find promo details using the correct map name
-            promo_detail = next((p for p_code, p in promo_details_map.items() if p['id'] == promo_id), None)
-            if promo_detail:
-                try:
-                    # *** Ensure discount value is float ***
-                    discount_value_float = float(promo_detail['value'])
-                    if promo_detail['type'] == 'Percentage':
-                        discount_amount = round(subtotal * (discount_value_float / 100.0), 2)
-                    elif promo_detail['type'] == 'Fixed Amount':
-                        discount_amount = discount_value_float
-                    discount_amount = round(min(subtotal, discount_amount), 2)
-                except (ValueError, TypeError):
-                     logging.warning(f"Invalid discount value '{promo_detail['value']}' for promo_id {promo_id}, skipping discount.")
-                     discount_amount = 0.0
-
-        # *** Calculations using floats ***
-        shipping_cost = round(random.uniform(3.0, 15.0), 2) if subtotal < 75 else 0.0
-        taxable_amount = subtotal - discount_amount
-        tax_amount = round(taxable_amount * 0.07, 2) if taxable_amount > 0 else 0.0
-        order_total = round(subtotal - discount_amount + shipping_cost + tax_amount, 2)
-        order_total = max(0.0, order_total)
-
-        try:
-            cursor.execute(
-                """UPDATE public.orders
-                   SET subtotal = %s, discount_amount = %s, shipping_cost = %s, tax_amount = %s, order_total = %s
-                   WHERE order_id = %s""",
-                 (subtotal, discount_amount, shipping_cost, tax_amount, order_total, order_id)
-            )
-            updated_count += 1
-        except psycopg2.Error as e:
-            logging.error(f"Error updating totals for order {order_id}: {e}")
-            cursor.connection.rollback()
-
-    logging.info(f"Updated totals for {updated_count} orders. Skipped {skipped_count} orders with zero subtotal.")
+    logging.info(f"Finished inserting {order_insert_count} orders and their items (peak RSS {peak_rss_mb():.0f} MB).")
+    return order_insert_count
 
 
 def insert_web_sessions(cursor, customer_ids):
     logging.info("Inserting web sessions...")
-    if not customer_ids: customer_ids = [None]
+    # Guests carry weight 0.6 per registered customer; sampled in O(1) instead of building a padded list per session.
+    guest_weight = int(len(customer_ids) * 0.6) if customer_ids else 1
 
     session_count = 0
     for _ in range(NUM_WEB_SESSIONS):
         try:
-            cust_id = random.choice(customer_ids + [None]*int(len(customer_ids)*0.6))
-            session_start = random_date_between(ORDER_START_DATE, ORDER_END_DATE)
-            session_end = session_start + datetime.timedelta(minutes=random.randint(1, 180))
-            ip_address = fake.ipv4()
-            user_agent = fake.user_agent()
-            referrer = random.choice(REFERRER_SOURCES + [None]*2)
-            utm_campaign = fake.slug() if random.random() < 0.25 else None
-            utm_medium = random.choice(['cpc', 'social', 'email', 'referral']) if utm_campaign else None
+            pick = random.randrange(len(customer_ids) + guest_weight)
+            cust_id = customer_ids[pick] if pick < len(customer_ids) else None
+            # An id skipped on conflict has no customer row; the subquery turns it into a guest session.
+            session_start, session_end, ip_address, user_agent, referrer, utm_campaign, utm_medium = build_session_fields()
 
             cursor.execute(
                  """INSERT INTO public.web_sessions
                     (customer_id, session_start, session_end, ip_address, user_agent, referrer_source, utm_campaign, utm_medium)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+                    VALUES ((SELECT customer_id FROM public.customers WHERE customer_id = %s), %s, %s, %s, %s, %s, %s, %s)""",
                  (cust_id, session_start, session_end, ip_address, user_agent, referrer, utm_campaign, utm_medium)
             )
             session_count += 1
@@ -520,7 +514,7 @@ def insert_web_sessions(cursor, customer_ids):
         except Exception as e:
             logging.warning(f"Generic error generating session data: {e}")
             continue
-    logging.info(f"Inserted {session_count} web sessions.")
+    logging.info(f"Inserted {session_count} web sessions (peak RSS {peak_rss_mb():.0f} MB).")
 
 
 # --- Main Execution ---
@@ -545,26 +539,20 @@ if __name__ == "__main__":
             product_data = insert_products(cur, category_ids)
             conn.commit()
 
-            customer_ids = insert_customers(cur)
-            conn.commit()
-
-            address_data = insert_addresses(cur, customer_ids)
+            customer_ids = insert_customers(cur) # also inserts their addresses
             conn.commit()
 
             promo_data_map = insert_promotions(cur) # Use correct variable name
             conn.commit()
 
-            order_map = insert_orders_and_items(cur, customer_ids, product_data, address_data, promo_data_map) # Pass correct map
-            conn.commit()
-
-            update_order_totals(cur, order_map, promo_data_map) # Pass correct map
+            insert_orders_and_items(cur, customer_ids, product_data, promo_data_map) # Pass correct map
             conn.commit()
 
             insert_web_sessions(cur, customer_ids)
             conn.commit()
 
             end_time = datetime.datetime.now()
-            logging.info(f"Sample data generation completed successfully in {end_time - start_time}!")
+            logging.info(f"Sample data generation completed successfully in {end_time - start_time} (peak RSS {peak_rss_mb():.0f} MB)!")
 
         except Exception as e:
             logging.exception(f"An critical error occurred during data generation:") # Log traceback
@@ -0,0 +1,290 @@
+import os
+import re
+import json
+import logging
+import argparse
+import tempfile
+import statistics
+import psycopg2
+import psycopg2.extensions
+from dotenv import load_dotenv
+
+# --- Configuration ---
+load_dotenv()
+
+INDEX_PACK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cod_index_pack.sql')
+ATTRIBUTION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cod_attribution.sql')
+
+# One representative context per fetch_data_for_intent branch (plus the period extremes for revenue).
+INTENT_PROBES = [
+    ('get_delivered_revenue', {'period': 'last_month'}),
+    ('get_delivered_revenue', {'period': 'last_90_days'}),
+    ('get_gross_profit', {'period': 'last_month'}),
+    ('get_cancellation_reasons', {'period': 'last_90_days', 'top_n': 7}),
+    ('explain_sales_funnel', {'period': 'last_90_days'}),
+    ('compare_failure_rate_geo', {'countries': ['Algeria', 'Egypt'], 'period': 'last_month'}),
+    ('get_high_failure_products', {'period': 'last_90_days', 'threshold': 5, 'top_n': 5}),
+    ('find_revenue_anomaly', {'period': 'last_90_days', 'time_grain': 'day'}),
+    ('suggest_improvement_for_high_failure_city', {'city': 'Cairo', 'period': 'last_90_days'}),
+    ('get_channel_performance', {'dimension': 'channel', 'period': 'last_month'}),
+]
+# Tables a probe reads besides the base schema; the probe is skipped on databases without them.
+PROBE_REQUIRES = {'get_channel_performance': 'order_attribution'}
+# Schema indexes the pack drops because a pack index supersedes them; restored for the without-pack variant.
+REPLACED_BY_PACK = {'idx_orders_order_date': "CREATE INDEX idx_orders_order_date ON public.orders (order_date)"}
+BRIN_COLUMNS = [('orders', 'order_date'), ('orders', 'delivered_at'), ('web_sessions', 'session_start')]
+PARTITION_SUFFIX = re.compile(r'_p\d{4}_\d{2}(?=_|$)')
+
+
+def get_db_connection(dbname=None, **kwargs):
+    """Establishes a connection to the PostgreSQL database (DB_NAME unless dbname is given)."""
+    try:
+        conn = psycopg2.connect(
+            dbname=dbname or os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            **kwargs
+        )
+        return conn
+    except Exception as e:
+        logging.error(f"Database Connection Error: {e}")
+        return None
+
+def pack_index_names():
+    with open(INDEX_PACK_FILE) as f: return re.findall(r'CREATE INDEX IF NOT EXISTS (\w+)', f.read())
+
+def apply_index_pack(conn):
+    """Runs cod_index_pack.sql one statement at a time in autocommit (its trailing VACUUMs refuse transaction blocks)."""
+    with open(INDEX_PACK_FILE) as f: sql = '\n'.join(line for line in f if not line.lstrip().startswith('--'))
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for statement in filter(str.strip, sql.split(';')): cur.execute(statement)
+
+
+class ExplainingCursor(psycopg2.extensions.cursor):
+    """Cursor that runs EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) before each read query and keeps the plans on the connection."""
+
+    def execute(self, query, vars=None):
+        if query.lstrip().upper().startswith(('SELECT', 'WITH')):
+            super().execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, vars)
+            self.connection.explain_log.append(self.fetchone()[0][0])
+        return super().execute(query, vars)
+
+class ExplainingConnection(psycopg2.extensions.connection):
+    """Connection whose cursors are ExplainingCursors; explain_log collects their plans."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = ExplainingCursor
+        self.explain_log = []
+
+
+def _walk_plan(node):
+    yield node
+    for child in node.get('Plans', []): yield from _walk_plan(child)
+
+def summarize_plan(explain):
+    """Condenses one EXPLAIN JSON document into scan shapes, buffers and timings."""
+    scans = {}
+    for node in _walk_plan(explain['Plan']):
+        if 'Scan' not in node['Node Type'] or node.get('Actual Loops', 1) == 0: continue
+        target = node.get('Index Name') or node.get('Relation Name') or ''
+        label = f"{node['Node Type']} {PARTITION_SUFFIX.sub('', target)}".strip()
+        scans[label] = scans.get(label, 0) + 1
+    root = explain['Plan']
+    return {'scans': [f"{label} x{count}" if count > 1 else label for label, count in sorted(scans.items())],
+            'shared_hit': root.get('Shared Hit Blocks', 0), 'shared_read': root.get('Shared Read Blocks', 0),
+            'planning_ms': explain.get('Planning Time', 0.0), 'execution_ms': explain.get('Execution Time', 0.0)}
+
+class ProbeFailed(Exception):
+    """An intent probe returned an error (fetch_data_for_intent has rolled its transaction back)."""
+
+
+def probe_intents(conn, repeat, stop_on_error=False):
+    """
+    Runs every INTENT_PROBES entry through fetch_data_for_intent on an ExplainingCursor connection.
+    stop_on_error raises ProbeFailed at the first failing probe instead of logging it and moving on.
+    """
+    from InsightFlow import fetch_data_for_intent
+    results = []
+    for intent, context in INTENT_PROBES:
+        if intent in PROBE_REQUIRES:
+            with conn.cursor() as cur: cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f"public.{PROBE_REQUIRES[intent]}",)); present = cur.fetchone()[0]
+            if not present: logging.info(f"Skipping {intent}: {PROBE_REQUIRES[intent]} does not exist."); continue
+        runs = []
+        for _ in range(repeat):
+            conn.explain_log = []
+            data = fetch_data_for_intent(intent, dict(context), conn)
+            if isinstance(data, dict) and 'error' in data:
+                if stop_on_error: raise ProbeFailed(f"{intent} returned {data}")
+                logging.warning(f"{intent} returned {data}")
+            runs.append([summarize_plan(e) for e in conn.explain_log])
+        last = runs[-1]
+        results.append({
+            'intent': intent, 'context': context,
+            'plan': ' | '.join(', '.join(q['scans']) for q in last),
+            'shared_hit': sum(q['shared_hit'] for q in last), 'shared_read': sum(q['shared_read'] for q in last),
+            'planning_ms': round(sum(q['planning_ms'] for q in last), 2),
+            'execution_ms': round(statistics.median(sum(q['execution_ms'] for q in run) for run in runs), 2),
+        })
+    return results
+
+def brin_correlation(cur):
+    """Physical/logical order correlation per BRIN candidate column (1.0 = perfectly append-ordered)."""
+    report = {}
+    for table, column in BRIN_COLUMNS:
+        cur.execute(
+            """SELECT AVG(correlation) FROM pg_stats
+               WHERE schemaname = 'public' AND attname = %s AND (tablename = %s OR tablename ~ %s) AND correlation IS NOT NULL""",
+            (column, table, f"^{table}_p[0-9]{{4}}_[0-9]{{2}}$")
+        )
+        value = cur.fetchone()[0]
+        report[f"{table}.{column}"] = round(float(value), 3) if value is not None else None
+    return report
+
+def advise_database(dbname, repeat=3, compare=False):
+    """
+    Probes every intent on dbname. With compare (scratch databases, or --allow-live-locks), the probes run
+    again with the pack dropped in a transaction that is rolled back afterwards. The dropped indexes'
+    tables stay ACCESS EXCLUSIVE locked for that whole run.
+    """
+    conn = get_db_connection(dbname, connection_factory=ExplainingConnection)
+    if not conn: raise RuntimeError(f"Could not connect to database '{dbname}'.")
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM public.orders")
+            orders = cur.fetchone()[0]
+            cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename IN ('orders', 'order_items', 'addresses', 'web_sessions')")
+            present = {row[0] for row in cur.fetchall()}
+            correlation = brin_correlation(cur)
+        conn.rollback()
+        pack = [name for name in pack_index_names() if name in present]
+        report = {'database': dbname, 'orders': orders, 'index_pack': len(pack), 'brin_correlation': correlation, 'variants': {}}
+        logging.info(f"[{dbname}] {orders} orders, {len(pack)} pack indexes present, BRIN correlation {correlation}")
+
+        report['variants']['current'] = probe_intents(conn, repeat)
+        conn.rollback()
+        if compare and pack:
+            # A failing probe rolls back, restoring the pack, so the variant stops there rather than report
+            # the remaining probes with the pack in place.
+            with conn.cursor() as cur:
+                for name in pack: cur.execute(f"DROP INDEX public.{name}")
+                for name, ddl in REPLACED_BY_PACK.items():
+                    if name not in present: cur.execute(ddl)
+            try: report['variants']['without_pack'] = probe_intents(conn, repeat, stop_on_error=True)
+            except ProbeFailed as e: logging.error(f"[{dbname}] Without-pack variant aborted: {e}")
+            conn.rollback()
+        elif pack:
+            logging.info(f"[{dbname}] Skipping the without-pack variant (it locks the tables; use --build-scales or --allow-live-locks).")
+        return report
+    finally:
+        conn.close()
+
+
+# --- Building scaled databases ---
+def build_scaled_database(dbname, orders, schema_file, apply_pack):
+    """
+    Creates dbname from schema_file (dropping it first), loads a generated dataset of the given size,
+    attributes its orders (cod_attribution.sql) and optionally installs the index pack.
+    """
+    import dataset_export
+    import dataset_loader
+    from attribution_job import run_attribution
+    admin = get_db_connection('postgres')
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{dbname}"')
+        cur.execute(f'CREATE DATABASE "{dbname}"')
+    admin.close()
+    conn = get_db_connection(dbname)
+    with conn.cursor() as cur, open(schema_file) as f: cur.execute(f.read())
+    conn.commit(); conn.close()
+
+    with tempfile.TemporaryDirectory(prefix='insightflow_adv_') as tmp:
+        writer = dataset_export.ShardWriter(tmp, 'parquet')
+        dataset_export.export_dataset(writer, num_customers=max(orders * 2 // 5, 100), num_orders=orders, num_sessions=orders * 3 // 4)
+        writer.close()
+        previous = os.environ.get('DB_NAME'); os.environ['DB_NAME'] = dbname  # the loader connects via DB_NAME
+        try: dataset_loader.load_into_postgres(tmp, workers=4, trusted=True)
+        finally:
+            if previous is None: os.environ.pop('DB_NAME', None)
+            else: os.environ['DB_NAME'] = previous
+    conn = get_db_connection(dbname)
+    with conn.cursor() as cur, open(ATTRIBUTION_FILE) as f: cur.execute(f.read())
+    conn.commit()
+    run_attribution(conn, full=True)
+    if apply_pack: apply_index_pack(conn)
+    conn.close()
+
+
+# --- Reporting ---
+def print_report(reports):
+    for report in reports:
+        print(f"\n=== {report['database']} ({report['orders']:,} orders, {report['index_pack']} pack indexes) BRIN correlation: {report['brin_correlation']}")
+        print(f"{'variant':<13} {'intent':<42} {'exec ms':>9} {'plan ms':>8} {'hit':>8} {'read':>8}  plan")
+        for variant, rows in report['variants'].items():
+            for r in rows:
+                label = r['intent'] + (f" ({r['context']['period']})" if 'period' in r['context'] else '')
+                print(f"{variant:<13} {label[:42]:<42} {r['execution_ms']:>9.2f} {r['planning_ms']:>8.2f} {r['shared_hit']:>8} {r['shared_read']:>8}  {r['plan']}")
+
+def find_regressions(reports, baseline, tolerance, time_tolerance):
+    """
+    Compares (database, variant, intent, context) rows against a previous run; returns human-readable findings.
+    Buffers and plan shapes are deterministic for a given dataset, so they get the tight tolerance;
+    wall-clock time is noisy and only flagged past time_tolerance.
+    """
+    def key(db, variant, row): return (db, variant, row['intent'], json.dumps(row['context'], sort_keys=True))
+    previous = {key(r['database'], v, row): row for r in baseline for v, rows in r['variants'].items() for row in rows}
+    findings = []
+    for report in reports:
+        for variant, rows in report['variants'].items():
+            for row in rows:
+                old = previous.get(key(report['database'], variant, row))
+                if not old: continue
+                name = f"{report['database']}/{variant}/{row['intent']}" + (f"({row['context']['period']})" if 'period' in row['context'] else '')
+                if row['execution_ms'] > old['execution_ms'] * (1 + time_tolerance) and row['execution_ms'] - old['execution_ms'] > 5:
+                    findings.append(f"{name}: execution {old['execution_ms']} -> {row['execution_ms']} ms")
+                old_buffers = old['shared_hit'] + old['shared_read']; new_buffers = row['shared_hit'] + row['shared_read']
+                if new_buffers > old_buffers * (1 + tolerance) and new_buffers - old_buffers > 100:
+                    findings.append(f"{name}: buffers {old_buffers} -> {new_buffers}")
+                if row['plan'] != old['plan']:
+                    findings.append(f"{name}: plan changed '{old['plan']}' -> '{row['plan']}'")
+    return findings
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN (ANALYZE, BUFFERS) every chatbot intent query, with and without the index pack, at several data scales.")
+    parser.add_argument('--databases', default=None, help="Comma-separated databases already loaded at different scales (default: DB_NAME)")
+    parser.add_argument('--build-scales', default=None, help="Comma-separated order counts; builds <DB_NAME>_adv_<n> databases first (drops existing ones)")
+    parser.add_argument('--schema', default='cod_schema_partitioned.sql', help="Schema file used with --build-scales")
+    parser.add_argument('--no-pack', action='store_true', help="With --build-scales: do not install cod_index_pack.sql")
+    parser.add_argument('--allow-live-locks', action='store_true', help="Also compare without the pack on --databases; drops the pack in a rolled-back transaction that locks the tables for the whole run")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per query; the median execution time is reported")
+    parser.add_argument('--out', default=None, help="Write the full report as JSON")
+    parser.add_argument('--baseline', default=None, help="Previous --out report; exit 1 on execution/buffer/plan regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative growth in buffers touched (default: 0.25)")
+    parser.add_argument('--time-tolerance', type=float, default=1.0, help="Allowed relative growth in execution time (default: 1.0, i.e. 2x)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.build_scales:
+        databases = []
+        for n in [int(x) for x in args.build_scales.split(',')]:
+            dbname = f"{os.getenv('DB_NAME')}_adv_{n}"
+            logging.info(f"Building {dbname} with {n} orders...")
+            build_scaled_database(dbname, n, args.schema, not args.no_pack)
+            databases.append(dbname)
+    else:
+        databases = args.databases.split(',') if args.databases else [os.getenv("DB_NAME")]
+
+    reports = [advise_database(db, args.repeat, compare=bool(args.build_scales) or args.allow_live_locks) for db in databases]
+    print_report(reports)
+    if args.out:
+        with open(args.out, 'w') as f: json.dump(reports, f, indent=2, default=str)
+    if args.baseline:
+        with open(args.baseline) as f: findings = find_regressions(reports, json.load(f), args.tolerance, args.time_tolerance)
+        for finding in findings: print(f"REGRESSION {finding}")
+        if findings: raise SystemExit(1)
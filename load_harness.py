@@ -0,0 +1,243 @@
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import datetime
+import threading
+import collections
+import concurrent.futures
+import requests
+
+# Query templates per intent, phrased the way interpret_query_intent recognizes them ('check-mix' verifies).
+SYNTHETIC_QUERIES = {
+    'get_delivered_revenue': ["What was delivered revenue {period}?", "delivered sales {period}"],
+    'get_gross_profit': ["gross profit {period}", "What was our profit margin {period}?"],
+    'get_cancellation_reasons': ["Show cancellation reason breakdown {period}", "Why were orders cancelled {period}?"],
+    'explain_sales_funnel': ["Explain the sales funnel {period}", "Show me the conversion funnel {period}"],
+    'compare_failure_rate_geo': ["Compare failure rate between {country} and {other_country} for {period}"],
+    'get_high_failure_products': ["Which products have high failure rates after shipping {period}?"],
+    'find_revenue_anomaly': ["Any unusual revenue changes {period}?", "biggest change in revenue {period}"],
+    'suggest_improvement_for_high_failure_city': ["Improve delivery issues for {city}", "How can we fix refused orders in {city}?"],
+    'get_channel_performance': ["Revenue and failure rate by channel {period}", "Which campaign performs best {period}?"],
+    'get_help': ["help", "what can you do?"],
+    'explain_term': ["What is AOV?", "define COD", "What is gross profit?"],
+}
+PERIOD_PHRASES = ["last month", "last quarter", "last 90 days", "last 30 days", "last 7 days", "this month", "year to date"]
+COUNTRIES = ['Algeria', 'Morocco', 'Tunisia', 'Libya', 'Egypt']
+CITIES = ['Algiers', 'Oran', 'Constantine', 'Casablanca', 'Tunis', 'Cairo', 'Alexandria']
+METRIC_LINE = re.compile(r'^(\w+)(\{[^}]*\})?\s+([-+\d.eEinfa]+)$')
+
+
+def synthetic_query(intent, rng):
+    country, other_country = rng.sample(COUNTRIES, 2)
+    return rng.choice(SYNTHETIC_QUERIES[intent]).format(period=rng.choice(PERIOD_PHRASES), country=country, other_country=other_country, city=rng.choice(CITIES))
+
+def synthetic_traffic(mix, count, clients, rate, seed):
+    """Traffic entries in the CHAT_RECORD_FILE format; arrivals are Poisson at rate/s (0: all at once)."""
+    rng = random.Random(seed); intents = list(mix); weights = [mix[i] for i in intents]; ts = 0.0; traffic = []
+    for _ in range(count):
+        intent = rng.choices(intents, weights)[0]
+        traffic.append({'ts': round(ts, 4), 'query': synthetic_query(intent, rng), 'intent': intent, 'client_id': f"load-{rng.randrange(clients)}", 'timeout_ms': None})
+        if rate: ts += rng.expovariate(rate)
+    return traffic
+
+def load_traffic(path):
+    with open(path, encoding='utf-8') as f: traffic = [json.loads(line) for line in f if line.strip()]
+    return sorted(traffic, key=lambda t: t['ts'])
+
+def parse_mix(text):
+    if not text: return {intent: 1.0 for intent in SYNTHETIC_QUERIES}
+    mix = {}
+    for part in text.split(','):
+        intent, _, weight = part.partition('=')
+        if intent not in SYNTHETIC_QUERIES: raise SystemExit(f"Unknown intent in --mix: {intent} (known: {', '.join(SYNTHETIC_QUERIES)})")
+        mix[intent] = float(weight or 1)
+    return mix
+
+
+# --- Sending ---
+class ChatClient:
+    """POSTs traffic entries to /chat over one keep-alive session per thread and classifies the outcome."""
+
+    def __init__(self, url, timeout):
+        self.url = url.rstrip('/'); self.timeout = timeout; self.local = threading.local()
+
+    def send(self, entry, scheduled=None):
+        session = getattr(self.local, 'session', None)
+        if session is None: session = self.local.session = requests.Session()
+        headers = {'X-Client-Id': entry.get('client_id') or 'load-harness'}
+        if entry.get('timeout_ms'): headers['X-Client-Timeout-Ms'] = str(entry['timeout_ms'])
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{self.url}/chat", json={'query': entry['query']}, headers=headers, timeout=self.timeout)
+            status = response.status_code
+            outcome = 'ok' if status == 200 else ('shed' if status == 429 or (status == 503 and 'Retry-After' in response.headers) else 'error')
+        except requests.RequestException as e:
+            status = type(e).__name__; outcome = 'error'
+        finished = time.perf_counter()
+        # Open-loop runs measure from the scheduled send time, so a saturated harness cannot hide queueing.
+        return {'intent': entry.get('intent') or 'unknown', 'status': status, 'outcome': outcome, 'latency_ms': (finished - (scheduled or started)) * 1000.0}
+
+def scrape_metrics(url):
+    """Counters from the server's /metrics (empty when unreachable), keyed by 'name{labels}'."""
+    try: text = requests.get(f"{url.rstrip('/')}/metrics", timeout=10).text
+    except requests.RequestException: return {}
+    metrics = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line.strip())
+        if match: metrics[match.group(1) + (match.group(2) or '')] = float(match.group(3))
+    return metrics
+
+def run_open_loop(client, traffic, speed, max_inflight):
+    """Sends each entry at its recorded offset divided by speed, whatever the server's pace."""
+    results = []; t0 = traffic[0]['ts'] if traffic else 0.0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        started = time.perf_counter(); futures = []
+        for entry in traffic:
+            scheduled = started + (entry['ts'] - t0) / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+            futures.append(pool.submit(client.send, entry, scheduled))
+        results = [f.result() for f in futures]
+    return results, time.perf_counter() - started
+
+def run_closed_loop(client, traffic, concurrency):
+    """concurrency workers send the entries in order, each waiting for its previous answer."""
+    queue = collections.deque(traffic); lock = threading.Lock(); results = []
+    def worker():
+        while True:
+            with lock:
+                if not queue: return
+                entry = queue.popleft()
+            result = client.send(entry)
+            with lock: results.append(result)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return results, time.perf_counter() - started
+
+
+# --- Reporting ---
+def percentile(sorted_values, p):
+    if not sorted_values: return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))], 1)
+
+def summarize_group(results):
+    latencies = sorted(r['latency_ms'] for r in results if r['outcome'] == 'ok')
+    count = len(results); outcomes = collections.Counter(r['outcome'] for r in results)
+    return {'requests': count, 'ok': outcomes['ok'], 'shed': outcomes['shed'], 'errors': outcomes['error'],
+            'shed_rate': round(outcomes['shed'] / count, 4) if count else 0.0, 'error_rate': round(outcomes['error'] / count, 4) if count else 0.0,
+            'p50_ms': percentile(latencies, 50), 'p90_ms': percentile(latencies, 90), 'p95_ms': percentile(latencies, 95), 'p99_ms': percentile(latencies, 99),
+            'max_ms': round(latencies[-1], 1) if latencies else None}
+
+def summarize(results, elapsed, before, after):
+    delta = lambda key: after.get(key, 0.0) - before.get(key, 0.0)
+    hits = delta('insightflow_answer_cache_total{result="hit"}'); misses = delta('insightflow_answer_cache_total{result="miss"}')
+    by_intent = collections.defaultdict(list)
+    for r in results: by_intent[r['intent']].append(r)
+    return {
+        'at': datetime.datetime.now().isoformat(timespec='seconds'), 'seconds': round(elapsed, 2),
+        'throughput_rps': round(len(results) / elapsed, 2) if elapsed else 0.0,
+        'overall': summarize_group(results),
+        'intents': {intent: summarize_group(rs) for intent, rs in sorted(by_intent.items())},
+        'statuses': dict(collections.Counter(str(r['status']) for r in results)),
+        'server': {'cache_hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+                   'shed': {key.split('"')[1]: delta(key) for key in after if key.startswith('insightflow_chat_shed_total')},
+                   'narrative_llm_calls': {key.split('"')[1]: delta(key) for key in after if key.startswith('insightflow_narrative_llm_calls_total')}} if after else None,
+    }
+
+def print_report(report):
+    print(f"\n{report['overall']['requests']} requests in {report['seconds']}s: {report['throughput_rps']} req/s, statuses {report['statuses']}")
+    if report['server']: print(f"Server: cache hit ratio {report['server']['cache_hit_ratio']}, shed {report['server']['shed']}, narrative LLM calls {report['server']['narrative_llm_calls']}")
+    print(f"{'intent':<42} {'req':>5} {'ok':>5} {'shed%':>6} {'err%':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for name, s in list(report['intents'].items()) + [('ALL', report['overall'])]:
+        fmt = lambda v: f"{v:>8.0f}" if v is not None else f"{'-':>8}"
+        print(f"{name:<42} {s['requests']:>5} {s['ok']:>5} {s['shed_rate'] * 100:>6.1f} {s['error_rate'] * 100:>6.1f} {fmt(s['p50_ms'])} {fmt(s['p90_ms'])} {fmt(s['p99_ms'])} {fmt(s['max_ms'])}")
+
+def find_regressions(report, baseline, tolerance, max_error_increase, min_delta_ms):
+    """Intents whose p95 grew by more than tolerance (and min_delta_ms), or whose error rate rose by more than max_error_increase."""
+    regressions = []
+    for intent, base in baseline['intents'].items():
+        current = report['intents'].get(intent)
+        if not current: continue
+        if base['p95_ms'] and current['p95_ms'] and current['p95_ms'] > max(base['p95_ms'] * (1 + tolerance), base['p95_ms'] + min_delta_ms):
+            regressions.append(f"{intent}: p95 {base['p95_ms']:.0f} -> {current['p95_ms']:.0f} ms")
+        if current['error_rate'] - base['error_rate'] > max_error_increase:
+            regressions.append(f"{intent}: error rate {base['error_rate']:.1%} -> {current['error_rate']:.1%}")
+    return regressions
+
+def check_mix():
+    """Runs every template with every period through interpret_query_intent; returns the mismatches."""
+    from InsightFlow import interpret_query_intent
+    rng = random.Random(0); mismatches = []
+    for intent, templates in SYNTHETIC_QUERIES.items():
+        for template in templates:
+            for period in PERIOD_PHRASES:
+                country, other_country = rng.sample(COUNTRIES, 2)
+                query = template.format(period=period, country=country, other_country=other_country, city=rng.choice(CITIES))
+                got = interpret_query_intent(query)[0]
+                if got != intent: mismatches.append(f"'{query}': expected {intent}, got {got}")
+    return mismatches
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded /chat traffic or generate synthetic load, and report latency, shedding and cache behaviour per intent.")
+    sub = parser.add_subparsers(dest='mode', required=True)
+    for name, help_text in (('replay', "Replay a CHAT_RECORD_FILE recording"), ('synthetic', "Generate a synthetic query mix")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('--url', default='http://localhost:5001', help="Server base URL (default: http://localhost:5001)")
+        p.add_argument('--concurrency', type=int, default=None, help="Closed loop: this many clients send back to back, ignoring arrival times")
+        p.add_argument('--max-inflight', type=int, default=256, help="Open loop: upper bound on concurrent requests (default: 256)")
+        p.add_argument('--timeout', type=float, default=60.0, help="Per-request timeout in seconds (default: 60)")
+        p.add_argument('--out', default=None, help="Write the report as JSON")
+        p.add_argument('--baseline', default=None, help="Previous --out report; exit 1 on p95 or error-rate regressions")
+        p.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative p95 growth per intent (default: 0.25)")
+        p.add_argument('--min-delta-ms', type=float, default=100.0, help="Ignore p95 growth below this many ms, e.g. on cached answers (default: 100)")
+        p.add_argument('--max-error-increase', type=float, default=0.01, help="Allowed absolute error-rate increase per intent (default: 0.01)")
+    replay = sub.choices['replay']
+    replay.add_argument('traffic', help="JSONL file written by the server with CHAT_RECORD_FILE (or by synthetic --save)")
+    replay.add_argument('--speed', type=float, default=1.0, help="Open loop: replay N times faster than recorded (default: 1)")
+    synthetic = sub.choices['synthetic']
+    synthetic.add_argument('--requests', type=int, default=200, help="Number of requests (default: 200)")
+    synthetic.add_argument('--rate', type=float, default=10.0, help="Open loop: Poisson arrivals per second (default: 10)")
+    synthetic.add_argument('--mix', default=None, help="intent=weight,... (default: every intent, equal weights)")
+    synthetic.add_argument('--clients', type=int, default=50, help="Distinct X-Client-Id values (default: 50)")
+    synthetic.add_argument('--seed', type=int, default=None, help="Seed for a reproducible query sequence")
+    synthetic.add_argument('--save', default=None, help="Also write the generated traffic as JSONL for later replay")
+    sub.add_parser('check-mix', help="Verify that every synthetic template maps to its intent")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.mode == 'check-mix':
+        mismatches = check_mix()
+        for m in mismatches: print(m)
+        print(f"{len(mismatches)} mismatching templates." if mismatches else "Every template maps to its intent.")
+        raise SystemExit(1 if mismatches else 0)
+
+    if args.mode == 'replay':
+        traffic = load_traffic(args.traffic); speed = args.speed
+    else:
+        traffic = synthetic_traffic(parse_mix(args.mix), args.requests, args.clients, args.rate, args.seed); speed = 1.0
+        if args.save:
+            with open(args.save, 'w', encoding='utf-8') as f: f.writelines(json.dumps(t) + "\n" for t in traffic)
+    if not traffic: raise SystemExit("No traffic to send.")
+
+    client = ChatClient(args.url, args.timeout)
+    before = scrape_metrics(args.url)
+    mode = f"closed loop, {args.concurrency} clients" if args.concurrency else f"open loop, {speed}x recorded pace" if args.mode == 'replay' else f"open loop, {args.rate}/s"
+    logging.warning(f"Sending {len(traffic)} requests to {args.url} ({mode})...")
+    if args.concurrency: results, elapsed = run_closed_loop(client, traffic, args.concurrency)
+    else: results, elapsed = run_open_loop(client, traffic, speed, args.max_inflight)
+    report = summarize(results, elapsed, before, scrape_metrics(args.url))
+    report['mode'] = mode
+    print_report(report)
+    if args.out:
+        with open(args.out, 'w') as f: json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f: regressions = find_regressions(report, json.load(f), args.tolerance, args.max_error_increase, args.min_delta_ms)
+        for r in regressions: print(f"REGRESSION {r}")
+        if regressions: raise SystemExit(1)
@@ -0,0 +1,182 @@
+import os
+import gzip
+import logging
+import json
+import argparse
+import datetime
+import psycopg2
+from dotenv import load_dotenv
+
+# --- Configuration ---
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ARCHIVE_SCHEMA = 'archive'
+
+
+def get_db_connection():
+    """Establishes a connection to the PostgreSQL database."""
+    try:
+        conn = psycopg2.connect(
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT")
+        )
+        return conn
+    except Exception as e:
+        logging.error(f"Database Connection Error: {e}")
+        return None
+
+def add_months(month_start, months):
+    month_index = month_start.year * 12 + month_start.month - 1 + months
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+def is_partitioned(cur):
+    """True when the connected database uses cod_schema_partitioned.sql (ensure_monthly_partitions exists)."""
+    cur.execute("SELECT to_regproc('public.ensure_monthly_partitions') IS NOT NULL")
+    return cur.fetchone()[0]
+
+def ensure_partitions(cur, start, end):
+    """Creates missing monthly partitions covering [start, end); returns how many were created."""
+    cur.execute("SELECT public.ensure_monthly_partitions(%s, %s)", (start, end))
+    return cur.fetchone()[0]
+
+def missing_partitions(cur, start, end):
+    """Names of the monthly partitions ensure_partitions(cur, start, end) would create; creates nothing."""
+    missing = []
+    for parent in ['orders', 'order_items', 'web_sessions']:
+        month = start.replace(day=1)
+        while month < end:
+            name = f"{parent}_p{month:%Y_%m}"
+            cur.execute("SELECT to_regclass(%s) IS NULL", (f"public.{name}",))
+            if cur.fetchone()[0]: missing.append(name)
+            month = add_months(month, 1)
+    return missing
+
+def list_partitions(cur, parent):
+    """Returns [(partition_name, lower_bound_date)] for the attached monthly partitions of parent."""
+    cur.execute(
+        """SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+           FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+           WHERE i.inhparent = %s::regclass ORDER BY c.relname""",
+        (f"public.{parent}",)
+    )
+    partitions = []
+    for name, bound in cur.fetchall():
+        # bound looks like: FOR VALUES FROM ('2025-01-01 00:00:00') TO ('2025-02-01 00:00:00')
+        if 'FROM (' not in bound: continue  # DEFAULT partition
+        lower = bound.split("FROM ('", 1)[1][:10]
+        partitions.append((name, datetime.date.fromisoformat(lower)))
+    return partitions
+
+def drop_partitioned_foreign_keys(cur, name):
+    """
+    Drops the foreign keys a detached partition kept towards partitioned tables (order_items -> orders).
+    DETACH leaves them behind as standalone constraints that archived rows can no longer satisfy once
+    the referenced month is retired too. Keys towards plain tables (customers, products) stay.
+    """
+    cur.execute(
+        """SELECT con.conname FROM pg_constraint con JOIN pg_class ref ON ref.oid = con.confrelid
+           WHERE con.conrelid = %s::regclass AND con.contype = 'f' AND ref.relkind = 'p'""",
+        (f"public.{name}",)
+    )
+    for (conname,) in cur.fetchall():
+        cur.execute(f'ALTER TABLE public.{name} DROP CONSTRAINT "{conname}"')
+        logging.info(f"Dropped foreign key {conname} of detached {name}")
+
+def retire_old_partitions(cur, retain_months, export_dir=None, dry_run=False):
+    """
+    Detaches partitions whose month starts before the retention cutoff. Detached partitions are either
+    moved to the archive schema (still queryable, no longer scanned by the parents) or, with export_dir,
+    written to <export_dir>/<partition>.csv.gz and dropped.
+    """
+    cutoff = add_months(datetime.date.today().replace(day=1), -retain_months)
+    retired = []
+    # Children first: order_items references orders, so its partitions must go before the orders ones.
+    for parent in ['order_items', 'web_sessions', 'orders']:
+        for name, lower in list_partitions(cur, parent):
+            if lower >= cutoff: continue
+            retired.append(name)
+            if dry_run: logging.info(f"[dry-run] Would retire {name} (month {lower:%Y-%m})"); continue
+            cur.execute(f"ALTER TABLE public.{parent} DETACH PARTITION public.{name}")
+            if export_dir:
+                path = os.path.join(export_dir, f"{name}.csv.gz")
+                with gzip.open(path, 'wb') as f:
+                    cur.copy_expert(f"COPY public.{name} TO STDOUT WITH (FORMAT csv, HEADER true)", f)
+                cur.execute(f"DROP TABLE public.{name}")
+                logging.info(f"Exported and dropped {name} -> {path}")
+            else:
+                drop_partitioned_foreign_keys(cur, name)
+                cur.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+                cur.execute(f"ALTER TABLE public.{name} SET SCHEMA {ARCHIVE_SCHEMA}")
+                logging.info(f"Detached {name} into schema '{ARCHIVE_SCHEMA}'")
+    return retired
+
+
+# --- Partition pruning evidence ---
+PERIOD_KEYS = ['last_7_days', 'last_30_days', 'this_month_mtd', 'last_month', 'last_90_days', 'last_quarter', 'year_to_date']
+
+def _walk_plan(node):
+    yield node
+    for child in node.get('Plans', []): yield from _walk_plan(child)
+
+def explain_period_filters(cur):
+    """
+    Runs EXPLAIN (ANALYZE, BUFFERS) for the chatbot's period windows (get_date_filter) on orders and
+    reports relations scanned, subplans pruned at startup, buffers and time. Run it against the
+    monolithic and the partitioned database to get before/after numbers on the same dataset.
+    """
+    from InsightFlow import get_date_filter
+    probes = {'order_date': lambda p: f"SELECT COUNT(*) FROM public.orders o WHERE TRUE {get_date_filter(p, 'o.order_date')}",
+              'delivered_at': lambda p: f"SELECT SUM(order_total) FROM public.orders o WHERE o.order_status = 'Delivered' {get_date_filter(p, 'o.delivered_at', 'o.order_date')}"}
+    report = []
+    for period in PERIOD_KEYS:
+        for probe, build_sql in probes.items():
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + build_sql(period))
+            plan = cur.fetchone()[0][0]
+            nodes = list(_walk_plan(plan['Plan']))
+            scanned = sorted({n['Relation Name'] for n in nodes if 'Relation Name' in n and n.get('Actual Loops', 1) > 0})
+            row = {'period': period, 'filter_on': probe, 'relations_scanned': len(scanned),
+                   'subplans_removed': sum(n.get('Subplans Removed', 0) for n in nodes),
+                   'shared_hit': plan['Plan'].get('Shared Hit Blocks', 0), 'shared_read': plan['Plan'].get('Shared Read Blocks', 0),
+                   'execution_ms': round(plan['Execution Time'], 2)}
+            report.append(row)
+            logging.info(json.dumps(row))
+    return report
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create future monthly partitions and retire old ones (cod_schema_partitioned.sql).")
+    parser.add_argument('--ahead', type=int, default=3, help="Months of future partitions to keep ready (default: 3)")
+    parser.add_argument('--retain', type=int, default=None, help="Months of history to keep attached; older partitions are retired")
+    parser.add_argument('--export-dir', default=None, help="With --retain: export retired partitions to gzipped CSV here and drop them")
+    parser.add_argument('--dry-run', action='store_true', help="Only report the partitions that would be created and retired; changes nothing")
+    parser.add_argument('--explain', action='store_true', help="Only report partition pruning for the chatbot period filters (works on either schema)")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    if not conn: raise SystemExit("Could not establish database connection.")
+    try:
+        with conn.cursor() as cur:
+            if args.explain:
+                explain_period_filters(cur); raise SystemExit(0)
+            if not is_partitioned(cur): raise SystemExit("Database does not use the partitioned schema (ensure_monthly_partitions missing).")
+            this_month = datetime.date.today().replace(day=1)
+            if args.dry_run:
+                for name in missing_partitions(cur, this_month, add_months(this_month, args.ahead + 1)): logging.info(f"[dry-run] Would create {name}")
+            else:
+                created = ensure_partitions(cur, this_month, add_months(this_month, args.ahead + 1))
+                logging.info(f"Created {created} new partitions ({args.ahead} months ahead of {this_month:%Y-%m}).")
+            if args.retain is not None:
+                if args.export_dir and not args.dry_run: os.makedirs(args.export_dir, exist_ok=True)
+                retired = retire_old_partitions(cur, args.retain, args.export_dir, args.dry_run)
+                logging.info(f"{'[dry-run] Would retire' if args.dry_run else 'Retired'} {len(retired)} partitions older than {args.retain} months.")
+        if args.dry_run: conn.rollback()
+        else: conn.commit()
+    except Exception:
+        conn.rollback(); raise
+    finally:
+        conn.close()
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import random
+import logging
+import datetime
+import threading
+import collections
+import logging.handlers
+import psycopg2
+import psycopg2.extensions
+from dotenv import load_dotenv
+from index_advisor import summarize_plan
+
+# --- Configuration ---
+load_dotenv()
+
+# A query is slow when one execute (including fetching its rows) takes longer than its intent's threshold:
+# SLOW_QUERY_MS_<INTENT> from the environment, else SLOW_QUERY_THRESHOLDS_MS, else SLOW_QUERY_MS.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_THRESHOLDS_MS = {'get_high_failure_products': 2000, 'find_revenue_anomaly': 1500, 'get_gross_profit': 1500}
+# Share of slow queries re-run under EXPLAIN (ANALYZE, BUFFERS) on a separate connection, one at a time.
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0.1"))
+SLOW_QUERY_BUFFER = int(os.getenv("SLOW_QUERY_BUFFER", "200"))
+SLOW_QUERY_LOG_FILE = os.getenv("SLOW_QUERY_LOG_FILE", "slow_queries.jsonl") # empty: ring buffer only
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "5"))
+
+
+def threshold_ms(intent):
+    override = os.getenv(f"SLOW_QUERY_MS_{(intent or '').upper()}")
+    return float(override) if override else float(SLOW_QUERY_THRESHOLDS_MS.get(intent, SLOW_QUERY_MS))
+
+
+class SlowQueryCursor(psycopg2.extensions.cursor):
+    """Cursor that times each execute and reports it to its recorder (see SlowQueryRecorder.cursor)."""
+    recorder = None; intent = None; target = 'primary'
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter(); error = None
+        try:
+            return super().execute(query, vars)
+        except Exception as e:
+            error = e; raise
+        finally:
+            if self.recorder: self.recorder.observe(self, query, vars, (time.perf_counter() - started) * 1000.0, error)
+
+
+class SlowQueryRecorder:
+    """
+    Keeps the last buffer_size slow intent queries (SQL, parameters, duration, rows, sampled plan) in
+    memory and appends each one to a size-rotated JSONL file. Queries cancelled by their statement_timeout
+    are recorded whatever their duration, with the error; failed queries are never re-run for a plan.
+    connect_for(target, intent) opens the connection that sampled EXPLAINs run on, so plans come from
+    the server that ran the query.
+    """
+
+    def __init__(self, connect_for, buffer_size=SLOW_QUERY_BUFFER, log_file=SLOW_QUERY_LOG_FILE, explain_sample=SLOW_QUERY_EXPLAIN_SAMPLE):
+        self.connect_for = connect_for; self.explain_sample = explain_sample
+        self.records = collections.deque(maxlen=buffer_size)
+        self.lock = threading.Lock()
+        self.explaining = False
+        self.counts = collections.Counter()
+        self.file_log = None
+        if log_file:
+            handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=SLOW_QUERY_LOG_MAX_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS, encoding='utf-8', delay=True) # opened on the first slow query
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.file_log = logging.Logger('insightflow.slow_queries') # standalone: records never reach the app log
+            self.file_log.addHandler(handler)
+
+    def cursor(self, conn, intent, target):
+        cur = conn.cursor(cursor_factory=SlowQueryCursor)
+        cur.recorder = self; cur.intent = intent; cur.target = target
+        return cur
+
+    def observe(self, cursor, query, params, elapsed_ms, error=None):
+        threshold = threshold_ms(cursor.intent)
+        if elapsed_ms < threshold and not isinstance(error, psycopg2.extensions.QueryCanceledError): return
+        rows = cursor.rowcount if error is None else None
+        record = {'at': datetime.datetime.now().isoformat(timespec='milliseconds'), 'intent': cursor.intent, 'target': cursor.target,
+                  'duration_ms': round(elapsed_ms, 1), 'threshold_ms': threshold, 'rows': rows,
+                  'sql': ' '.join(query.split()), 'params': json.loads(json.dumps(params, default=str)), 'plan_summary': None, 'plan': None}
+        if error is not None: record['error_class'] = type(error).__name__; record['error'] = (str(error).strip().splitlines() or [''])[0]
+        explain = error is None and query.lstrip().upper().startswith(('SELECT', 'WITH'))
+        with self.lock:
+            self.records.append(record); self.counts[cursor.intent] += 1
+            explain = explain and not self.explaining and random.random() < self.explain_sample
+            if explain: self.explaining = True
+        outcome = f"{rows} rows" if error is None else f"failed with {record['error_class']}: {record['error']}"
+        logging.warning(f"Slow query for intent '{cursor.intent}' on {cursor.target}: {elapsed_ms:.0f} ms (threshold {threshold:.0f} ms), {outcome}.")
+        if explain: threading.Thread(target=self._explain, args=(record, query, params), daemon=True).start()
+        else: self._write(record)
+
+    def _explain(self, record, query, params):
+        # Re-runs the query (read-only, same statement_timeout) off the request thread.
+        conn = None
+        try:
+            conn = self.connect_for(record['target'], record['intent'])
+            with conn.cursor() as cur: cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params); plan = cur.fetchone()[0][0]
+            with self.lock: record['plan'] = plan; record['plan_summary'] = summarize_plan(plan)
+        except psycopg2.Error as e:
+            logging.warning(f"Could not capture the plan of a slow '{record['intent']}' query: {e}")
+            with self.lock: record['plan_error'] = str(e).strip().splitlines()[0]
+        finally:
+            if conn: conn.close()
+            with self.lock: self.explaining = False
+            self._write(record)
+
+    def _write(self, record):
+        if not self.file_log: return
+        with self.lock: line = json.dumps(record, default=str)
+        self.file_log.info(line)
+
+    # --- Reporting ---
+    def snapshot(self, intent=None, limit=50, include_plans=False):
+        """Newest first; plans are reduced to their summary unless include_plans."""
+        with self.lock: records = [dict(r) for r in reversed(self.records) if intent in (None, r['intent'])][:limit]
+        if not include_plans:
+            for r in records: r.pop('plan')
+        return records
+
+    def prometheus_text(self):
+        with self.lock: counts = dict(self.counts)
+        lines = ["# HELP insightflow_slow_queries_total Intent queries slower than their threshold.", "# TYPE insightflow_slow_queries_total counter"]
+        lines += [f'insightflow_slow_queries_total{{intent="{intent}"}} {count}' for intent, count in sorted(counts.items())]
+        return "\n".join(lines) + "\n"
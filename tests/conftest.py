@@ -0,0 +1,48 @@
+import os
+import sys
+import itertools
+import pytest
+
+# The modules under test are flat scripts at the repository root.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Tests using scratch_db create and drop throwaway databases on the DB_* server, so they only run on request.
+TEST_PG = os.getenv("INSIGHTFLOW_TEST_PG", "").lower() in ("1", "true", "yes")
+_db_counter = itertools.count()
+
+
+def _connect(dbname):
+    import psycopg2
+    return psycopg2.connect(dbname=dbname, user=os.getenv("DB_USER"), password=os.getenv("DB_PASSWORD"),
+                            host=os.getenv("DB_HOST"), port=os.getenv("DB_PORT"))
+
+
+@pytest.fixture
+def scratch_db(monkeypatch):
+    """
+    Returns make(*sql_files): creates an empty database, runs the given repository SQL files in it, points
+    DB_NAME at it and returns a connection. The database is dropped after the test.
+    """
+    if not TEST_PG: pytest.skip("set INSIGHTFLOW_TEST_PG=1 to run tests against the DB_* PostgreSQL server")
+    created = []; conns = []
+
+    def make(*sql_files):
+        name = f"insightflow_test_{os.getpid()}_{next(_db_counter)}"
+        admin = _connect('postgres'); admin.autocommit = True
+        with admin.cursor() as cur: cur.execute(f"CREATE DATABASE {name} ENCODING 'UTF8' TEMPLATE template0")
+        admin.close(); created.append(name)
+        monkeypatch.setenv("DB_NAME", name)
+        conn = _connect(name); conns.append(conn)
+        with conn.cursor() as cur:
+            for sql_file in sql_files:
+                with open(os.path.join(REPO_ROOT, sql_file), encoding='utf-8') as f: cur.execute(f.read())
+        conn.commit()
+        return conn
+
+    yield make
+    for conn in conns: conn.close()
+    admin = _connect('postgres'); admin.autocommit = True
+    with admin.cursor() as cur:
+        for name in created: cur.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+    admin.close()
@@ -0,0 +1,119 @@
+import datetime
+import pytest
+
+from attribution_job import last_touch, run_attribution, UNATTRIBUTED
+
+DAY = datetime.datetime(2025, 5, 10, 12, 0)
+LOOKBACK = datetime.timedelta(days=7)
+
+
+def order(order_id, customer_id, at):
+    return (order_id, customer_id, at, 'Delivered', 100)
+
+def session(session_id, customer_id, at, referrer='Google', campaign=None, medium=None):
+    return (session_id, customer_id, at, referrer, campaign, medium)
+
+def credited(orders, sessions):
+    """order_id -> (session_id, channel) for every row last_touch yields."""
+    return {row[0]: (row[3], row[5]) for row in last_touch(orders, sessions, LOOKBACK)}
+
+
+def test_latest_session_before_the_order_wins():
+    sessions = [session(1, 10, DAY - datetime.timedelta(days=2), 'Facebook'), session(2, 10, DAY - datetime.timedelta(hours=1), 'Google')]
+    assert credited([order(100, 10, DAY)], sessions) == {100: (2, 'Google')}
+
+
+def test_session_after_the_order_is_not_credited():
+    sessions = [session(1, 10, DAY - datetime.timedelta(days=1), 'Facebook'), session(2, 10, DAY + datetime.timedelta(minutes=5), 'Google')]
+    assert credited([order(100, 10, DAY)], sessions) == {100: (1, 'Facebook')}
+
+
+def test_only_sessions_after_the_order_leave_it_unattributed():
+    sessions = [session(1, 10, DAY + datetime.timedelta(minutes=1))]
+    assert credited([order(100, 10, DAY)], sessions) == {100: (None, UNATTRIBUTED)}
+
+
+def test_session_at_the_order_time_is_credited():
+    assert credited([order(100, 10, DAY)], [session(1, 10, DAY)]) == {100: (1, 'Google')}
+
+
+def test_tie_on_session_start_credits_the_last_one_in_stream_order():
+    # Sessions tied on (customer_id, session_start) arrive in session_id order; the later one is the last touch.
+    sessions = [session(1, 10, DAY - datetime.timedelta(hours=1), 'Facebook'), session(2, 10, DAY - datetime.timedelta(hours=1), 'Instagram')]
+    assert credited([order(100, 10, DAY)], sessions) == {100: (2, 'Instagram')}
+
+
+def test_orders_tied_on_date_share_the_same_session():
+    sessions = [session(1, 10, DAY - datetime.timedelta(hours=1))]
+    assert credited([order(100, 10, DAY), order(101, 10, DAY)], sessions) == {100: (1, 'Google'), 101: (1, 'Google')}
+
+
+def test_session_between_two_orders_only_credits_the_later_one():
+    sessions = [session(1, 10, DAY - datetime.timedelta(days=1), 'Facebook'), session(2, 10, DAY + datetime.timedelta(hours=1), 'Google')]
+    orders = [order(100, 10, DAY), order(101, 10, DAY + datetime.timedelta(hours=2))]
+    assert credited(orders, sessions) == {100: (1, 'Facebook'), 101: (2, 'Google')}
+
+
+def test_session_older_than_lookback_is_not_credited():
+    sessions = [session(1, 10, DAY - LOOKBACK - datetime.timedelta(seconds=1))]
+    assert credited([order(100, 10, DAY)], sessions) == {100: (None, UNATTRIBUTED)}
+
+
+def test_sessions_of_other_customers_are_not_credited():
+    sessions = [session(1, 9, DAY - datetime.timedelta(hours=1)), session(2, 11, DAY - datetime.timedelta(hours=1))]
+    assert credited([order(100, 10, DAY)], sessions) == {100: (None, UNATTRIBUTED)}
+
+
+def test_previous_customers_session_does_not_leak():
+    sessions = [session(1, 10, DAY - datetime.timedelta(hours=1))]
+    orders = [order(100, 10, DAY), order(101, 11, DAY + datetime.timedelta(hours=1))]
+    assert credited(orders, sessions) == {100: (1, 'Google'), 101: (None, UNATTRIBUTED)}
+
+
+def test_missing_referrer_is_direct_and_missing_customer_is_unattributed():
+    sessions = [session(1, 10, DAY - datetime.timedelta(hours=1), None, 'summer', 'cpc')]
+    rows = list(last_touch([order(100, 10, DAY), order(101, None, DAY)], sessions, LOOKBACK))
+    assert rows[0][5:8] == ('Direct', 'summer', 'cpc')
+    assert rows[1][2:6] == (None, None, None, UNATTRIBUTED)
+
+
+# --- Against PostgreSQL (INSIGHTFLOW_TEST_PG=1) ---
+# Reference: the latest session of the order's customer within the lookback, ties going to the higher session_id.
+REFERENCE_SESSIONS = """
+SELECT o.order_id, s.session_id FROM public.orders o
+LEFT JOIN LATERAL (SELECT s.session_id FROM public.web_sessions s
+                   WHERE s.customer_id = o.customer_id AND s.session_start <= o.order_date AND s.session_start >= o.order_date - %s
+                   ORDER BY s.session_start DESC, s.session_id DESC LIMIT 1) s ON TRUE
+"""
+
+
+@pytest.fixture
+def attribution_db(scratch_db):
+    from dataset_export import export_dataset
+    from dataset_loader import PostgresCopyWriter
+    conn = scratch_db('cod_schema_partitioned.sql', 'cod_attribution.sql')
+    writer = PostgresCopyWriter(5000)
+    export_dataset(writer, num_customers=30, num_orders=400, num_sessions=3000)
+    writer.close()
+    return conn
+
+
+def test_run_attribution_matches_a_lateral_join(attribution_db):
+    stats = run_attribution(attribution_db, lookback_days=7, full=True)
+    with attribution_db.cursor() as cur:
+        cur.execute(REFERENCE_SESSIONS, (LOOKBACK,)); expected = dict(cur.fetchall())
+        cur.execute("SELECT order_id, session_id FROM public.order_attribution"); actual = dict(cur.fetchall())
+    assert actual == expected
+    assert stats['attributed'] == len(expected) and 0 < stats['matched'] == sum(1 for s in expected.values() if s)
+
+
+def test_incremental_run_resyncs_status_only(attribution_db):
+    run_attribution(attribution_db, lookback_days=7, full=True)
+    with attribution_db.cursor() as cur:
+        cur.execute("UPDATE public.orders SET order_status = 'Returned', last_updated_at = NOW() WHERE order_id = 1")
+    attribution_db.commit()
+    stats = run_attribution(attribution_db, lookback_days=7)
+    assert (stats['attributed'], stats['status_resynced']) == (0, 1)
+    with attribution_db.cursor() as cur:
+        cur.execute("SELECT order_status FROM public.order_attribution WHERE order_id = 1")
+        assert cur.fetchone() == ('Returned',)
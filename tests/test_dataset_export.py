@@ -0,0 +1,152 @@
+import os
+import datetime
+import pytest
+
+import generate_data as gd
+from dataset_export import ShardWriter, export_dataset, address_ids_for, arrival_time, TABLE_ORDER, TABLE_COLUMNS
+from dataset_loader import load_dataset, read_manifest
+
+SHARD_ROWS = 500
+
+
+@pytest.fixture(scope='module', params=['csv', 'parquet'])
+def exported(request, tmp_path_factory):
+    out_dir = str(tmp_path_factory.mktemp(f"export_{request.param}"))
+    writer = ShardWriter(out_dir, request.param, shard_rows=SHARD_ROWS)
+    export_dataset(writer)
+    return out_dir, writer.close(), load_dataset(out_dir)
+
+
+def test_manifest_lists_every_table_and_shard(exported):
+    out_dir, manifest, _ = exported
+    assert read_manifest(out_dir) == manifest
+    assert manifest['table_order'] == TABLE_ORDER
+    for table in TABLE_ORDER:
+        assert manifest['row_counts'][table] == sum(f['rows'] for f in manifest['files'][table])
+        assert all(0 < f['rows'] <= SHARD_ROWS for f in manifest['files'][table])
+
+
+def test_round_trip_keeps_rows_and_columns(exported):
+    _, manifest, frames = exported
+    for table in TABLE_ORDER:
+        assert list(frames[table].columns) == [name for name, _ in TABLE_COLUMNS[table]]
+        assert len(frames[table]) == manifest['row_counts'][table]
+        ids = frames[table][TABLE_COLUMNS[table][0][0]]
+        if table == 'addresses': assert ids.is_unique # per-customer id blocks leave gaps
+        else: assert sorted(ids) == list(range(1, len(ids) + 1))
+
+
+def test_round_trip_keeps_references(exported):
+    _, _, frames = exported
+    orders, items = frames['orders'], frames['order_items']
+    assert set(items['order_id']) <= set(orders['order_id'])
+    assert set(orders['customer_id']) <= set(frames['customers']['customer_id'])
+    addresses = frames['addresses'].set_index('address_id')['customer_id']
+    assert (addresses.loc[orders['shipping_address_id']].to_numpy() == orders['customer_id'].to_numpy()).all()
+
+
+def test_order_totals_match_their_items(exported):
+    _, _, frames = exported
+    item_totals = frames['order_items'].groupby('order_id')['item_total'].sum().round(2)
+    subtotals = frames['orders'].set_index('order_id')['subtotal']
+    assert (abs(subtotals.loc[item_totals.index] - item_totals) < 0.01).all()
+
+
+def read_shard(out_dir, manifest, shard):
+    import pandas as pd
+    path = f"{out_dir}/{shard['path']}"
+    return pd.read_parquet(path) if manifest['format'] == 'parquet' else pd.read_csv(path)
+
+
+def test_items_are_sharded_with_their_order(exported):
+    out_dir, manifest, frames = exported
+    order_month = {row.order_id: row.order_ref[4:10] for row in frames['orders'].itertuples()}
+    for shard in manifest['files']['order_items']:
+        part = read_shard(out_dir, manifest, shard)
+        assert {order_month[o] for o in part['order_id']} == {shard['partition'].replace('-', '')}
+
+
+def test_shards_split_at_shard_rows_per_month(tmp_path):
+    writer = ShardWriter(str(tmp_path), 'csv', shard_rows=2)
+    may, june = datetime.datetime(2025, 5, 3), datetime.datetime(2025, 6, 1)
+    for customer_id, signup in enumerate([may, may, may, june], start=1):
+        writer.add('customers', (customer_id, 'A', 'B', f"{customer_id}@example.com", '+2120001', signup.date()), signup)
+    manifest = writer.close()
+    assert [(f['partition'], f['rows']) for f in manifest['files']['customers']] == [('2025-05', 2), ('2025-05', 1), ('2025-06', 1)]
+    assert manifest['files']['customers'][1]['path'] == 'customers/month=2025-05/part-00001.csv.gz'
+
+
+def test_unknown_format_is_refused(tmp_path):
+    with pytest.raises(ValueError): ShardWriter(str(tmp_path), 'xlsx')
+
+
+def test_address_id_blocks_are_disjoint_and_bounded():
+    low, high = gd.NUM_ADDRESSES_PER_CUSTOMER
+    blocks = [address_ids_for(customer_id, 12345) for customer_id in range(1, 5001)]
+    assert all(low <= len(b) <= high for b in blocks)
+    assert all(b.start == (customer_id - 1) * high + 1 for customer_id, b in enumerate(blocks, start=1))
+    assert len({a for b in blocks for a in b}) == sum(len(b) for b in blocks)
+    assert {len(b) for b in blocks} == set(range(low, high + 1))
+    assert address_ids_for(77, 12345) == address_ids_for(77, 12345)
+
+
+def test_arrival_times_ascend_within_the_order_window():
+    times = [arrival_time(i, 1000) for i in range(1, 1001)]
+    assert times == sorted(times)
+    assert times[0].date() >= gd.ORDER_START_DATE and times[-1].date() <= gd.ORDER_END_DATE
+
+
+def test_buffered_rows_stay_under_the_cap(tmp_path):
+    writer = ShardWriter(str(tmp_path), 'csv', shard_rows=50, max_buffered_rows=120)
+    peak = 0
+    for n in range(1, 1001):
+        month = datetime.datetime(2025, 1 + n % 12, 1)
+        writer.add('customers', (n, 'A', 'B', f"{n}@example.com", '+2120001', month.date()), month)
+        peak = max(peak, writer.buffered_rows)
+    manifest = writer.close()
+    assert peak <= 120 and writer.buffered_rows == 0
+    assert manifest['row_counts']['customers'] == 1000
+    assert all(f['rows'] <= 50 for f in manifest['files']['customers'])
+
+
+def test_export_scales_with_explicit_counts(tmp_path):
+    writer = ShardWriter(str(tmp_path), 'csv', shard_rows=SHARD_ROWS)
+    export_dataset(writer, num_customers=40, num_orders=300, num_sessions=120); writer.close()
+    frames = load_dataset(str(tmp_path))
+    assert (len(frames['customers']), len(frames['orders']), len(frames['web_sessions'])) == (40, 300, 120)
+    assert frames['orders'].sort_values('order_id')['order_date'].is_monotonic_increasing # ids follow time (BRIN)
+    assert set(frames['web_sessions']['customer_id'].dropna()) <= set(range(1, 41))
+
+
+def test_column_kinds_survive_the_round_trip(exported):
+    _, _, frames = exported
+    orders, sessions = frames['orders'], frames['web_sessions']
+    assert str(orders['promo_id'].dtype) == 'Int64' and orders['promo_id'].isna().any() # ids stay integers next to NULLs
+    assert str(sessions['customer_id'].dtype) == 'Int64'
+    assert str(frames['addresses']['is_default'].dtype) == 'boolean'
+    assert isinstance(frames['customers']['signup_date'].iloc[0], datetime.date)
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_text_columns_keep_leading_zeros(tmp_path, fmt):
+    writer = ShardWriter(str(tmp_path), fmt, shard_rows=10)
+    writer.add('addresses', (1, 1, 'Home', '1 Rue A', 'Oran', '01234', 'Algeria', True))
+    writer.add('addresses', (2, 1, 'Work', '2 Rue B', 'Oran', '00017', 'Algeria', False))
+    writer.close()
+    addresses = load_dataset(str(tmp_path), ['addresses'])['addresses']
+    assert list(addresses['postal_code']) == ['01234', '00017']
+    assert list(addresses['is_default']) == [True, False]
+
+
+def test_importing_the_loader_builds_no_pools():
+    import subprocess, sys
+    code = "import sys, dataset_loader, generate_data; assert generate_data._pools is None and 'faker' not in sys.modules"
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(gd.__file__))
+
+
+@pytest.mark.parametrize('schema_file', ['cod_schema_setup.sql', 'cod_schema_partitioned.sql'])
+def test_order_ref_column_fits_large_order_ids(schema_file):
+    import re
+    with open(os.path.join(os.path.dirname(gd.__file__), schema_file), encoding='utf-8') as f:
+        width = int(re.search(r'^order_ref VARCHAR2?\((\d+)\)', f.read(), re.M).group(1))
+    assert len(f"COD-20251231-{10 ** 12}") <= width # the exporter's format, past a trillion orders
@@ -0,0 +1,70 @@
+import os
+
+import db_router
+from db_router import ReadRouter, session_options, max_lag_for_period, REPLICA_RECHECK_SECONDS
+
+
+class FakeClock:
+    def __init__(self): self.now = 1000.0
+    def __call__(self): return self.now
+
+
+def measured(router, name, lag=None, error=None, checked=1000.0):
+    replica = next(r for r in router.replicas if r.name == name)
+    replica.lag = lag; replica.error = error; replica.checked = checked
+
+
+def test_session_options_carry_intent_limits():
+    options = session_options('get_high_failure_products')
+    assert "-c statement_timeout=20000" in options and "-c work_mem=64MB" in options
+    assert "-c default_transaction_read_only=on" in options and options.endswith("application_name=insightflow:get_high_failure_products")
+    assert f"-c statement_timeout={db_router.DEFAULT_STATEMENT_TIMEOUT_MS}" in session_options('get_sales_summary')
+
+
+def test_closed_periods_tolerate_more_lag():
+    assert max_lag_for_period('last_month') == db_router.REPLICA_MAX_LAG_CLOSED_SECONDS
+    assert max_lag_for_period('last_7_days') == db_router.REPLICA_MAX_LAG_SECONDS
+    assert max_lag_for_period(None) == db_router.REPLICA_MAX_LAG_SECONDS
+
+
+def test_unmeasured_replicas_are_candidates_in_round_robin_order():
+    router = ReadRouter(['a', 'b', 'c'], clock=FakeClock())
+    turns = [[r.name for r in router._candidates(30, 1000.0)] for _ in range(4)]
+    assert turns == [['a', 'b', 'c'], ['b', 'c', 'a'], ['c', 'a', 'b'], ['a', 'b', 'c']]
+    assert ReadRouter([])._candidates(30, 1000.0) == []
+
+
+def test_candidates_follow_the_period_lag_limit():
+    router = ReadRouter(['fresh', 'lagging', 'down'], clock=FakeClock())
+    measured(router, 'fresh', lag=2.0); measured(router, 'lagging', lag=120.0); measured(router, 'down', error='timeout expired')
+    names = lambda max_lag: sorted(r.name for r in router._candidates(max_lag, 1001.0))
+    assert names(30) == ['fresh']
+    assert names(900) == ['fresh', 'lagging'] # closed periods may read the lagging replica
+    assert names(0) == []
+
+
+def test_skipped_replicas_are_rechecked_after_the_window():
+    router = ReadRouter(['lagging', 'down'], clock=FakeClock())
+    measured(router, 'lagging', lag=120.0); measured(router, 'down', error='connection refused')
+    assert router._candidates(30, 1000.0 + REPLICA_RECHECK_SECONDS - 0.1) == []
+    assert sorted(r.name for r in router._candidates(30, 1000.0 + REPLICA_RECHECK_SECONDS)) == ['down', 'lagging']
+
+
+# --- Against PostgreSQL (INSIGHTFLOW_TEST_PG=1) ---
+def test_connect_skips_unreachable_replicas_and_applies_intent_settings(scratch_db):
+    scratch_db()
+    primary = f"{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}"
+    router = ReadRouter(['127.0.0.1:1', primary], clock=FakeClock())
+    targets = []
+    for _ in range(2):
+        conn, target = router.connect('get_high_failure_products', {'period': 'last_7_days'}); targets.append(target)
+        with conn.cursor() as cur:
+            cur.execute("SHOW statement_timeout"); assert cur.fetchone()[0] == '20s'
+            cur.execute("SHOW transaction_read_only"); assert cur.fetchone()[0] == 'on'
+        conn.close()
+    # The primary is not in recovery, so as a "replica" it reports no lag; the dead one is skipped for the recheck window.
+    assert targets == [primary, primary]
+    snapshot = router.snapshot()
+    assert snapshot['replicas']['127.0.0.1:1']['error'] and snapshot['replicas'][primary]['lag_seconds'] == 0
+    assert snapshot['routed'] == {'primary': 0, '127.0.0.1:1': 0, primary: 2}
+    assert f'insightflow_db_routed_total{{target="{primary}"}} 2' in router.prometheus_text()
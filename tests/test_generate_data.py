@@ -0,0 +1,17 @@
+import generate_data as gd
+
+
+# --- Against PostgreSQL (INSIGHTFLOW_TEST_PG=1) ---
+def test_orders_ship_to_one_of_their_customers_addresses(scratch_db, monkeypatch):
+    conn = scratch_db('cod_schema_partitioned.sql')
+    for name, value in (('NUM_CUSTOMERS', 60), ('NUM_ORDERS', 300)): monkeypatch.setattr(gd, name, value)
+    with conn.cursor() as cur:
+        products = gd.insert_products(cur, gd.insert_categories(cur))
+        customers = gd.insert_customers(cur)
+        assert gd.insert_orders_and_items(cur, customers, products, gd.insert_promotions(cur)) == 300
+        cur.execute("""SELECT COUNT(*), COUNT(*) FILTER (WHERE a.customer_id = o.customer_id AND o.billing_address_id = o.shipping_address_id)
+                       FROM orders o JOIN addresses a ON a.address_id = o.shipping_address_id""")
+        assert cur.fetchone() == (300, 300)
+        # Customers with two addresses get orders shipped to either of them.
+        cur.execute("SELECT COUNT(*) FROM (SELECT customer_id FROM orders GROUP BY 1 HAVING COUNT(DISTINCT shipping_address_id) > 1) x")
+        assert cur.fetchone()[0] > 0
@@ -0,0 +1,124 @@
+import os
+import pytest
+
+import index_advisor
+from index_advisor import advise_database, summarize_plan, find_regressions, pack_index_names, apply_index_pack, INDEX_PACK_FILE, INTENT_PROBES
+
+
+def scan(node_type, relation, index=None, loops=1, **extra):
+    node = {'Node Type': node_type, 'Relation Name': relation, 'Actual Loops': loops, **extra}
+    if index: node['Index Name'] = index
+    return node
+
+def explain(*children, hit=10, read=2):
+    return {'Plan': {'Node Type': 'Append', 'Shared Hit Blocks': hit, 'Shared Read Blocks': read, 'Plans': list(children)},
+            'Planning Time': 0.5, 'Execution Time': 3.25}
+
+def report_row(intent='get_delivered_revenue', plan='Seq Scan orders', hit=1000, ms=10.0):
+    return {'intent': intent, 'context': {'period': 'last_month'}, 'plan': plan, 'shared_hit': hit, 'shared_read': 0, 'execution_ms': ms}
+
+def reports(row):
+    return [{'database': 'db', 'variants': {'current': [row]}}]
+
+
+def test_partition_suffixes_are_collapsed():
+    summary = summarize_plan(explain(scan('Seq Scan', 'orders_p2025_01'), scan('Seq Scan', 'orders_p2025_02'),
+                                     scan('Index Only Scan', 'orders_p2025_02', 'orders_p2025_02_order_date_idx')))
+    assert summary['scans'] == ['Index Only Scan orders_order_date_idx', 'Seq Scan orders x2']
+    assert (summary['shared_hit'], summary['shared_read'], summary['planning_ms'], summary['execution_ms']) == (10, 2, 0.5, 3.25)
+
+
+def test_pruned_and_non_scan_nodes_are_left_out():
+    summary = summarize_plan(explain(scan('Seq Scan', 'orders_p2025_01', loops=0), scan('Hash', 'orders'), scan('Bitmap Heap Scan', 'addresses')))
+    assert summary['scans'] == ['Bitmap Heap Scan addresses']
+
+
+def test_unchanged_run_has_no_regressions():
+    assert find_regressions(reports(report_row()), reports(report_row(ms=12.0)), 0.25, 1.0) == []
+
+
+def test_buffer_growth_and_plan_change_are_regressions():
+    findings = find_regressions(reports(report_row(plan='Seq Scan orders x3', hit=2000)), reports(report_row()), 0.25, 1.0)
+    assert findings == ["db/current/get_delivered_revenue(last_month): buffers 1000 -> 2000",
+                        "db/current/get_delivered_revenue(last_month): plan changed 'Seq Scan orders' -> 'Seq Scan orders x3'"]
+
+
+def test_time_is_only_flagged_past_its_tolerance():
+    assert find_regressions(reports(report_row(ms=19.0)), reports(report_row()), 0.25, 1.0) == []
+    assert find_regressions(reports(report_row(ms=40.0)), reports(report_row()), 0.25, 1.0) == ["db/current/get_delivered_revenue(last_month): execution 10.0 -> 40.0 ms"]
+
+
+def test_pack_index_names_cover_every_index_in_the_pack():
+    with open(INDEX_PACK_FILE) as f: statements = f.read().count('CREATE INDEX')
+    names = pack_index_names()
+    assert len(names) == statements and len(set(names)) == len(names)
+
+
+def test_pack_installs_on_the_partitioned_schema(scratch_db):
+    conn = scratch_db('cod_schema_partitioned.sql')
+    apply_index_pack(conn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")
+        installed = {row[0] for row in cur.fetchall()}
+    assert set(pack_index_names()) <= installed
+    assert 'idx_orders_order_date' not in installed # replaced by the covering idx_orders_date_status
+
+
+def test_every_data_intent_is_probed():
+    from load_harness import SYNTHETIC_QUERIES
+    from InsightFlow import CHEAP_INTENTS
+    assert set(SYNTHETIC_QUERIES) - set(CHEAP_INTENTS) <= {intent for intent, _ in INTENT_PROBES}
+
+
+@pytest.fixture
+def advised_db(scratch_db):
+    from dataset_export import export_dataset
+    from dataset_loader import PostgresCopyWriter
+    conn = scratch_db('cod_schema_partitioned.sql')
+    writer = PostgresCopyWriter(5000)
+    export_dataset(writer, num_customers=40, num_orders=400, num_sessions=100)
+    writer.close()
+    apply_index_pack(conn)
+    return conn
+
+
+def test_live_databases_are_not_compared_without_the_pack(advised_db, monkeypatch):
+    monkeypatch.setattr(index_advisor, 'INTENT_PROBES', [('get_delivered_revenue', {'period': 'last_90_days'})])
+    report = advise_database(os.environ['DB_NAME'], repeat=1)
+    assert list(report['variants']) == ['current'] and report['index_pack'] == len(pack_index_names())
+
+
+def test_without_pack_variant_stops_at_the_first_failing_probe(advised_db, monkeypatch):
+    probes = [('get_delivered_revenue', {'period': 'last_90_days'}), ('no_such_intent', {}), ('get_gross_profit', {'period': 'last_90_days'})]
+    monkeypatch.setattr(index_advisor, 'INTENT_PROBES', probes)
+    report = advise_database(os.environ['DB_NAME'], repeat=1, compare=True)
+    assert [r['intent'] for r in report['variants']['current']] == [intent for intent, _ in probes] # current keeps going
+    assert 'without_pack' not in report['variants']
+    with advised_db.cursor() as cur:
+        cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")
+        assert set(pack_index_names()) <= {row[0] for row in cur.fetchall()} # rolled back
+
+
+def test_probes_needing_missing_tables_are_skipped(advised_db, monkeypatch):
+    probes = [('get_channel_performance', {'dimension': 'channel', 'period': 'last_month'}), ('get_delivered_revenue', {'period': 'last_90_days'})]
+    monkeypatch.setattr(index_advisor, 'INTENT_PROBES', probes)
+    report = advise_database(os.environ['DB_NAME'], repeat=1, compare=True) # advised_db has no order_attribution
+    assert [r['intent'] for r in report['variants']['without_pack']] == ['get_delivered_revenue']
+
+
+def test_scaled_databases_can_probe_every_intent(advised_db):
+    dbname = f"{os.environ['DB_NAME']}_adv"
+    try:
+        index_advisor.build_scaled_database(dbname, 300, os.path.join(os.path.dirname(INDEX_PACK_FILE), 'cod_schema_partitioned.sql'), False)
+        report = advise_database(dbname, repeat=1)
+        rows = report['variants']['current']
+        assert [r['intent'] for r in rows] == [intent for intent, _ in INTENT_PROBES]
+        assert all(r['plan'] for r in rows) and 'order_attribution' in rows[-1]['plan'] # no probe failed
+        conn = index_advisor.get_db_connection(dbname)
+        with conn.cursor() as cur: cur.execute("SELECT (SELECT COUNT(*) FROM order_attribution), (SELECT COUNT(*) FROM orders)"); attributed, orders = cur.fetchone()
+        conn.close()
+        assert attributed == orders == 300
+    finally:
+        admin = index_advisor.get_db_connection('postgres'); admin.autocommit = True
+        with admin.cursor() as cur: cur.execute(f'DROP DATABASE IF EXISTS "{dbname}" WITH (FORCE)')
+        admin.close()
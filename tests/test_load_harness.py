@@ -0,0 +1,59 @@
+import pytest
+
+from load_harness import synthetic_traffic, parse_mix, percentile, summarize_group, summarize, find_regressions, check_mix, SYNTHETIC_QUERIES
+
+
+def result(intent, outcome='ok', latency_ms=100.0, status=200):
+    return {'intent': intent, 'status': status, 'outcome': outcome, 'latency_ms': latency_ms}
+
+
+def test_synthetic_traffic_is_reproducible():
+    mix = {'get_gross_profit': 3, 'get_help': 1}
+    traffic = synthetic_traffic(mix, 200, clients=5, rate=50, seed=7)
+    assert traffic == synthetic_traffic(mix, 200, clients=5, rate=50, seed=7)
+    assert {t['intent'] for t in traffic} == set(mix) and {t['client_id'] for t in traffic} <= {f"load-{n}" for n in range(5)}
+    assert [t['ts'] for t in traffic] == sorted(t['ts'] for t in traffic) and traffic[-1]['ts'] > 0
+    assert all(t['ts'] == 0.0 for t in synthetic_traffic(mix, 20, clients=1, rate=0, seed=7))
+
+
+def test_synthetic_queries_map_back_to_their_intent():
+    assert check_mix() == []
+
+
+def test_parse_mix():
+    assert parse_mix('') == {intent: 1.0 for intent in SYNTHETIC_QUERIES}
+    assert parse_mix('get_gross_profit=3,get_help') == {'get_gross_profit': 3.0, 'get_help': 1.0}
+    with pytest.raises(SystemExit): parse_mix('get_everything=1')
+
+
+def test_percentile_uses_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert (percentile(values, 50), percentile(values, 95), percentile(values, 100)) == (51.0, 95.0, 100.0)
+    assert percentile([], 50) is None and percentile([7.0], 99) == 7.0
+
+
+def test_summarize_group_excludes_shed_and_failed_latencies():
+    group = summarize_group([result('x', latency_ms=10), result('x', latency_ms=30), result('x', 'shed', 1, 429), result('x', 'error', 5000, 500)])
+    assert (group['requests'], group['ok'], group['shed'], group['errors']) == (4, 2, 1, 1)
+    assert (group['shed_rate'], group['error_rate'], group['max_ms']) == (0.25, 0.25, 30.0)
+    assert summarize_group([])['p50_ms'] is None
+
+
+def test_summarize_reports_per_intent_and_server_deltas():
+    results = [result('get_gross_profit'), result('get_gross_profit', 'shed', 1, 429), result('get_help', latency_ms=5)]
+    before = {'insightflow_answer_cache_total{result="hit"}': 10, 'insightflow_answer_cache_total{result="miss"}': 10,
+              'insightflow_chat_shed_total{reason="rate_limited"}': 2}
+    after = {'insightflow_answer_cache_total{result="hit"}': 13, 'insightflow_answer_cache_total{result="miss"}': 11,
+             'insightflow_chat_shed_total{reason="rate_limited"}': 3, 'insightflow_narrative_llm_calls_total{kind="batch"}': 4}
+    report = summarize(results, 1.5, before, after)
+    assert report['throughput_rps'] == 2.0 and report['statuses'] == {'200': 2, '429': 1}
+    assert list(report['intents']) == ['get_gross_profit', 'get_help'] and report['intents']['get_gross_profit']['shed'] == 1
+    assert report['server'] == {'cache_hit_ratio': 0.75, 'shed': {'rate_limited': 1}, 'narrative_llm_calls': {'batch': 4}}
+    assert summarize(results, 1.5, {}, {})['server'] is None # server unreachable
+
+
+def test_find_regressions_needs_both_relative_and_absolute_growth():
+    base = {'intents': {'a': {'p95_ms': 100.0, 'error_rate': 0.0}, 'b': {'p95_ms': 1000.0, 'error_rate': 0.01}, 'gone': {'p95_ms': 1.0, 'error_rate': 0.0}}}
+    report = {'intents': {'a': {'p95_ms': 140.0, 'error_rate': 0.0}, 'b': {'p95_ms': 1300.0, 'error_rate': 0.05}}}
+    assert find_regressions(report, base, tolerance=0.2, max_error_increase=0.02, min_delta_ms=50) == ["b: p95 1000 -> 1300 ms", "b: error rate 1.0% -> 5.0%"]
+    assert find_regressions(report, base, tolerance=0.2, max_error_increase=0.02, min_delta_ms=25)[0] == "a: p95 100 -> 140 ms"
@@ -0,0 +1,107 @@
+import pytest
+
+import InsightFlow
+from InsightFlow import fetch_data_for_intent
+
+# Orders whose fact row is missing or disagrees with the base tables.
+FACTS_MISMATCHES = """
+SELECT COUNT(*) FROM public.orders o
+LEFT JOIN public.order_facts f USING (order_id)
+LEFT JOIN (SELECT order_id, COUNT(*) AS item_count, SUM(quantity) AS units, SUM(COALESCE(cost_per_unit, 0) * quantity) AS cogs
+           FROM public.order_items GROUP BY order_id) i USING (order_id)
+WHERE f.order_id IS NULL OR f.order_status <> o.order_status OR f.order_total IS DISTINCT FROM o.order_total
+   OR f.item_count <> COALESCE(i.item_count, 0) OR f.units <> COALESCE(i.units, 0) OR f.cogs <> COALESCE(i.cogs, 0)
+"""
+
+
+def mismatches(conn):
+    with conn.cursor() as cur: cur.execute(FACTS_MISMATCHES); return cur.fetchone()[0]
+
+def fact(conn, order_id, *columns):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT {', '.join(columns)} FROM public.order_facts WHERE order_id = %s", (order_id,))
+        return cur.fetchone()
+
+
+@pytest.fixture
+def facts_db(scratch_db):
+    from dataset_export import export_dataset
+    from dataset_loader import PostgresCopyWriter
+    conn = scratch_db('cod_schema_partitioned.sql', 'cod_order_facts.sql')
+    writer = PostgresCopyWriter(5000)
+    export_dataset(writer, num_customers=40, num_orders=400, num_sessions=50)
+    writer.close()
+    return conn
+
+
+def test_copy_load_is_mirrored_by_the_triggers(facts_db):
+    assert mismatches(facts_db) == 0
+    with facts_db.cursor() as cur:
+        cur.execute("SELECT (SELECT COUNT(*) FROM public.orders), (SELECT COUNT(*) FROM public.order_facts)")
+        assert cur.fetchone() == (400, 400)
+
+
+def test_status_and_item_changes_refresh_the_fact_row(facts_db):
+    with facts_db.cursor() as cur:
+        cur.execute("SELECT order_id FROM public.order_items GROUP BY order_id HAVING COUNT(*) > 1 LIMIT 1"); order_id = cur.fetchone()[0]
+        items_before, = fact(facts_db, order_id, 'item_count')
+        cur.execute("UPDATE public.orders SET order_status = 'Refused Delivery' WHERE order_id = %s", (order_id,))
+        cur.execute("DELETE FROM public.order_items WHERE order_item_id = (SELECT MIN(order_item_id) FROM public.order_items WHERE order_id = %s)", (order_id,))
+    facts_db.commit()
+    assert fact(facts_db, order_id, 'order_status', 'is_failed', 'item_count') == ('Refused Delivery', True, items_before - 1)
+    assert mismatches(facts_db) == 0
+
+
+def test_geography_is_a_snapshot_until_the_address_changes(facts_db):
+    with facts_db.cursor() as cur:
+        cur.execute("SELECT order_id, shipping_address_id FROM public.orders LIMIT 1"); order_id, address_id = cur.fetchone()
+        city, = fact(facts_db, order_id, 'shipping_city')
+        cur.execute("UPDATE public.addresses SET city = 'Renamed' WHERE address_id = %s", (address_id,))
+        cur.execute("UPDATE public.orders SET order_status = order_status WHERE order_id = %s", (order_id,))
+        facts_db.commit()
+        assert fact(facts_db, order_id, 'shipping_city') == (city,)
+        cur.execute("""INSERT INTO public.addresses (customer_id, address_type, street_address, city, postal_code, country, is_default)
+                       SELECT customer_id, 'Shipping', '1 Rue Test', 'Moved', '16000', 'Algeria', false FROM public.orders WHERE order_id = %s
+                       RETURNING address_id""", (order_id,)); new_address = cur.fetchone()[0]
+        cur.execute("UPDATE public.orders SET shipping_address_id = %s WHERE order_id = %s", (new_address, order_id))
+    facts_db.commit()
+    assert fact(facts_db, order_id, 'shipping_city', 'shipping_country') == ('Moved', 'Algeria')
+
+
+def test_refresh_restores_missing_rows(facts_db):
+    with facts_db.cursor() as cur:
+        cur.execute("DELETE FROM public.order_facts WHERE order_id IN (SELECT order_id FROM public.orders ORDER BY order_id LIMIT 10)")
+        cur.execute("SELECT refresh_order_facts('infinity')")
+        assert cur.fetchone()[0] == 10
+    assert mismatches(facts_db) == 0
+
+
+@pytest.mark.parametrize('intent, context', [
+    ('compare_failure_rate_geo', {'countries': ['Algeria', 'Egypt'], 'period': 'last_90_days'}),
+    ('get_cancellation_reasons', {'period': 'last_90_days', 'top_n': 100}), # every reason: ties would make LIMIT pick arbitrarily
+    ('explain_sales_funnel', {'period': 'last_90_days'}),
+])
+def test_fact_queries_match_the_join_queries(facts_db, monkeypatch, intent, context):
+    monkeypatch.setattr(InsightFlow, 'ORDER_FACTS', False); joined = fetch_data_for_intent(intent, dict(context), facts_db)
+    monkeypatch.setattr(InsightFlow, 'ORDER_FACTS', True); facts = fetch_data_for_intent(intent, dict(context), facts_db)
+    if intent == 'get_cancellation_reasons': facts, joined = (sorted(tuple(r.values()) for r in rows) for rows in (facts, joined))
+    assert facts == joined and not (isinstance(facts, dict) and 'error' in facts)
+
+
+def test_city_improvement_matches_the_join_query(facts_db, monkeypatch):
+    with facts_db.cursor() as cur:
+        cur.execute("SELECT a.city FROM public.orders o JOIN public.addresses a ON a.address_id = o.shipping_address_id GROUP BY a.city ORDER BY COUNT(*) DESC LIMIT 1")
+        context = {'city': cur.fetchone()[0], 'period': 'last_90_days'}
+    monkeypatch.setattr(InsightFlow, 'ORDER_FACTS', False); joined = fetch_data_for_intent('suggest_improvement_for_high_failure_city', dict(context), facts_db)
+    monkeypatch.setattr(InsightFlow, 'ORDER_FACTS', True); facts = fetch_data_for_intent('suggest_improvement_for_high_failure_city', dict(context), facts_db)
+    assert facts == joined and facts['total_orders'] > 0
+
+
+def test_parallel_shard_load_leaves_no_partial_facts(scratch_db, tmp_path):
+    from dataset_export import ShardWriter, export_dataset
+    from dataset_loader import load_into_postgres
+    writer = ShardWriter(str(tmp_path), 'csv', shard_rows=7) # many item shards split an order's items
+    export_dataset(writer, num_customers=40, num_orders=400, num_sessions=50); writer.close()
+    conn = scratch_db('cod_schema_partitioned.sql', 'cod_order_facts.sql')
+    load_into_postgres(str(tmp_path), workers=8)
+    assert mismatches(conn) == 0
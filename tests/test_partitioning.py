@@ -0,0 +1,134 @@
+import os
+import sys
+import gzip
+import subprocess
+import datetime
+import pytest
+
+import InsightFlow
+from InsightFlow import get_date_filter, get_period_bounds, order_items_join, MAX_FULFILMENT_DAYS
+from partition_maintenance import add_months, list_partitions, missing_partitions, ensure_partitions, retire_old_partitions, explain_period_filters, PERIOD_KEYS
+
+CLOSED_WINDOWS = {'last_month', 'last_quarter', 'this_month_mtd', 'last_7_days', 'year_to_date'}
+
+
+def test_add_months_wraps_years():
+    assert add_months(datetime.date(2025, 11, 1), 3) == datetime.date(2026, 2, 1)
+    assert add_months(datetime.date(2025, 1, 1), -13) == datetime.date(2023, 12, 1)
+    assert add_months(datetime.date(2025, 6, 1), 0) == datetime.date(2025, 6, 1)
+
+
+@pytest.mark.parametrize('period', PERIOD_KEYS)
+def test_date_filter_bounds_the_date_column(period):
+    lower, upper = get_period_bounds(period)
+    assert (upper is not None) == (period in CLOSED_WINDOWS)
+    expected = f"AND o.order_date >= {lower}" + (f" AND o.order_date < {upper}" if upper else "")
+    assert get_date_filter(period) == expected
+
+
+@pytest.mark.parametrize('period', PERIOD_KEYS)
+def test_partition_column_gets_a_fulfilment_bounded_range(period):
+    lower, upper = get_period_bounds(period)
+    date_filter = get_date_filter(period, 'o.delivered_at', 'o.order_date')
+    assert date_filter.startswith(f"AND o.delivered_at >= {lower}")
+    assert f"AND o.order_date >= ({lower}) - INTERVAL '{MAX_FULFILMENT_DAYS} days'" in date_filter
+    assert (f"AND o.order_date < {upper}" in date_filter) == (upper is not None)
+
+
+def test_items_join_on_the_partition_key_only_when_partitioned(monkeypatch):
+    monkeypatch.setattr(InsightFlow, 'PARTITIONED_SCHEMA', False)
+    assert order_items_join() == "oi.order_id = o.order_id"
+    monkeypatch.setattr(InsightFlow, 'PARTITIONED_SCHEMA', True)
+    assert order_items_join('i', 'x') == "i.order_id = x.order_id AND i.order_date = x.order_date"
+
+
+# --- Against PostgreSQL (INSIGHTFLOW_TEST_PG=1) ---
+@pytest.fixture
+def partitioned_db(scratch_db):
+    from dataset_export import export_dataset
+    from dataset_loader import PostgresCopyWriter
+    conn = scratch_db('cod_schema_partitioned.sql')
+    writer = PostgresCopyWriter(5000)
+    export_dataset(writer, num_customers=40, num_orders=400, num_sessions=100)
+    writer.close()
+    return conn
+
+
+def test_period_bounds_are_month_aligned(partitioned_db):
+    with partitioned_db.cursor() as cur:
+        for period in ('last_month', 'last_quarter'):
+            lower, upper = get_period_bounds(period)
+            cur.execute(f"SELECT ({lower})::date, ({upper})::date, DATE_TRUNC('month', CURRENT_DATE)::date")
+            start, end, this_month = cur.fetchone()
+            assert start.day == 1 and end.day == 1 and start < end <= this_month
+
+
+def test_period_filters_prune_partitions(partitioned_db):
+    with partitioned_db.cursor() as cur:
+        partitions = len(list_partitions(cur, 'orders'))
+        report = {(r['period'], r['filter_on']): r for r in explain_period_filters(cur)}
+    assert report[('last_month', 'order_date')]['relations_scanned'] == 1
+    assert report[('this_month_mtd', 'order_date')]['relations_scanned'] == 1
+    assert report[('last_month', 'delivered_at')]['relations_scanned'] <= 3
+    assert all(r['relations_scanned'] < partitions for r in report.values())
+
+
+def test_dry_run_retires_nothing(partitioned_db):
+    with partitioned_db.cursor() as cur:
+        before = list_partitions(cur, 'orders')
+        retired = retire_old_partitions(cur, 2, dry_run=True)
+        assert retired and list_partitions(cur, 'orders') == before
+
+
+def test_missing_partitions_lists_what_ensure_creates(partitioned_db):
+    this_month = datetime.date.today().replace(day=1)
+    end = add_months(this_month, 30)
+    with partitioned_db.cursor() as cur:
+        missing = missing_partitions(cur, this_month, end)
+        assert missing and missing_partitions(cur, this_month, end) == missing # listing creates nothing
+        assert ensure_partitions(cur, this_month, end) == len(missing)
+        assert missing_partitions(cur, this_month, end) == []
+
+
+def test_dry_run_command_changes_nothing(partitioned_db):
+    def snapshot():
+        with partitioned_db.cursor() as cur: state = {p: list_partitions(cur, p) for p in ('orders', 'order_items', 'web_sessions')}
+        partitioned_db.rollback(); return state
+    before = snapshot()
+    run = subprocess.run([sys.executable, 'partition_maintenance.py', '--ahead', '30', '--retain', '2', '--dry-run'],
+                         cwd=os.path.dirname(os.path.abspath(InsightFlow.__file__)), capture_output=True, text=True)
+    assert run.returncode == 0, run.stderr
+    assert '[dry-run] Would create orders_p' in run.stderr and '[dry-run] Would retire' in run.stderr
+    assert snapshot() == before
+
+
+def test_retired_partitions_move_to_the_archive_schema(partitioned_db):
+    cutoff = add_months(datetime.date.today().replace(day=1), -2)
+    with partitioned_db.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM public.orders"); total = cur.fetchone()[0]
+        retired = retire_old_partitions(cur, 2)
+        assert all(lower >= cutoff for _, lower in list_partitions(cur, 'orders'))
+        cur.execute("SELECT relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = 'archive'")
+        assert set(retired) <= {row[0] for row in cur.fetchall()}
+        archived = [name for name in retired if name.startswith('orders_')]
+        cur.execute("SELECT (SELECT COUNT(*) FROM public.orders) + " + " + ".join(f"(SELECT COUNT(*) FROM archive.{name})" for name in archived))
+        assert cur.fetchone()[0] == total
+        cur.execute("""SELECT COUNT(*) FROM pg_constraint con JOIN pg_class c ON c.oid = con.conrelid JOIN pg_namespace n ON n.oid = c.relnamespace
+                       JOIN pg_class ref ON ref.oid = con.confrelid WHERE n.nspname = 'archive' AND con.contype = 'f' AND ref.relkind = 'p'""")
+        assert cur.fetchone()[0] == 0 # archived items no longer reference the live orders table
+    partitioned_db.commit()
+
+
+def test_retired_partitions_can_be_exported_and_dropped(partitioned_db, tmp_path):
+    with partitioned_db.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM public.order_items"); total = cur.fetchone()[0]
+        retired = retire_old_partitions(cur, 2, export_dir=str(tmp_path))
+        cur.execute("SELECT COUNT(*) FROM public.order_items"); kept = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*) FROM pg_class WHERE relname = ANY(%s)", (retired,))
+        assert cur.fetchone()[0] == 0
+    exported = 0
+    for name in retired:
+        assert os.path.exists(tmp_path / f"{name}.csv.gz")
+        if name.startswith('order_items_'):
+            with gzip.open(tmp_path / f"{name}.csv.gz", 'rt') as f: exported += sum(1 for _ in f) - 1
+    assert kept + exported == total
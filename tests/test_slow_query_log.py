@@ -0,0 +1,86 @@
+import json
+import pytest
+import psycopg2
+import psycopg2.errors
+
+import slow_query_log
+from slow_query_log import SlowQueryRecorder, threshold_ms
+
+
+class FakeCursor:
+    def __init__(self, intent, target='primary', rowcount=3): self.intent = intent; self.target = target; self.rowcount = rowcount
+
+
+def recorder(**kwargs):
+    kwargs.setdefault('log_file', None); kwargs.setdefault('explain_sample', 0)
+    return SlowQueryRecorder(connect_for=None, **kwargs)
+
+
+def test_threshold_prefers_env_then_intent_then_default(monkeypatch):
+    assert threshold_ms('get_high_failure_products') == 2000
+    assert threshold_ms('get_sales_summary') == slow_query_log.SLOW_QUERY_MS
+    monkeypatch.setenv('SLOW_QUERY_MS_GET_HIGH_FAILURE_PRODUCTS', '250')
+    assert threshold_ms('get_high_failure_products') == 250
+
+
+def test_only_queries_at_or_over_the_threshold_are_recorded():
+    rec = recorder()
+    rec.observe(FakeCursor('get_gross_profit'), "SELECT 1", None, 1499.9)
+    assert rec.snapshot() == []
+    rec.observe(FakeCursor('get_gross_profit', 'replica-1:5432', 12), "SELECT  sum(x)\n  FROM t WHERE d >= %s", ('2025-01-01',), 1500.0)
+    [record] = rec.snapshot()
+    assert (record['intent'], record['target'], record['rows'], record['threshold_ms']) == ('get_gross_profit', 'replica-1:5432', 12, 1500)
+    assert record['sql'] == "SELECT sum(x) FROM t WHERE d >= %s" and record['params'] == ['2025-01-01']
+    assert 'plan' not in record and record['plan_summary'] is None
+    assert 'insightflow_slow_queries_total{intent="get_gross_profit"} 1' in rec.prometheus_text()
+
+
+def test_ring_buffer_keeps_the_newest_records_first():
+    rec = recorder(buffer_size=3)
+    for n in range(5): rec.observe(FakeCursor('get_sales_summary' if n % 2 else 'get_top_products'), f"SELECT {n}", None, 10000.0)
+    assert [r['sql'] for r in rec.snapshot()] == ["SELECT 4", "SELECT 3", "SELECT 2"]
+    assert [r['sql'] for r in rec.snapshot(intent='get_sales_summary')] == ["SELECT 3"]
+    assert len(rec.snapshot(limit=1)) == 1 and 'plan' in rec.snapshot(include_plans=True)[0]
+    assert rec.counts['get_top_products'] == 3 # counters are not bounded by the buffer
+
+
+def test_records_are_appended_to_the_jsonl_file(tmp_path):
+    log_file = tmp_path / 'slow.jsonl'
+    rec = recorder(log_file=str(log_file))
+    assert not log_file.exists() # opened on the first slow query only
+    rec.observe(FakeCursor('get_sales_summary'), "SELECT 1", {'since': 7}, 9999.0)
+    rec.file_log.handlers[0].flush()
+    [line] = log_file.read_text(encoding='utf-8').splitlines()
+    assert json.loads(line)['params'] == {'since': 7}
+
+
+
+def test_cancelled_queries_are_recorded_with_their_error():
+    rec = recorder(explain_sample=1.0)
+    rec.observe(FakeCursor('get_gross_profit', rowcount=-1), "SELECT 1", None, 40.0, psycopg2.errors.QueryCanceled("canceling statement due to statement timeout\n"))
+    rec.observe(FakeCursor('get_gross_profit', rowcount=-1), "SELEC 1", None, 3.0, psycopg2.errors.SyntaxError("syntax error")) # fast failures are not slow queries
+    [record] = rec.snapshot()
+    assert (record['error_class'], record['error'], record['rows']) == ('QueryCanceled', "canceling statement due to statement timeout", None)
+    assert not rec.explaining and record['plan_summary'] is None # never re-run under EXPLAIN ANALYZE
+
+
+# --- Against PostgreSQL (INSIGHTFLOW_TEST_PG=1) ---
+def test_cursor_times_each_execute(scratch_db, monkeypatch):
+    conn = scratch_db()
+    monkeypatch.setenv('SLOW_QUERY_MS_GET_SALES_SUMMARY', '50')
+    rec = recorder()
+    with rec.cursor(conn, 'get_sales_summary', 'primary') as cur:
+        cur.execute("SELECT 1"); cur.execute("SELECT pg_sleep(0.1), %s", (5,))
+    [record] = rec.snapshot()
+    assert record['duration_ms'] >= 100 and record['params'] == [5] and record['rows'] == 1
+
+
+def test_cursor_records_queries_cancelled_by_statement_timeout(scratch_db):
+    conn = scratch_db()
+    rec = recorder()
+    with rec.cursor(conn, 'get_sales_summary', 'primary') as cur:
+        cur.execute("SET statement_timeout = 100")
+        with pytest.raises(psycopg2.extensions.QueryCanceledError): cur.execute("SELECT pg_sleep(5)")
+    conn.rollback()
+    [record] = rec.snapshot()
+    assert record['error_class'] == 'QueryCanceled' and 'statement timeout' in record['error'] and 100 <= record['duration_ms'] < 5000
@@ -0,0 +1,58 @@
+import math
+import pytest
+
+import value_pools
+from value_pools import _permute, ValuePools, PHONE_SPACE, IP_SPACE, SKU_SPACE
+
+SAMPLE = 200_000
+
+
+@pytest.fixture(scope='module')
+def pools():
+    return ValuePools(seed=42)
+
+
+@pytest.mark.parametrize('space, multiplier', [(1000, 7), (2 ** 10, 2654435761), (26 * 10, 1000003)])
+def test_permute_is_a_bijection(space, multiplier):
+    values = [_permute(n, space, multiplier, 17) for n in range(space)]
+    assert sorted(values) == list(range(space))
+
+
+@pytest.mark.parametrize('space, multiplier', [(PHONE_SPACE, 387420489), (IP_SPACE, 2654435761), (SKU_SPACE, 1000003), (10 ** 6, 7919)])
+def test_configured_multipliers_are_coprime(space, multiplier):
+    assert math.gcd(space, multiplier) == 1
+
+
+def test_emails_are_unique(pools):
+    emails = [pools.email() for _ in range(SAMPLE)]
+    assert len(set(emails)) == SAMPLE
+
+
+def test_phones_are_unique_and_well_formed(pools):
+    phones = [pools.phone() for _ in range(SAMPLE)]
+    assert len(set(phones)) == SAMPLE
+    assert all(p.startswith(tuple(value_pools.PHONE_PREFIXES)) and p[-9:].isdigit() for p in phones)
+
+
+def test_phone_digits_are_unique_across_prefixes(pools):
+    # The prefix rotates with the counter, so uniqueness must already hold on the 9 subscriber digits.
+    digits = [pools.phone()[-9:] for _ in range(SAMPLE)]
+    assert len(set(digits)) == SAMPLE
+
+
+def test_skus_are_unique_and_well_formed(pools):
+    skus = [pools.sku() for _ in range(SAMPLE)]
+    assert len(set(skus)) == SAMPLE
+    assert all(len(s) == len('SKU-ABC-12345') and s[4:7].isalpha() and s[8:].isdigit() for s in skus)
+
+
+def test_sku_space_is_exhaustible(pools):
+    pools._counters['sku'] = SKU_SPACE
+    with pytest.raises(OverflowError):
+        pools.sku()
+
+
+def test_same_seed_gives_same_values():
+    a, b = ValuePools(seed=7), ValuePools(seed=7)
+    assert [a.phone() for _ in range(50)] == [b.phone() for _ in range(50)]
+    assert [a.sku() for _ in range(50)] == [b.sku() for _ in range(50)]
@@ -0,0 +1,140 @@
+import random
+import logging
+
+# --- Locale Mix (same split generate_data.py always produced) ---
+# fr_FR by default, ar_SA for ~20% of customers, en_US for ~10% of the remainder.
+LOCALE_WEIGHTS = [('fr_FR', 0.72), ('ar_SA', 0.20), ('en_US', 0.08)]
+
+NAME_POOL_SIZE = 1500
+STREET_POOL_SIZE = 4000
+POSTCODE_POOL_SIZE = 2000
+USER_AGENT_POOL_SIZE = 600
+CAMPAIGN_POOL_SIZE = 120
+EMAIL_LOCAL_POOL_SIZE = 3000
+
+# Country calling codes for the markets we sell into (matches NA_LOCATIONS order).
+PHONE_PREFIXES = ['+213', '+212', '+216', '+218', '+20']
+
+PHONE_SPACE = 10 ** 9           # 9 subscriber digits after the country code
+IP_SPACE = 2 ** 32
+SKU_SPACE = 26 ** 3 * 10 ** 5   # 'SKU-???-#####'
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def _build_faker():
+    from faker import Faker # imported here: Faker is slow to import and only needed while pools are built
+    try:
+        fake = Faker(['fr_FR', 'ar_SA', 'en_US'])
+        fake.name()
+        return fake, LOCALE_WEIGHTS
+    except (ImportError, AttributeError):
+        logging.warning("Could not initialize Faker with 'ar_SA', falling back to fr_FR and en_US.")
+        return Faker(['fr_FR', 'en_US']), [('fr_FR', 0.90), ('en_US', 0.10)]
+
+
+def _permute(n, space, multiplier, offset):
+    """Bijective scramble of a counter inside [0, space): multiplier must be coprime with space."""
+    return (n * multiplier + offset) % space
+
+
+class ValuePools:
+    """
+    Precomputed value sources for the data generator.
+
+    Faker is only called while the pools are built (once per run); every row afterwards is a
+    list lookup. Values that must be unique (emails, phones, SKUs, IPs, promo codes) are derived
+    from per-kind counters pushed through a seeded bijection, so they never collide and never
+    need a retry-until-unique loop or a growing `fake.unique` set.
+    """
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.fake, self.locale_weights = _build_faker()
+        if seed is not None: self.fake.seed_instance(seed)
+        self.locales = [loc for loc, _ in self.locale_weights]
+        self.locale_cum_weights = []
+        running = 0.0
+        for _, weight in self.locale_weights:
+            running += weight; self.locale_cum_weights.append(running)
+
+        # Seeded offsets keep runs with different seeds from producing the same unique values.
+        self._offsets = {kind: self.rng.randrange(space) for kind, space in
+                         (('phone', PHONE_SPACE), ('ip', IP_SPACE), ('sku', SKU_SPACE), ('promo', 10 ** 6))}
+        self._counters = {'email': 0, 'phone': 0, 'ip': 0, 'sku': 0, 'promo': 0}
+
+        self._build_pools()
+
+    def _build_pools(self):
+        logging.info("Building value pools...")
+        self.first_names = {}; self.last_names = {}
+        for loc in self.locales:
+            proxy = self.fake[loc]
+            self.first_names[loc] = [proxy.first_name() for _ in range(NAME_POOL_SIZE)]
+            self.last_names[loc] = [proxy.last_name() for _ in range(NAME_POOL_SIZE)]
+        ascii_locales = [loc for loc in self.locales if loc != 'ar_SA']
+        self.email_locals = [self.fake[self.rng.choice(ascii_locales)].user_name() for _ in range(EMAIL_LOCAL_POOL_SIZE)]
+        self.email_domains = sorted({self.fake.free_email_domain() for _ in range(200)})
+        self.streets = [self.fake['fr_FR'].street_address() for _ in range(STREET_POOL_SIZE)]
+        self.postcodes = [self.fake.postcode() for _ in range(POSTCODE_POOL_SIZE)]
+        self.user_agents = [self.fake.user_agent() for _ in range(USER_AGENT_POOL_SIZE)]
+        self.campaigns = sorted({self.fake.slug() for _ in range(CAMPAIGN_POOL_SIZE)})
+        logging.info(f"Value pools ready: {sum(len(v) for v in self.first_names.values())} first names, "
+                     f"{len(self.streets)} streets, {len(self.user_agents)} user agents, {len(self.campaigns)} campaigns.")
+
+    # --- Pooled (non-unique) values ---
+    def locale(self):
+        return self.rng.choices(self.locales, cum_weights=self.locale_cum_weights, k=1)[0]
+
+    def person_name(self):
+        loc = self.locale()
+        return self.rng.choice(self.first_names[loc]), self.rng.choice(self.last_names[loc])
+
+    def street_address(self):
+        return self.rng.choice(self.streets)
+
+    def postcode(self):
+        return self.rng.choice(self.postcodes)
+
+    def user_agent(self):
+        return self.rng.choice(self.user_agents)
+
+    def referrer(self, sources):
+        # Same distribution as random.choice(sources + [None]*2) without building the list per row.
+        idx = self.rng.randrange(len(sources) + 2)
+        return sources[idx] if idx < len(sources) else None
+
+    def utm_campaign(self):
+        return self.rng.choice(self.campaigns)
+
+    # --- Synthesized unique values ---
+    def _next(self, kind):
+        n = self._counters[kind]; self._counters[kind] = n + 1
+        return n
+
+    def email(self):
+        n = self._next('email')
+        return f"{self.rng.choice(self.email_locals)}.{n:x}@{self.rng.choice(self.email_domains)}"
+
+    def phone(self):
+        n = self._next('phone')
+        if n >= PHONE_SPACE: raise OverflowError("Phone number space exhausted.")
+        digits = _permute(n, PHONE_SPACE, 387420489, self._offsets['phone'])  # 3**18, coprime with 10**9
+        return f"{PHONE_PREFIXES[n % len(PHONE_PREFIXES)]}{digits:09d}"
+
+    def ipv4(self):
+        n = self._next('ip')
+        value = _permute(n, IP_SPACE, 2654435761, self._offsets['ip'])  # odd, so coprime with 2**32
+        return f"{value >> 24 & 255}.{value >> 16 & 255}.{value >> 8 & 255}.{value & 255}"
+
+    def sku(self):
+        n = self._next('sku')
+        if n >= SKU_SPACE: raise OverflowError("SKU space exhausted.")
+        value = _permute(n, SKU_SPACE, 1000003, self._offsets['sku'])  # prime, not a factor of 26**3 * 10**5
+        letters, digits = divmod(value, 10 ** 5)
+        code = LETTERS[letters // 676] + LETTERS[letters // 26 % 26] + LETTERS[letters % 26]
+        return f"SKU-{code}-{digits:05d}"
+
+    def promo_code(self, prefixes=('SALE', 'GAMER', 'COD', 'NA')):
+        n = self._next('promo')
+        value = _permute(n, 10 ** 6, 7919, self._offsets['promo'])
+        return f"{self.rng.choice(prefixes)}{value:06d}"